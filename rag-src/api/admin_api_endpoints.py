@@ -1,40 +1,55 @@
 # administrative endpoints for the API
-from fastapi import APIRouter, HTTPException
+import itertools
+import json
+from typing import Any, Dict, Iterator, Optional
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import StreamingResponse
 
-from index_builder_and_retrieval_search_service.build_index import get_all_doc_parts_from_sqldb, get_all_docs_from_sqldb, get_all_parts_from_sqldb
+from index_builder_basics.document_storage_sql_database import iterate_documents_from_sqldb, iterate_plob_documents_from_sqldb, iterate_plobs_from_sqldb
 
 router = APIRouter()
 
+#
+# The tables are streamed as JSON lines (one row per line), read page by page from the SQL DB:
+# a table is never held in memory, not even for large databases.
+#
 
-@router.get("/admin/documents")
-async def get_documents():
+
+def stream_json_lines(rows: Iterator[Dict[str, Any]], limit: Optional[int]) -> StreamingResponse:
+    if limit is not None:
+        if limit < 0:
+            raise HTTPException(status_code=400, detail=f"Invalid limit: {limit}")
+        rows = itertools.islice(rows, limit)
+    # (a sync generator: iterated in a worker thread by the response)
+    body = (json.dumps(row, default=str) + "\n" for row in rows)
+    return StreamingResponse(body, media_type="application/x-ndjson")
+
+
+@router.get("/admin/plobs")
+async def get_plobs(
+    limit: Optional[int] = Query(None, description="Maximum number of rows to return"),
+) -> StreamingResponse:
     """"
-    Retrive all documents from database
+    Retrive all plobs (loaded documents/files) from database, as JSON lines
     """
-    try:
-        documents = get_all_docs_from_sqldb()
-        return {"documents": documents}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
-
-@router.get("/admin/parts")
-async def get_parts():
+    return stream_json_lines(iterate_plobs_from_sqldb(), limit)
+
+@router.get("/admin/documents")
+async def get_documents(
+    limit: Optional[int] = Query(None, description="Maximum number of rows to return"),
+    include_content: bool = Query(True, description="Include the texts"),
+    include_embedding: bool = Query(False, description="Include the embeddings (large)"),
+) -> StreamingResponse:
     """"
-    Retrive all parts from database
+    Retrive all documents (parts/texts with their embeddings) from database, as JSON lines
     """
-    try:
-        parts = get_all_parts_from_sqldb()
-        return {"parts": parts}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
-
-@router.get("/admin/doc-parts")
-async def get_doc_parts():
+    return stream_json_lines(iterate_documents_from_sqldb(include_content=include_content, include_embedding=include_embedding), limit)
+
+@router.get("/admin/plob-documents")
+async def get_plob_documents(
+    limit: Optional[int] = Query(None, description="Maximum number of rows to return"),
+) -> StreamingResponse:
     """"
-    Retrive all doc-parts from database
+    Retrive all connections between plobs and their documents from database, as JSON lines
     """
-    try:
-        doc_parts = get_all_doc_parts_from_sqldb()
-        return {"doc_parts": doc_parts}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    return stream_json_lines(iterate_plob_documents_from_sqldb(), limit)
@@ -1,10 +1,18 @@
-from fastapi import Query
+from fastapi import Query, Request, Response
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from typing import List, Optional
-from index_builder_and_retrieval_search_service.search_index import search
+from typing import Any, AsyncIterator, Awaitable, Dict, List, Optional, Tuple
+from index_builder_and_retrieval_search_service.search_index import search, search_stream, precalculate_query_embeddings
+from index_builder_and_retrieval_search_service.search_budget import SearchBudget, DEGRADED_ERROR, DEGRADED_LOAD_SHEDDING
+from common.service.admission_control import AdmissionRejected
+from index_builder_and_retrieval_search_service.document_retrieval import STAGE_FINAL
+from common.service.configloader import deep_get, settings
+from common.service.span_recorder import SpanRecorder, record_spans
+from common.service.metrics import Counter, Histogram
 from langchain_core.documents import Document
 from common.service.logging_tools import doc2str
 
+import asyncio
 import logging
 from fastapi import APIRouter, HTTPException
 import json
@@ -14,6 +22,18 @@ logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
+server_timing_header_enabled = deep_get(settings, "config.rag_response.search_server_timing_header", default_value=False)
+search_batch_max_queries = deep_get(settings, "config.rag_response.search_batch_max_queries", default_value=1000)
+search_batch_max_concurrency = deep_get(settings, "config.rag_response.search_batch_max_concurrency", default_value=8)
+# how often to check whether the client of a running search disconnected
+client_disconnect_poll_seconds = deep_get(settings, "config.rag_response.search_client_disconnect_poll_seconds", default_value=0.5)
+
+# Search metrics (for the /metrics endpoint)
+search_requests_counter = Counter("rag_search_requests_total", "Number of search requests per result (ok, degraded, skipped, rejected, cancelled)", ["result"])
+search_duration_histogram = Histogram("rag_search_duration_seconds", "Latency of search requests")
+search_stage_duration_histogram = Histogram("rag_search_stage_duration_seconds", "Latency of single stages (spans) of search requests", ["stage"])
+
+
 class SearchResult(BaseModel):
     title: Optional[str] = None
     content: str
@@ -32,13 +52,41 @@ class SearxNGResponse(BaseModel):
       # "total": 0.345,
       # "processing": 0.123,
       # "network": 0.222
+      # (not part of SearxNG) "stages": {"vector_search": {"count": 4, "total": 0.180, "max": 0.061}, ...}
+    # (not part of SearxNG) stages skipped or cut short because of the latency budget: stage -> reason
+    degraded_stages: Dict[str, str] = {}
+
+# Event of the streaming search (not part of SearxNG)
+class SearchStreamEvent(BaseModel):
+    query: str
+    # "raw", "expanded", "graded", "final" (or "error")
+    stage: str
+    final: bool
+    results: List[SearchResult]
+    # only in the final event
+    timing: Optional[dict] = None
+    degraded_stages: Optional[Dict[str, str]] = None
+
+# Batch search request (not part of SearxNG)
+class SearchBatchRequest(BaseModel):
+    queries: List[str]
+    max_results: Optional[int] = None
+    # latency budget in seconds per query, starting when its search starts (default: config.rag_response.search_timeout_seconds, 0 = unlimited)
+    timeout: Optional[float] = None
+
+# Batch search response (not part of SearxNG): one SearxNG response per query, in the order of the queries
+class SearchBatchResponse(BaseModel):
+    results: List[SearxNGResponse]
 
 
 @router.get("/search", response_model=SearxNGResponse)
 async def search_endpoint(
+    request: Request,
+    response: Response,
     q: str = Query(..., description="Search query"),
     max_results: Optional[int] = Query(None, description="Maximum number of results to return"),
-    engines: Optional[str] = Query(None, description="Search engines to use")
+    engines: Optional[str] = Query(None, description="Search engines to use"),
+    timeout: Optional[float] = Query(None, description="Latency budget in seconds (default: config.rag_response.search_timeout_seconds, 0 = unlimited)")
 ) -> SearxNGResponse:
     """
     Search endpoint implementing the SearxNG API protocol.
@@ -46,40 +94,223 @@ async def search_endpoint(
 
     logger.info( "=====")
     logger.info( "=====")
-    logger.info(f"===== API Received query (max_results={max_results}): '{q}'")
+    logger.info(f"===== API Received query (max_results={max_results}, timeout={timeout}): '{q}'")
 
     search_results = []
+    search_budget = SearchBudget(timeout)
+    span_recorder: Optional[SpanRecorder] = None
 
     # Skip searches for images or videos
     if engines:
         e = engines.lower()
         if "image" in e or "video" in e:
             logger.info(f"API Search query contains 'image' or 'video', skipping search. Engines: {engines}")
+            search_requests_counter.inc(result="skipped")
 
     else:
         # Perform the search using the imported search function
-        content_docs: List[Document] = await search(q, max_results)
-
-        # Check if response is None
-        if content_docs:
-            logger.info(f"API Response: found {len(content_docs)} documents for query '{q}':")
-            for idx, doc in enumerate(content_docs):
-                logger.info(f"    #{idx+1}: {doc2str(doc)} - page_content: {str_limit(doc.page_content, 10000)}")
-        else:
-            logger.info(f"API Response: no contents (documents) found for query '{q}'")
-
-        # Format results
-        for content_doc in content_docs:
-            # convert to SearchResult
-            searchResult = SearchResult(
-                title=content_doc.metadata.get("title", None),
-                content=content_doc.page_content,
-                url=content_doc.metadata.get("source", None),
-            )
-            search_results.append(searchResult)
+        try:
+            search_results, span_recorder = await run_until_client_disconnects(request, search_and_convert_results(q, max_results, search_budget))
+        except AdmissionRejected as e:
+            # Load shedding
+            search_requests_counter.inc(result="rejected")
+            raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+        except ClientDisconnected:
+            search_requests_counter.inc(result="cancelled")
+            raise HTTPException(status_code=499, detail="Client closed request")
+        if server_timing_header_enabled:
+            response.headers["Server-Timing"] = get_server_timing_header(span_recorder)
 
     # Create SearxNGResponse object
-    searxng_response = SearxNGResponse(
+    searxng_response = create_searxng_response(q, search_results, span_recorder, search_budget)
+
+    logger.debug( "=====")
+    logger.debug(f"===== SearxNG Response - {len(search_results)} results: {str_limit(str(searxng_response), 100)}")
+    logger.info(  "=====")
+    logger.info(  "=====")
+
+    return searxng_response
+
+
+@router.post("/search/batch", response_model=SearchBatchResponse)
+async def search_batch_endpoint(request: SearchBatchRequest, http_request: Request) -> SearchBatchResponse:
+    """
+    Search for multiple queries in one request.
+
+    The embeddings of all queries are calculated with a single call of the embedding model,
+    then the searches run concurrently (max. config.rag_response.search_batch_max_concurrency at once).
+    Each query gets its own latency budget (request.timeout), starting when its search starts -
+    queries waiting for a free slot don't use up their budget.
+    """
+    queries = request.queries
+    logger.info(f"===== API Received batch of {len(queries)} queries (max_results={request.max_results}, timeout={request.timeout})")
+    if len(queries) > search_batch_max_queries:
+        raise HTTPException(status_code=400, detail=f"Too many queries: {len(queries)} > {search_batch_max_queries}")
+
+    await precalculate_query_embeddings(queries)
+
+    # Concurrent searches
+    semaphore = asyncio.Semaphore(max(1, search_batch_max_concurrency))
+
+    async def search_single_query(q: str) -> SearxNGResponse:
+        async with semaphore:
+            # One budget per query, from now on
+            search_budget = SearchBudget(request.timeout)
+            try:
+                search_results, span_recorder = await search_and_convert_results(q, request.max_results, search_budget)
+            except AdmissionRejected as e:
+                # Load shedding - doesn't fail the complete batch
+                logger.warning(f"API Batch: query '{q}' rejected: {e}")
+                search_requests_counter.inc(result="rejected")
+                search_budget.mark_degraded("search", DEGRADED_LOAD_SHEDDING)
+                search_results, span_recorder = [], None
+            except Exception as e:
+                # A failed query doesn't fail the complete batch
+                logger.warning(f"API Batch: error while searching for query '{q}': {e}", exc_info=True)
+                search_budget.mark_degraded("search", DEGRADED_ERROR)
+                search_results, span_recorder = [], None
+        return create_searxng_response(q, search_results, span_recorder, search_budget)
+
+    try:
+        searxng_responses = await run_until_client_disconnects(http_request, asyncio.gather(*[
+            search_single_query(q) for q in queries
+        ]))
+    except ClientDisconnected:
+        search_requests_counter.inc(result="cancelled")
+        raise HTTPException(status_code=499, detail="Client closed request")
+
+    logger.info(f"===== API Batch of {len(queries)} queries done")
+    return SearchBatchResponse(results=searxng_responses)
+
+
+class ClientDisconnected(Exception):
+    """The client disconnected before the response was ready."""
+
+
+async def run_until_client_disconnects(request: Request, awaitable: Awaitable[Any]) -> Any:
+    """
+    Await the search in a separate task, and cancel it if the client disconnects in the meantime
+    (the LLM calls of the search are cancelled with it).
+
+    Raises:
+        ClientDisconnected: if the client disconnected
+    """
+    task = asyncio.ensure_future(awaitable)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=client_disconnect_poll_seconds)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                logger.info("API Search: client disconnected - cancel search")
+                raise ClientDisconnected()
+    finally:
+        if not task.done():
+            task.cancel()
+
+
+async def search_and_convert_results(q: str, max_results: Optional[int], search_budget: SearchBudget) -> Tuple[List[SearchResult], SpanRecorder]:
+    """Search for a query (with recording of timing spans and metrics) and convert the found documents to search results."""
+    with record_spans() as span_recorder:
+        content_docs: List[Document] = await search(q, max_results, search_budget)
+    logger.info(f"API Search timing: {span_recorder}")
+    observe_search_metrics(span_recorder, search_budget)
+
+    # Check if response is None
+    if content_docs:
+        logger.info(f"API Response: found {len(content_docs)} documents for query '{q}':")
+        for idx, doc in enumerate(content_docs):
+            logger.info(f"    #{idx+1}: {doc2str(doc)} - page_content: {str_limit(doc.page_content, 10000)}")
+    else:
+        logger.info(f"API Response: no contents (documents) found for query '{q}'")
+
+    return convert_documents_to_search_results(content_docs), span_recorder
+
+
+def convert_documents_to_search_results(content_docs: List[Document]) -> List[SearchResult]:
+    search_results: List[SearchResult] = []
+    for content_doc in content_docs:
+        # convert to SearchResult
+        searchResult = SearchResult(
+            title=content_doc.metadata.get("title", None),
+            content=content_doc.page_content,
+            url=content_doc.metadata.get("source", None),
+        )
+        search_results.append(searchResult)
+    return search_results
+
+
+@router.get("/search/stream")
+async def search_stream_endpoint(
+    q: str = Query(..., description="Search query"),
+    max_results: Optional[int] = Query(None, description="Maximum number of results to return"),
+    timeout: Optional[float] = Query(None, description="Latency budget in seconds (default: config.rag_response.search_timeout_seconds, 0 = unlimited)"),
+    format: str = Query("ndjson", description="'ndjson' (one JSON event per line) or 'sse' (Server-Sent Events)"),
+) -> StreamingResponse:
+    """
+    Streaming search (not part of SearxNG): emits the raw hybrid search hits immediately,
+    then the refined, re-ranked and merged results as the later stages finish.
+    Each event is a SearchStreamEvent, the last one has final=True.
+    """
+    if format not in ("ndjson", "sse"):
+        raise HTTPException(status_code=400, detail=f"Unsupported format: {format}")
+    logger.info(f"===== API Received streaming query (max_results={max_results}, timeout={timeout}, format={format}): '{q}'")
+
+    search_budget = SearchBudget(timeout)
+    events = stream_search_events(q, max_results, search_budget)
+    if format == "sse":
+        body = (f"event: {event.stage}\ndata: {event.model_dump_json()}\n\n" async for event in events)
+        return StreamingResponse(body, media_type="text/event-stream")
+    body = (event.model_dump_json() + "\n" async for event in events)
+    return StreamingResponse(body, media_type="application/x-ndjson")
+
+
+async def stream_search_events(q: str, max_results: Optional[int], search_budget: SearchBudget) -> AsyncIterator[SearchStreamEvent]:
+    """
+    Run the search in a separate task (with recording of timing spans and metrics)
+    and yield an event per finished stage. The search is cancelled if the client disconnects.
+    """
+    queue: asyncio.Queue[Optional[SearchStreamEvent]] = asyncio.Queue()
+
+    async def run_search() -> None:
+        try:
+            with record_spans() as span_recorder:
+                async for stage, docs in search_stream(q, max_results, search_budget):
+                    if stage != STAGE_FINAL:
+                        await queue.put(SearchStreamEvent(query=q, stage=stage, final=False, results=convert_documents_to_search_results(docs)))
+            logger.info(f"API Search timing: {span_recorder}")
+            observe_search_metrics(span_recorder, search_budget)
+            await queue.put(SearchStreamEvent(query=q, stage=stage, final=True, results=convert_documents_to_search_results(docs),
+                                              timing=get_timing(span_recorder), degraded_stages=search_budget.degraded_stages))
+        except AdmissionRejected as e:
+            # Load shedding
+            logger.warning(f"API Streaming search: query '{q}' rejected: {e}")
+            search_requests_counter.inc(result="rejected")
+            search_budget.mark_degraded("search", DEGRADED_LOAD_SHEDDING)
+            await queue.put(SearchStreamEvent(query=q, stage="error", final=True, results=[], degraded_stages=search_budget.degraded_stages))
+        except Exception as e:
+            logger.warning(f"API Streaming search: error while searching for query '{q}': {e}", exc_info=True)
+            search_budget.mark_degraded("search", DEGRADED_ERROR)
+            await queue.put(SearchStreamEvent(query=q, stage="error", final=True, results=[], degraded_stages=search_budget.degraded_stages))
+        finally:
+            queue.put_nowait(None)
+
+    search_task = asyncio.create_task(run_search())
+    try:
+        while True:
+            event = await queue.get()
+            if event is None:
+                break
+            yield event
+    finally:
+        # e.g. client disconnected
+        if not search_task.done():
+            logger.info(f"API Streaming search: cancelled for query '{q}'")
+            search_task.cancel()
+
+
+def create_searxng_response(q: str, search_results: List[SearchResult], span_recorder: Optional[SpanRecorder], search_budget: SearchBudget) -> SearxNGResponse:
+    return SearxNGResponse(
         query=q,
         engines=["rag"],
         results=search_results,
@@ -87,16 +318,49 @@ async def search_endpoint(
         suggestions=[],
         infoboxes=[],
         unresponsive_engines=[],
-        timing={
-            "total": 0.0,
-            "processing": 0.0,
-            "network": 0.0
-        }
+        timing=get_timing(span_recorder),
+        degraded_stages=search_budget.degraded_stages,
     )
 
-    logger.debug( "=====")
-    logger.debug(f"===== SearxNG Response - {len(search_results)} results: {str_limit(str(searxng_response), 100)}")
-    logger.info(  "=====")
-    logger.info(  "=====")
 
-    return searxng_response
+def observe_search_metrics(span_recorder: SpanRecorder, search_budget: SearchBudget) -> None:
+    """Record the timing spans of a search request in the search metrics."""
+    search_requests_counter.inc(result="degraded" if search_budget.is_degraded() else "ok")
+    search_duration_histogram.observe(span_recorder.total_seconds())
+    for span in span_recorder.spans:
+        search_stage_duration_histogram.observe(span.duration_seconds, stage=span.name)
+
+
+def get_timing(span_recorder: Optional[SpanRecorder]) -> dict:
+    """
+    SearxNG timing block of a search request.
+
+    "network" is the wall-clock time spent waiting for external services (LLMs, embedding model, vectorstore),
+    "processing" the rest of the total time. "stages" sums up the durations per stage,
+    so concurrent calls of a stage can add up to more than "total".
+    """
+    if span_recorder is None:
+        return {"total": 0.0, "processing": 0.0, "network": 0.0, "stages": {}}
+
+    total = span_recorder.total_seconds()
+    network = min(span_recorder.external_seconds(), total)
+    stages = {
+        name: {"count": int(t["count"]), "total": round(t["total"], 4), "max": round(t["max"], 4)}
+        for name, t in span_recorder.stage_timings().items()
+    }
+    return {
+        "total": round(total, 4),
+        "processing": round(total - network, 4),
+        "network": round(network, 4),
+        "stages": stages,
+    }
+
+
+def get_server_timing_header(span_recorder: SpanRecorder) -> str:
+    """Server-Timing HTTP header value, e.g. 'vector_search;dur=180.2;desc="4x", total;dur=950.0'."""
+    entries = [
+        f'{name};dur={t["total"]*1000:.1f};desc="{int(t["count"])}x"'
+        for name, t in span_recorder.stage_timings().items()
+    ]
+    entries.append(f"total;dur={span_recorder.total_seconds()*1000:.1f}")
+    return ", ".join(entries)
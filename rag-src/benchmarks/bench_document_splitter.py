@@ -0,0 +1,103 @@
+#
+# Benchmark: splitting of documents into parts
+#
+# Compares the former splitting (tokenizer set up for each document, the text tokenized
+# for the size check, a new RecursiveCharacterTextSplitter per document that re-tokenizes
+# every piece, offsets searched with find()) with the current splitter service
+# in index_builder_and_retrieval_search_service/document_splitter.py - on the sample corpus.
+#
+# Usage (from the repository root):
+#   python rag-src/benchmarks/bench_document_splitter.py
+#
+import glob
+import os
+import sys
+import time
+from typing import Callable, List
+
+RAG_SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAG_SRC_DIR)
+os.environ.setdefault("TIKTOKEN_CACHE_DIR", os.path.join(RAG_SRC_DIR, "factory", "tiktoken-cache-dir"))
+
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain_core.documents import Document
+import tiktoken
+
+from index_builder_and_retrieval_search_service.document_splitter import (
+    chunk_overlap_tokens,
+    chunk_size_tokens,
+    get_text_splitter_service,
+    split_single_document_into_parts_if_needed,
+)
+
+INPUT_DATA_DIR = os.path.join(RAG_SRC_DIR, "..", "input-data")
+INPUT_FILES = [
+    os.path.join(INPUT_DATA_DIR, "plain-files", "paul_graham_essay.txt"),
+    os.path.join(INPUT_DATA_DIR, "plain-files", "java.html"),
+    *sorted(glob.glob(os.path.join(INPUT_DATA_DIR, "test-data", "*.md"))),
+]
+
+
+#
+# Former implementation (for comparison only)
+#
+
+def legacy_split_text(text: str) -> List[str]:
+    encoding = tiktoken.encoding_for_model("text-embedding-3-small")
+    if len(encoding.encode(text, disallowed_special=())) <= chunk_size_tokens:
+        return [text]
+    text_splitter = RecursiveCharacterTextSplitter.from_tiktoken_encoder(
+        chunk_size=chunk_size_tokens, chunk_overlap=chunk_overlap_tokens, disallowed_special=()
+    )
+    splits = text_splitter.split_text(text)
+    # offsets of the splits in the text
+    for split in splits:
+        text.find(split)
+    return splits
+
+
+#
+# Benchmark helpers
+#
+
+def load_texts() -> List[str]:
+    texts = []
+    for input_file in INPUT_FILES:
+        with open(input_file, encoding="utf-8") as f:
+            texts.append(f.read())
+    return texts
+
+def measure(name: str, func: Callable[[], object], repeat: int) -> float:
+    start_time = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    used_seconds = (time.perf_counter() - start_time) / repeat
+    print(f"  {name:<60} {used_seconds*1000:10.3f} ms")
+    return used_seconds
+
+def current_split_all(texts: List[str]) -> List[List[Document]]:
+    return [split_single_document_into_parts_if_needed(Document(page_content=text, metadata={})) for text in texts]
+
+
+def main():
+    texts = load_texts()
+    print(f"{len(texts)} files, {sum(len(t) for t in texts)} characters in total (chunk_size={chunk_size_tokens}, chunk_overlap={chunk_overlap_tokens} tokens)")
+    get_text_splitter_service()   # setup (once per process)
+
+    # Correctness check: splits within the size limit, exact offsets, chunk counts similar to the former splitting
+    encoding = get_text_splitter_service().encoding
+    for input_file, text, docs in zip(INPUT_FILES, texts, current_split_all(texts)):
+        for doc in docs:
+            assert len(encoding.encode(doc.page_content, disallowed_special=())) <= chunk_size_tokens
+            if "start_index" in doc.metadata:
+                assert text[doc.metadata["start_index"]:doc.metadata["end_index"]] == doc.page_content
+        print(f"  {os.path.basename(input_file):<40} {len(docs):5} splits (former: {len(legacy_split_text(text)):5})")
+
+    print("Split all files")
+    t_old = measure("legacy (splitter per document, re-tokenized pieces)", lambda: [legacy_split_text(text) for text in texts], 3)
+    t_new = measure("current (cached splitter, tokenized once)", lambda: current_split_all(texts), 3)
+    print(f"  speedup: {t_old/t_new:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
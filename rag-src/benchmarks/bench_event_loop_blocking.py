@@ -0,0 +1,109 @@
+#
+# Benchmark: event loop blocking by LLM calls on the search path
+#
+# Runs concurrent question rewrites (as in concurrent search requests) against a fake chat model
+# with a fixed latency, and measures how long the event loop is blocked (max. lag of a 10 ms ticker).
+# Compares the former blocking chain.invoke() with the current chain.ainvoke()
+# in index_builder_and_retrieval_search_service/question_rewriter.py.
+#
+# Usage (from the repository root, a rag-config.yaml is not required):
+#   python rag-src/benchmarks/bench_event_loop_blocking.py
+#
+import asyncio
+import os
+import sys
+import time
+from typing import Any, List, Optional
+
+RAG_SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAG_SRC_DIR)
+os.environ.setdefault("TIKTOKEN_CACHE_DIR", os.path.join(RAG_SRC_DIR, "factory", "tiktoken-cache-dir"))
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.prompts import ChatPromptTemplate
+
+from index_builder_and_retrieval_search_service import question_rewriter
+
+LLM_LATENCY_SECONDS = 0.2
+NUM_CONCURRENT_REQUESTS = 16
+TICK_SECONDS = 0.01
+# Max. acceptable event loop lag with ainvoke
+MAX_LAG_SECONDS = 0.1
+
+
+class SlowFakeChatModel(BaseChatModel):
+    """Fake chat model with a fixed latency: blocking in the sync API, non-blocking in the async API."""
+
+    latency_seconds: float = LLM_LATENCY_SECONDS
+
+    @property
+    def _llm_type(self) -> str:
+        return "slow-fake-chat-model"
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        time.sleep(self.latency_seconds)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content="improved question"))])
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        await asyncio.sleep(self.latency_seconds)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content="improved question"))])
+
+
+#
+# Former implementation (for comparison only)
+#
+
+async def legacy_rewrite_question(question: str) -> str:
+    prompt = ChatPromptTemplate.from_messages([("human", "Improve the question: {question}")])
+    question_rewriter_chain = prompt | SlowFakeChatModel() | StrOutputParser()
+    return question_rewriter_chain.invoke({"question": question})
+
+
+#
+# Benchmark helpers
+#
+
+async def measure_max_event_loop_lag(rewrite_question) -> float:
+    """Run concurrent rewrites and return the max. lag of a ticker on the same event loop."""
+    max_lag = 0.0
+    stop = False
+
+    async def ticker() -> None:
+        nonlocal max_lag
+        while not stop:
+            start_time = time.perf_counter()
+            await asyncio.sleep(TICK_SECONDS)
+            max_lag = max(max_lag, time.perf_counter() - start_time - TICK_SECONDS)
+
+    ticker_task = asyncio.create_task(ticker())
+    await asyncio.sleep(TICK_SECONDS)
+    start_time = time.perf_counter()
+    # distinct questions: no results from the alru_cache
+    await asyncio.gather(*[rewrite_question(f"question {i} at {start_time}") for i in range(NUM_CONCURRENT_REQUESTS)])
+    used_seconds = time.perf_counter() - start_time
+    stop = True
+    await ticker_task
+    print(f"    total: {used_seconds*1000:8.1f} ms, max. event loop lag: {max_lag*1000:8.1f} ms")
+    return max_lag
+
+
+async def main():
+    # the question rewriter uses the fake model instead of the configured one
+    question_rewriter.get_rewrite_question_chat_llm = lambda: SlowFakeChatModel()
+
+    print(f"{NUM_CONCURRENT_REQUESTS} concurrent question rewrites, LLM latency {LLM_LATENCY_SECONDS*1000:.0f} ms each")
+    print("  legacy (invoke)")
+    legacy_lag = await measure_max_event_loop_lag(legacy_rewrite_question)
+    print("  current (ainvoke)")
+    current_lag = await measure_max_event_loop_lag(question_rewriter.rewrite_question_for_vectorsearch_retrieval)
+
+    # Regression check: LLM calls must not block the event loop
+    assert current_lag < MAX_LAG_SECONDS, f"event loop blocked for {current_lag*1000:.1f} ms by LLM calls"
+    print(f"  lag reduction: {legacy_lag/max(current_lag, 1e-6):.0f}x")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
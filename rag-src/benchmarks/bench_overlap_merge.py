@@ -0,0 +1,108 @@
+#
+# Micro-benchmark: overlap merging of document splits
+#
+# Compares the former quadratic overlap detection (endswith() for every possible
+# overlap length + recursive merge) with the current prefix-function-based
+# implementation in common/utils/string_util.py - on real splits of the sample corpus.
+#
+# Usage (from the repository root):
+#   python rag-src/benchmarks/bench_overlap_merge.py
+#
+import os
+import sys
+import time
+from typing import Callable, List
+
+RAG_SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAG_SRC_DIR)
+os.environ.setdefault("TIKTOKEN_CACHE_DIR", os.path.join(RAG_SRC_DIR, "factory", "tiktoken-cache-dir"))
+
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+from common.utils.string_util import merge_strings_with_overlap_detection, merge_two_strings_with_with_overlap_detection
+
+INPUT_FILE = os.path.join(RAG_SRC_DIR, "..", "input-data", "plain-files", "paul_graham_essay.txt")
+CHUNK_SIZE_TOKENS = 500
+CHUNK_OVERLAP_TOKENS = 50
+SEPARATOR = "\n\n...\n\n"
+
+
+#
+# Former implementation (for comparison only)
+#
+
+def legacy_merge_two(s1: str, s2: str, separator: str = SEPARATOR) -> str:
+    overlap_length = min(min(len(s1), len(s2)), 10*1000)
+    for i in range(overlap_length, 10, -1):
+        if s1.endswith(s2[:i]):
+            return s1 + s2[i:]
+    return s1 + separator + s2
+
+def legacy_merge_all(merged: str, remaining: List[str], separator: str = SEPARATOR) -> str:
+    if not remaining:
+        return merged
+    merged = legacy_merge_two(merged, remaining[0], separator)
+    return legacy_merge_all(merged, remaining[1:], separator)
+
+
+#
+# Benchmark helpers
+#
+
+def load_splits() -> List[str]:
+    with open(INPUT_FILE, encoding="utf-8") as f:
+        text = f.read()
+    text_splitter = RecursiveCharacterTextSplitter.from_tiktoken_encoder(
+        chunk_size=CHUNK_SIZE_TOKENS, chunk_overlap=CHUNK_OVERLAP_TOKENS
+    )
+    return text_splitter.split_text(text)
+
+def measure(name: str, func: Callable[[], str], repeat: int) -> float:
+    start_time = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    used_seconds = (time.perf_counter() - start_time) / repeat
+    print(f"  {name:<60} {used_seconds*1000:10.3f} ms")
+    return used_seconds
+
+def extended_page_contents(splits: List[str], merge_two: Callable[[str, str], str]) -> List[str]:
+    # former pattern of document_splitter.split_single_document_into_parts()
+    results = []
+    for i, split in enumerate(splits):
+        extended = split
+        if i > 0:
+            extended = merge_two(splits[i - 1], split)
+        if i < len(splits) - 1:
+            extended = merge_two(extended, splits[i + 1])
+        results.append(extended)
+    return results
+
+
+def main():
+    splits = load_splits()
+    print(f"{len(splits)} splits, {sum(len(s) for s in splits)} characters in total (chunk_size={CHUNK_SIZE_TOKENS}, chunk_overlap={CHUNK_OVERLAP_TOKENS} tokens)")
+
+    # Correctness check
+    assert merge_strings_with_overlap_detection(splits, SEPARATOR) == legacy_merge_all("", splits, SEPARATOR).removeprefix(SEPARATOR)
+    assert extended_page_contents(splits, legacy_merge_two) == extended_page_contents(splits, merge_two_strings_with_with_overlap_detection)
+
+    print("Index time: extended_page_content of all splits")
+    t_old = measure("legacy (endswith loop)", lambda: extended_page_contents(splits, legacy_merge_two), 3)
+    t_new = measure("current (prefix function)", lambda: extended_page_contents(splits, merge_two_strings_with_with_overlap_detection), 3)
+    print(f"  speedup: {t_old/t_new:.1f}x")
+
+    print("Query time: merge all splits of a plob")
+    t_old = measure("legacy (endswith loop + recursion)", lambda: legacy_merge_all("", splits), 3)
+    t_new = measure("current (prefix function + iterative)", lambda: merge_strings_with_overlap_detection(splits), 3)
+    print(f"  speedup: {t_old/t_new:.1f}x")
+
+    # Merging of non-overlapping texts (worst case of the legacy implementation)
+    non_overlapping = list(reversed(splits))
+    print("Worst case: merge all splits without any overlap")
+    t_old = measure("legacy (endswith loop + recursion)", lambda: legacy_merge_all("", non_overlapping), 1)
+    t_new = measure("current (prefix function + iterative)", lambda: merge_strings_with_overlap_detection(non_overlapping), 1)
+    print(f"  speedup: {t_old/t_new:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
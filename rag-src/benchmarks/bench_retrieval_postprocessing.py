@@ -0,0 +1,150 @@
+#
+# Micro-benchmark: grouping and ordering of retrieved documents
+#
+# Compares the former list-scan based post-processing of document_retrieval.py
+# (grouping by plob_id, ordering by source rank, cmp_to_key sorting by part)
+# with the current hash-indexed implementation in document_grouping.py -
+# for a few hundred candidates from large plobs (e.g. with a raised max_max_search_results).
+#
+# Usage (from the repository root):
+#   python rag-src/benchmarks/bench_retrieval_postprocessing.py
+#
+import os
+import random
+import sys
+import time
+from functools import cmp_to_key
+from typing import Callable, List
+
+RAG_SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAG_SRC_DIR)
+
+from langchain_core.documents import Document
+
+from index_builder_and_retrieval_search_service.document_grouping import (
+    group_documents_by_plob_id, sort_documents_of_a_plob_by_part, build_rank_map, sort_documents_by_rank_map
+)
+from model.plob_documents import PlobDocuments
+
+NUM_PLOBS = 40
+NUM_CANDIDATES = 800
+SPLITS_PER_PLOB = 400
+
+
+#
+# Former implementation (for comparison only)
+#
+
+def legacy_group_documents_by_plob_id(documents: List[Document]) -> List[PlobDocuments]:
+    results: List[PlobDocuments] = []
+    for doc in documents:
+        plob_id = doc.metadata.get('plob_id', None)
+        found_blob_id = False
+        for plob_docs in results:
+            if plob_docs.plob_id == plob_id:
+                plob_docs.documents.append(doc)
+                found_blob_id = True
+                break
+        if not found_blob_id:
+            results.append(PlobDocuments(plob_id=plob_id, documents=[doc]))
+    return results
+
+def legacy_order_by_sources(documents: List[Document]) -> List[Document]:
+    sources: List[str] = []
+    for doc in documents:
+        source = doc.metadata.get('source', None)
+        if source is not None and source not in sources:
+            sources.append(source)
+    return sorted(documents, key=lambda doc: sources.index(doc.metadata.get('source', '')))
+
+def legacy_comparison_function(doc1: Document, doc2: Document) -> int:
+    part1_components = doc1.metadata.get('part', '').split('/')
+    part2_components = doc2.metadata.get('part', '').split('/')
+    if len(part1_components) != len(part2_components):
+        return -1 if len(part1_components) < len(part2_components) else 1
+    for comp1, comp2 in zip(part1_components, part2_components):
+        if comp1.isdigit() and comp2.isdigit():
+            if int(comp1) != int(comp2):
+                return -1 if int(comp1) < int(comp2) else 1
+        elif comp1 != comp2:
+            return -1 if comp1 < comp2 else 1
+    return 0
+
+def legacy_sort_by_part(documents: List[Document]) -> List[Document]:
+    documents.sort(key=cmp_to_key(legacy_comparison_function))
+    return documents
+
+
+#
+# Benchmark helpers
+#
+
+def create_candidates() -> List[Document]:
+    random.seed(42)
+    documents = []
+    for i in range(NUM_CANDIDATES):
+        plob_index = random.randrange(NUM_PLOBS)
+        split_index = random.randrange(SPLITS_PER_PLOB)
+        part = f"/split/{split_index}" + random.choice(["", "", "/summary", "/summary/join"])
+        documents.append(Document(
+            page_content=f"text {i}",
+            metadata={
+                "plob_id": f"plob-{plob_index}",
+                "source": f"https://example.com/doc-{plob_index}#{split_index}",
+                "part": part,
+            },
+        ))
+    return documents
+
+def measure(name: str, func: Callable[[], object], repeat: int) -> float:
+    start_time = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    used_seconds = (time.perf_counter() - start_time) / repeat
+    print(f"  {name:<50} {used_seconds*1000:10.3f} ms")
+    return used_seconds
+
+def legacy_pipeline(documents: List[Document]) -> None:
+    ordered = legacy_order_by_sources(documents)
+    for plob_docs in legacy_group_documents_by_plob_id(ordered):
+        legacy_sort_by_part(list(plob_docs.documents))
+
+def current_pipeline(documents: List[Document]) -> None:
+    ordered = sort_documents_by_rank_map(documents, build_rank_map(documents, 'source'), 'source')
+    for plob_docs in group_documents_by_plob_id(ordered):
+        sort_documents_of_a_plob_by_part(list(plob_docs.documents))
+
+
+def main():
+    documents = create_candidates()
+    print(f"{len(documents)} candidates from {NUM_PLOBS} plobs with up to {SPLITS_PER_PLOB} splits each")
+
+    # Correctness check
+    assert [d.plob_id for d in legacy_group_documents_by_plob_id(documents)] == [d.plob_id for d in group_documents_by_plob_id(documents)]
+    assert legacy_order_by_sources(documents) == sort_documents_by_rank_map(documents, build_rank_map(documents, 'source'), 'source')
+    assert [d.metadata['part'] for d in legacy_sort_by_part(list(documents))] == [d.metadata['part'] for d in sort_documents_of_a_plob_by_part(list(documents))]
+
+    repeat = 20
+    print("Group by plob_id")
+    t_old = measure("legacy (list scan)", lambda: legacy_group_documents_by_plob_id(documents), repeat)
+    t_new = measure("current (dict)", lambda: group_documents_by_plob_id(documents), repeat)
+    print(f"  speedup: {t_old/t_new:.1f}x")
+
+    print("Order by source rank")
+    t_old = measure("legacy (list.index)", lambda: legacy_order_by_sources(documents), repeat)
+    t_new = measure("current (rank map)", lambda: sort_documents_by_rank_map(documents, build_rank_map(documents, 'source'), 'source'), repeat)
+    print(f"  speedup: {t_old/t_new:.1f}x")
+
+    print("Sort by part")
+    t_old = measure("legacy (cmp_to_key)", lambda: legacy_sort_by_part(list(documents)), repeat)
+    t_new = measure("current (cached sort keys)", lambda: sort_documents_of_a_plob_by_part(list(documents)), repeat)
+    print(f"  speedup: {t_old/t_new:.1f}x")
+
+    print("Complete post-processing (without merging of texts)")
+    t_old = measure("legacy", lambda: legacy_pipeline(documents), repeat)
+    t_new = measure("current", lambda: current_pipeline(documents), repeat)
+    print(f"  speedup: {t_old/t_new:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
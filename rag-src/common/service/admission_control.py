@@ -0,0 +1,147 @@
+### Admission Control
+#
+# Async concurrency limiters with a bounded wait queue:
+# - one per LLM role (e.g. grader, rewriter), to avoid overloading the LLM server with concurrent calls
+# - one for all searches in flight, see index_builder_and_retrieval_search_service/search_index.py
+#
+# Usage:
+#     async with get_llm_limiter("grader"):
+#         ... call LLM ...
+#
+# The limiters are used by async code of the event loop (search requests) only, they are not thread-safe.
+
+import asyncio
+from collections import deque
+from functools import cache
+from typing import (
+    Deque,
+    Optional,
+)
+import time
+import logging
+
+from common.service.configloader import deep_get, settings
+from common.service.metrics import Counter, Gauge, Histogram
+
+logger = logging.getLogger(__name__)
+
+
+admission_wait_histogram = Histogram("rag_admission_wait_seconds", "Time waited in the queue of a concurrency limiter", ["limiter"])
+admission_in_flight_gauge = Gauge("rag_admission_in_flight", "Number of admitted (running) operations per concurrency limiter", ["limiter"])
+admission_queued_gauge = Gauge("rag_admission_queued", "Number of operations waiting in the queue of a concurrency limiter", ["limiter"])
+admission_rejected_counter = Counter("rag_admission_rejected_total", "Number of operations rejected by a concurrency limiter per reason", ["limiter", "reason"])
+
+
+class AdmissionRejected(Exception):
+    """The operation was not admitted: the wait queue is full or the wait timed out."""
+
+    def __init__(self, limiter_name: str, reason: str):
+        super().__init__(f"Not admitted by concurrency limiter '{limiter_name}': {reason}")
+        self.limiter_name = limiter_name
+        self.reason = reason
+
+
+class ConcurrencyLimiter:
+    """
+    Limit the number of concurrent operations, with a bounded FIFO wait queue.
+    """
+
+    def __init__(self, name: str, max_concurrency: int, max_queued: Optional[int] = None):
+        """
+        Args:
+            name (str): Name for logging and metrics.
+            max_concurrency (int): Max. number of concurrent operations, 0 = unlimited.
+            max_queued (Optional[int]): Max. number of waiting operations, None = unlimited.
+        """
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.max_queued = max_queued
+        self._in_flight = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+
+    def __repr__(self) -> str:
+        return f"ConcurrencyLimiter(name={self.name}, in_flight={self._in_flight}/{self.max_concurrency}, queued={len(self._waiters)}/{self.max_queued})"
+
+    async def acquire(self, timeout: Optional[float] = None) -> None:
+        """
+        Wait for a free slot - must be followed by release().
+
+        Args:
+            timeout (Optional[float]): Max. seconds to wait in the queue, None = unlimited.
+
+        Raises:
+            AdmissionRejected: if the queue is full or the timeout is reached
+        """
+        start_time = time.perf_counter()
+        if self.max_concurrency <= 0 or (self._in_flight < self.max_concurrency and not self._waiters):
+            # Free slot
+            self._set_in_flight(self._in_flight + 1)
+            admission_wait_histogram.observe(0, limiter=self.name)
+            return
+
+        # Wait in the queue
+        if self.max_queued is not None and len(self._waiters) >= self.max_queued:
+            admission_rejected_counter.inc(limiter=self.name, reason="queue_full")
+            raise AdmissionRejected(self.name, "queue full")
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        admission_queued_gauge.set(len(self._waiters), limiter=self.name)
+        try:
+            # release() hands its slot over to the waiter
+            await asyncio.wait_for(waiter, timeout=max(timeout, 0) if timeout is not None else None)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if waiter.done() and not waiter.cancelled():
+                # Slot was handed over just before: give it back
+                self.release()
+            else:
+                self._remove_waiter(waiter)
+            if isinstance(e, asyncio.TimeoutError):
+                admission_rejected_counter.inc(limiter=self.name, reason="timeout")
+                raise AdmissionRejected(self.name, "timeout while waiting in queue") from e
+            raise
+        finally:
+            admission_wait_histogram.observe(time.perf_counter() - start_time, limiter=self.name)
+
+    def release(self) -> None:
+        """Free the slot of an operation - or hand it over to the next waiting one."""
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            admission_queued_gauge.set(len(self._waiters), limiter=self.name)
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self._set_in_flight(self._in_flight - 1)
+
+    async def __aenter__(self) -> "ConcurrencyLimiter":
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        self.release()
+
+    def _remove_waiter(self, waiter: asyncio.Future) -> None:
+        try:
+            self._waiters.remove(waiter)
+        except ValueError:
+            pass
+        admission_queued_gauge.set(len(self._waiters), limiter=self.name)
+
+    def _set_in_flight(self, in_flight: int) -> None:
+        self._in_flight = in_flight
+        admission_in_flight_gauge.set(in_flight, limiter=self.name)
+
+
+#
+# LLM limiters
+#
+
+@cache
+def get_llm_limiter(role: str) -> ConcurrencyLimiter:
+    """
+    Concurrency limiter for all LLM calls of a role ("grader", "rewriter", "summarizer"),
+    configured in config.rag_response.llm_max_concurrency.<role> (0 = unlimited).
+    """
+    max_concurrency = deep_get(settings, f"config.rag_response.llm_max_concurrency.{role}", default_value=4)
+    limiter = ConcurrencyLimiter(f"llm_{role}", max_concurrency)
+    logger.info(f"Setup done: {limiter}")
+    return limiter
@@ -0,0 +1,219 @@
+### Metrics in Prometheus Text Format
+#
+# Minimal, dependency-free counters, gauges and histograms,
+# exposed by the /metrics endpoint in the Prometheus text exposition format (version 0.0.4).
+#
+# Usage:
+#     search_counter = Counter("rag_search_requests_total", "Number of search requests", ["result"])
+#     search_counter.inc(result="ok")
+#
+#     latency_histogram = Histogram("rag_search_duration_seconds", "Latency of search requests")
+#     with latency_histogram.time():
+#         ...
+#
+#     render_metrics()  # -> text for the /metrics endpoint
+
+from contextlib import contextmanager
+from typing import (
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+)
+import math
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE_LATEST = "text/plain; version=0.0.4; charset=utf-8"
+
+# Buckets (in seconds) for latencies of LLM calls, searches and indexing steps
+DEFAULT_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+LabelValues = Tuple[str, ...]
+
+
+class _Metric:
+    """Base class of all metrics: name, help text, label names and registration."""
+
+    type_name = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames: Tuple[str, ...] = tuple(labelnames)
+        self._lock = threading.Lock()
+        _register(self)
+
+    def _label_values(self, labels: Dict[str, str]) -> LabelValues:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"Metric {self.name}: expected labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[labelname]) for labelname in self.labelnames)
+
+    def _labels_str(self, label_values: LabelValues, extra_labels: Sequence[Tuple[str, str]] = ()) -> str:
+        pairs = list(zip(self.labelnames, label_values)) + list(extra_labels)
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{labelname}="{_escape_label_value(value)}"' for labelname, value in pairs) + "}"
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type_name}",
+        ]
+        lines.extend(self._samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    """Monotonically increasing value, e.g. the number of requests."""
+
+    type_name = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        if amount < 0:
+            raise ValueError(f"Counter {self.name} can only be increased")
+        label_values = self._label_values(labels)
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def get(self, **labels: str) -> float:
+        with self._lock:
+            return self._values.get(self._label_values(labels), 0)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            values = list(self._values.items())
+        return [f"{self.name}{self._labels_str(label_values)} {_format_value(value)}" for label_values, value in values]
+
+
+class Gauge(_Metric):
+    """Value that can go up and down, e.g. a queue length. Optionally calculated when rendered."""
+
+    type_name = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+        self._function: Optional[Callable[[], float]] = None
+
+    def set(self, value: float, **labels: str) -> None:
+        label_values = self._label_values(labels)
+        with self._lock:
+            self._values[label_values] = value
+
+    def set_function(self, function: Callable[[], float]) -> None:
+        """Calculate the (unlabeled) value when the metrics are rendered."""
+        self._function = function
+
+    def _samples(self) -> List[str]:
+        if self._function is not None:
+            try:
+                return [f"{self.name} {_format_value(self._function())}"]
+            except Exception as e:
+                logger.warning(f"Gauge {self.name}: failed to calculate value: {e}")
+                return []
+        with self._lock:
+            values = list(self._values.items())
+        return [f"{self.name}{self._labels_str(label_values)} {_format_value(value)}" for label_values, value in values]
+
+
+class Histogram(_Metric):
+    """Distribution of observed values (e.g. latencies) in cumulative buckets, plus their sum and count."""
+
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets: Tuple[float, ...] = tuple(sorted(buckets))
+        # label values -> (count per bucket (non-cumulative, last = +Inf), sum)
+        self._values: Dict[LabelValues, Tuple[List[int], float]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        label_values = self._label_values(labels)
+        bucket_index = len(self.buckets)
+        for index, upper_bound in enumerate(self.buckets):
+            if value <= upper_bound:
+                bucket_index = index
+                break
+        with self._lock:
+            bucket_counts, total = self._values.get(label_values, (None, 0.0))
+            if bucket_counts is None:
+                bucket_counts = [0] * (len(self.buckets) + 1)
+            bucket_counts[bucket_index] += 1
+            self._values[label_values] = (bucket_counts, total + value)
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        """Observe the duration of the enclosed block in seconds."""
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start_time, **labels)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            values = [(label_values, list(bucket_counts), total) for label_values, (bucket_counts, total) in self._values.items()]
+        lines = []
+        for label_values, bucket_counts, total in values:
+            cumulative_count = 0
+            for upper_bound, count in zip(self.buckets + (math.inf,), bucket_counts):
+                cumulative_count += count
+                le = "+Inf" if upper_bound == math.inf else _format_value(upper_bound)
+                lines.append(f"{self.name}_bucket{self._labels_str(label_values, [('le', le)])} {cumulative_count}")
+            lines.append(f"{self.name}_sum{self._labels_str(label_values)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{self._labels_str(label_values)} {cumulative_count}")
+        return lines
+
+
+#
+# Registry
+#
+
+_registry: Dict[str, _Metric] = {}
+_registry_lock = threading.Lock()
+
+
+def _register(metric: _Metric) -> None:
+    with _registry_lock:
+        if metric.name in _registry:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        _registry[metric.name] = metric
+
+
+def render_metrics() -> str:
+    """All registered metrics in the Prometheus text exposition format."""
+    with _registry_lock:
+        metrics = list(_registry.values())
+    return "\n".join(metric.render() for metric in metrics) + "\n"
+
+
+#
+# Helpers
+#
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if value == -math.inf:
+        return "-Inf"
+    if isinstance(value, int) or float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape_label_value(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
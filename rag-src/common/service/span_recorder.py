@@ -0,0 +1,137 @@
+### Timing Spans of a Request
+#
+# Lightweight recording of timing spans of a single request (e.g. a search).
+#
+# Usage:
+#     with record_spans() as span_recorder:
+#         ...
+#         with timing_span("vector_search", external=True):
+#             ...
+#         ...
+#     span_recorder.stage_timings()
+#
+# The current recorder is stored in a context variable, so spans can be recorded
+# deep in the call stack (e.g. in the embedding model) without passing the recorder around.
+# asyncio tasks inherit the recorder of the request that created them.
+# Outside of record_spans() (e.g. during indexing), timing_span() does nothing.
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import (
+    Dict,
+    Iterator,
+    List,
+    Optional,
+)
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Span:
+    name: str
+    start_seconds: float    # relative to the start of the recording
+    duration_seconds: float
+    external: bool          # waiting for an external service (LLM, embedding model, vectorstore, ...)?
+
+
+class SpanRecorder:
+    """Collects the timing spans of a single request."""
+
+    def __init__(self):
+        self.start_time = time.perf_counter()
+        self.end_time: Optional[float] = None
+        self.spans: List[Span] = []
+        self._lock = threading.Lock()
+
+    def record(self, name: str, start_time: float, end_time: float, external: bool = False) -> None:
+        """Record a span (with time.perf_counter() values)."""
+        span = Span(name=name, start_seconds=start_time - self.start_time, duration_seconds=end_time - start_time, external=external)
+        with self._lock:
+            self.spans.append(span)
+
+    def stop(self) -> None:
+        """Stop the recording (the total time)."""
+        if self.end_time is None:
+            self.end_time = time.perf_counter()
+
+    def total_seconds(self) -> float:
+        """Total time of the recording (until now if not stopped yet)."""
+        end_time = self.end_time if self.end_time is not None else time.perf_counter()
+        return end_time - self.start_time
+
+    def external_seconds(self) -> float:
+        """
+        Wall-clock time spent waiting for external services:
+        the union of all external spans, i.e. concurrent calls are counted only once.
+        """
+        with self._lock:
+            intervals = sorted((span.start_seconds, span.start_seconds + span.duration_seconds) for span in self.spans if span.external)
+        result = 0.0
+        current_start, current_end = None, None
+        for start, end in intervals:
+            if current_end is None or start > current_end:
+                if current_end is not None:
+                    result += current_end - current_start
+                current_start, current_end = start, end
+            else:
+                current_end = max(current_end, end)
+        if current_end is not None:
+            result += current_end - current_start
+        return result
+
+    def stage_timings(self) -> Dict[str, Dict[str, float]]:
+        """Aggregated timings per span name: {name: {"count": n, "total": seconds, "max": seconds}}."""
+        result: Dict[str, Dict[str, float]] = {}
+        with self._lock:
+            for span in self.spans:
+                timing = result.get(span.name)
+                if timing is None:
+                    result[span.name] = {"count": 1, "total": span.duration_seconds, "max": span.duration_seconds}
+                else:
+                    timing["count"] += 1
+                    timing["total"] += span.duration_seconds
+                    timing["max"] = max(timing["max"], span.duration_seconds)
+        return result
+
+    def __str__(self) -> str:
+        stages_str = ", ".join(f"{name}={timing['total']*1000:.0f}ms/{int(timing['count'])}x" for name, timing in self.stage_timings().items())
+        return f"total={self.total_seconds()*1000:.0f}ms: {stages_str}"
+
+
+_current_span_recorder: ContextVar[Optional[SpanRecorder]] = ContextVar("current_span_recorder", default=None)
+
+
+def get_current_span_recorder() -> Optional[SpanRecorder]:
+    """The recorder of the current request, or None if not recording."""
+    return _current_span_recorder.get()
+
+
+@contextmanager
+def record_spans() -> Iterator[SpanRecorder]:
+    """Record all spans in this context (and in the asyncio tasks created in it)."""
+    span_recorder = SpanRecorder()
+    token = _current_span_recorder.set(span_recorder)
+    try:
+        yield span_recorder
+    finally:
+        span_recorder.stop()
+        _current_span_recorder.reset(token)
+
+
+@contextmanager
+def timing_span(name: str, external: bool = False) -> Iterator[None]:
+    """Measure the enclosed block as span - if a recording is active."""
+    span_recorder = _current_span_recorder.get()
+    if span_recorder is None:
+        yield
+        return
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        span_recorder.record(name, start_time, time.perf_counter(), external)
@@ -0,0 +1,99 @@
+import asyncio
+from typing import (
+    Awaitable,
+    Callable,
+    Dict,
+    Generic,
+    Hashable,
+    Optional,
+    Tuple,
+    TypeVar,
+)
+import logging
+
+logger = logging.getLogger(__name__)
+
+V = TypeVar("V")
+
+#
+# Coalescing of identical in-flight requests ("single flight").
+#
+# Concurrent calls with the same key share one computation:
+# the first call starts it (as separate task), later calls await the same task.
+# In contrast to a cache, nothing is kept after the computation is done.
+#
+
+class SingleFlight(Generic[V]):
+    def __init__(self):
+        self._tasks: Dict[Hashable, asyncio.Task] = {}
+        # number of callers waiting for each task
+        self._waiters: Dict[asyncio.Task, int] = {}
+
+    def __len__(self) -> int:
+        """Number of computations in flight."""
+        return len(self._tasks)
+
+    async def run(self,
+                  key: Hashable,
+                  create_coroutine: Callable[[], Awaitable[V]],
+                  join_timeout: Optional[float] = None,
+                  ) -> Tuple[V, bool]:
+        """
+        Run the computation for the key - or join the one already in flight.
+
+        The computation is shielded: it continues if a single caller is cancelled
+        (e.g. its client disconnected) as long as others still wait for it.
+        It is cancelled when all waiting callers are cancelled.
+
+        Args:
+            key (Hashable): Identifies identical requests.
+            create_coroutine: Creates the coroutine of the computation, only called if none is in flight.
+            join_timeout (Optional[float]): Max. seconds to wait when joining a computation in flight, None = unlimited.
+                The caller that starts the computation always waits until it's done.
+
+        Returns:
+            Tuple[V, bool]: Result of the computation, and whether it was shared with an earlier caller.
+
+        Raises:
+            asyncio.TimeoutError: if the joined computation didn't finish within the join_timeout (it continues in the background)
+            Exception: of the computation - all callers get the same exception
+        """
+        task = self._tasks.get(key)
+        shared = task is not None
+        if task is None:
+            task = asyncio.ensure_future(create_coroutine())
+            self._tasks[key] = task
+            task.add_done_callback(lambda done_task: self._remove(key, done_task))
+
+        self._waiters[task] = self._waiters.get(task, 0) + 1
+        try:
+            if not shared or join_timeout is None:
+                result = await asyncio.shield(task)
+            else:
+                result = await asyncio.wait_for(asyncio.shield(task), timeout=max(join_timeout, 0))
+        except asyncio.CancelledError:
+            if self._release_waiter(task) == 0 and not task.done():
+                logger.debug(f"In-flight computation for {key} cancelled: nobody waits for it anymore")
+                task.cancel()
+            raise
+        except BaseException:
+            self._release_waiter(task)
+            raise
+        self._release_waiter(task)
+        return result, shared
+
+    def _release_waiter(self, task: asyncio.Task) -> int:
+        """Remove a waiting caller, returns the number of remaining ones."""
+        remaining = self._waiters.get(task, 1) - 1
+        if remaining > 0:
+            self._waiters[task] = remaining
+        else:
+            self._waiters.pop(task, None)
+        return remaining
+
+    def _remove(self, key: Hashable, task: asyncio.Task) -> None:
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+        if not task.cancelled() and task.exception() is not None:
+            # retrieve the exception to avoid "Task exception was never retrieved" if nobody waits anymore
+            logger.debug(f"In-flight computation for {key} failed: {task.exception()}")
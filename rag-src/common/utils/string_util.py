@@ -49,40 +49,51 @@ def str_limit_hard_cut(s: any, max_len: int = 40) -> str:
 # String helper functions: overlap detection and merging
 #
 
-def merge_strings_with_with_overlap_detection_and_tail_recursion(
-        merged: str,
-        remaining: List[str],
+# Overlap limits (in characters) used by the merge functions below
+max_allowed_overlap_len = 10*1000
+min_overlap_len = 10
+
+
+def merge_strings_with_overlap_detection(
+        strings: List[str],
         separator_in_case_of_simple_concatenation: str = "\n\n...\n\n"
         ) -> str:
     """
-    Merge strings with overlap detection and tail recursion.
+    Merge multiple strings with overlap detection - iteratively, in linear time.
 
     Overlap handling is used to compensate overlapping from document splitting.
-    
+    Only the tail of the merged string (max_allowed_overlap_len characters)
+    is considered for overlap detection, the merged string is joined once at the end.
+
     Args:
-        merged (str): The merged string so far. Start with an empty string.
-        strings (List[str]): List of (remaining) strings to merge.
+        strings (List[str]): List of strings to merge, in this order.
         separator_in_case_of_simple_concatenation (str):
             Separator to use if no overlap is detected. Defaults to "\n\n...\n\n".
-    
+
     Returns:
         str: Merged string with overlaps handled.
     """
-    if not remaining:
-        return merged
-
-    # Take the first string from the remaining list
-    current_string = remaining[0]
-    remaining_strings = remaining[1:]
-
-    # Check for overlap with the merged string
-    merged = merge_two_strings_with_with_overlap_detection(merged, current_string, separator_in_case_of_simple_concatenation)
-    if not remaining_strings:
-        # If there are no remaining strings, return the merged result
-        return merged
-    else:
-        # Recursively merge the remaining strings
-        return merge_strings_with_with_overlap_detection_and_tail_recursion(merged, remaining_strings, separator_in_case_of_simple_concatenation)
+    merged_parts: List[str] = []
+    merged_tail = ""
+    for current_string in strings:
+        if not current_string:
+            continue
+        if not merged_parts:
+            # First (non-empty) string: nothing to merge with
+            merged_parts.append(current_string)
+            merged_tail = current_string[-max_allowed_overlap_len:]
+            continue
+
+        # Check for overlap with the tail of the merged string so far
+        overlap_len = _find_overlap_len(merged_tail, current_string)
+        if overlap_len > min_overlap_len:
+            addition = current_string[overlap_len:]
+        else:
+            addition = separator_in_case_of_simple_concatenation + current_string
+        merged_parts.append(addition)
+        merged_tail = (merged_tail + addition)[-max_allowed_overlap_len:]
+
+    return "".join(merged_parts)
 
 
 def merge_two_strings_with_with_overlap_detection(
@@ -108,23 +119,68 @@ def merge_two_strings_with_with_overlap_detection(
     if extra_info_logging:
         logger.info(f"Merging len = {len(s1)+len(s2)} started ...")
 
-    # Check for overlap with the first string in a range of half the length of the second string to 1
-    max_allowed_overlap_len = 10*1000
-    min_overlap_len = 10
-    overlap_length = min(min(len(s1), len(s2)), max_allowed_overlap_len)
-    for i in range(overlap_length, min_overlap_len, -1):
-        if s1.endswith(s2[:i]):
-            # Overlap detected, merge without overlap
-            if extra_info_logging:
-                logger.info( f"  Overlap detected of len: {i}")
-            if logger.isEnabledFor(logging.DEBUG):
-                logger.debug(f"  Overlap detected: '{s1[-i:]}'")
-                logger.debug(f"    Overlap detected in s1: '{s1}'")
-                logger.debug(f"    Overlap detected in s2: '{s2}'")
-
-            return s1 + s2[i:]
+    # Nothing to merge?
+    if not s1:
+        return s2
+    if not s2:
+        return s1
+
+    # Find the longest suffix of s1 that is a prefix of s2
+    overlap_len = _find_overlap_len(s1, s2)
+    if overlap_len > min_overlap_len:
+        # Overlap detected, merge without overlap
+        if extra_info_logging:
+            logger.info( f"  Overlap detected of len: {overlap_len}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"  Overlap detected: '{s1[-overlap_len:]}'")
+            logger.debug(f"    Overlap detected in s1: '{s1}'")
+            logger.debug(f"    Overlap detected in s2: '{s2}'")
+
+        return s1 + s2[overlap_len:]
 
     # No overlap, just simple concatenation
     if extra_info_logging:
         logger.info("  No overlap detected, simple concatenation")
     return s1 + separator_in_case_of_simple_concatenation + s2
+
+
+def _find_overlap_len(s1: str, s2: str) -> int:
+    """
+    Find the length of the longest suffix of s1 that is also a prefix of s2
+    (limited to max_allowed_overlap_len characters).
+
+    Uses the prefix function (Knuth-Morris-Pratt) of the prefix of s2
+    and runs it over the tail of s1: O(len(s1 tail) + len(s2 prefix)).
+
+    Args:
+        s1 (str): First string.
+        s2 (str): Second string.
+
+    Returns:
+        int: Length of the overlap, 0 if there is none.
+    """
+    n = min(len(s1), len(s2), max_allowed_overlap_len)
+    if n == 0:
+        return 0
+    pattern = s2[:n]
+    text = s1[-n:]
+
+    # Prefix function of the pattern
+    prefix_function = [0] * n
+    k = 0
+    for i in range(1, n):
+        c = pattern[i]
+        while k > 0 and pattern[k] != c:
+            k = prefix_function[k - 1]
+        if pattern[k] == c:
+            k += 1
+        prefix_function[i] = k
+
+    # Match the pattern against the text, the final state is the overlap length
+    k = 0
+    for c in text:
+        while k > 0 and (k == n or pattern[k] != c):
+            k = prefix_function[k - 1]
+        if pattern[k] == c:
+            k += 1
+    return k
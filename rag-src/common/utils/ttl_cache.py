@@ -0,0 +1,59 @@
+from collections import OrderedDict
+from typing import (
+    Generic,
+    Hashable,
+    Optional,
+    Tuple,
+    TypeVar,
+)
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+V = TypeVar("V")
+
+#
+# Small in-memory LRU cache with time-to-live.
+#
+# In contrast to alru_cache, the caller decides which results are cached
+# (e.g. only complete, non-degraded results).
+#
+
+class TtlCache(Generic[V]):
+    def __init__(self, ttl_seconds: float, maxsize: int):
+        """
+        Args:
+            ttl_seconds (float): Time-to-live of each entry, in seconds.
+            maxsize (int): Maximum number of entries, the least recently used entries are removed first.
+        """
+        self.ttl_seconds = ttl_seconds
+        self.maxsize = maxsize
+        self._entries: "OrderedDict[Hashable, Tuple[float, V]]" = OrderedDict()
+
+    def get(self, key: Hashable) -> Optional[V]:
+        """Get a cached value, or None if not cached (or expired)."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            # expired
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def put(self, key: Hashable, value: V) -> None:
+        """Cache a value."""
+        self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, key: Hashable) -> None:
+        """Remove a value from the cache (if cached)."""
+        self._entries.pop(key, None)
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -0,0 +1,120 @@
+
+from functools import cache
+from typing import Dict
+import importlib.util
+import httpx
+
+from common.service.configloader import deep_get, settings
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+#
+# Shared (pooled) HTTP connections for all LLM and embedding backends.
+#
+# All configured chat and embedding models use the same connection pools (httpx transports),
+# with keep-alive, so that TLS handshakes are not repeated for each call
+# and the total number of concurrent connections is predictable.
+#
+# The async transport binds its connections to the event loop of the API server,
+# the indexing threads use the sync transport.
+#
+
+http_client_enabled = deep_get(settings, "config.common.http_client.enabled", default_value=True)
+http_client_max_connections = deep_get(settings, "config.common.http_client.max_connections", default_value=100)
+http_client_max_keepalive_connections = deep_get(settings, "config.common.http_client.max_keepalive_connections", default_value=20)
+http_client_keepalive_expiry_seconds = deep_get(settings, "config.common.http_client.keepalive_expiry_seconds", default_value=30)
+http_client_timeout_seconds = deep_get(settings, "config.common.http_client.timeout_seconds", default_value=120)
+http_client_connect_timeout_seconds = deep_get(settings, "config.common.http_client.connect_timeout_seconds", default_value=10)
+http_client_http2 = deep_get(settings, "config.common.http_client.http2", default_value=True)
+
+
+def _get_limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=http_client_max_connections,
+        max_keepalive_connections=http_client_max_keepalive_connections,
+        keepalive_expiry=http_client_keepalive_expiry_seconds,
+    )
+
+
+def _get_timeout() -> httpx.Timeout:
+    return httpx.Timeout(http_client_timeout_seconds, connect=http_client_connect_timeout_seconds)
+
+
+@cache
+def _is_http2_available() -> bool:
+    """HTTP/2 is used if configured and the package 'h2' is installed (e.g. with: pip install httpx[http2])."""
+    if not http_client_http2:
+        return False
+    if importlib.util.find_spec("h2") is None:
+        logger.warning("config.common.http_client.http2=true, but package 'h2' is not installed - use HTTP/1.1 only")
+        return False
+    return True
+
+
+@cache
+def get_shared_http_transport() -> httpx.HTTPTransport:
+    transport = httpx.HTTPTransport(limits=_get_limits(), http2=_is_http2_available())
+    logger.info(f"Setup done: shared HTTP transport (limits={_get_limits()}, http2={_is_http2_available()})")
+    return transport
+
+
+@cache
+def get_shared_async_http_transport() -> httpx.AsyncHTTPTransport:
+    transport = httpx.AsyncHTTPTransport(limits=_get_limits(), http2=_is_http2_available())
+    logger.info(f"Setup done: shared async HTTP transport (limits={_get_limits()}, http2={_is_http2_available()})")
+    return transport
+
+
+@cache
+def get_shared_http_client() -> httpx.Client:
+    return httpx.Client(transport=get_shared_http_transport(), timeout=_get_timeout())
+
+
+@cache
+def get_shared_async_http_client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(transport=get_shared_async_http_transport(), timeout=_get_timeout())
+
+
+#
+# Injection into the constructor args of chat and embedding models
+#
+
+def add_shared_http_clients_to_kwargs(module_and_class: str, class_kwargs: Dict) -> Dict:
+    """
+    Add the shared HTTP clients/transports to the constructor args of a chat or embedding model,
+    if the model class is known to support them. Explicitly configured args are kept.
+
+    Supported:
+        langchain_openai.*   - args http_client and http_async_client
+        langchain_ollama.*   - args sync_client_kwargs and async_client_kwargs (with the shared transports)
+
+    Args:
+        module_and_class (str): Fully qualified class name, e.g. "langchain_openai.ChatOpenAI".
+        class_kwargs (Dict): Constructor args (not changed).
+
+    Returns:
+        Dict: A copy of the constructor args, with the shared HTTP clients added.
+    """
+    class_kwargs = dict(class_kwargs or {})
+    if not http_client_enabled or not module_and_class:
+        return class_kwargs
+
+    if module_and_class.startswith("langchain_openai."):
+        class_kwargs.setdefault("http_client", get_shared_http_client())
+        class_kwargs.setdefault("http_async_client", get_shared_async_http_client())
+    elif module_and_class.startswith("langchain_ollama."):
+        client_kwargs = dict(class_kwargs.get("client_kwargs") or {})
+        client_kwargs.setdefault("timeout", _get_timeout())
+        class_kwargs["client_kwargs"] = client_kwargs
+        sync_client_kwargs = dict(class_kwargs.get("sync_client_kwargs") or {})
+        sync_client_kwargs.setdefault("transport", get_shared_http_transport())
+        class_kwargs["sync_client_kwargs"] = sync_client_kwargs
+        async_client_kwargs = dict(class_kwargs.get("async_client_kwargs") or {})
+        async_client_kwargs.setdefault("transport", get_shared_async_http_transport())
+        class_kwargs["async_client_kwargs"] = async_client_kwargs
+    else:
+        logger.debug(f"No shared HTTP clients for {module_and_class} - it uses its own connections")
+
+    return class_kwargs
@@ -1,14 +1,27 @@
 
 from functools import cache
-from typing import Dict, Optional
+from typing import Any, Dict, Optional, Sequence, Tuple
+from uuid import UUID
+from langchain_core.caches import BaseCache
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.messages import message_to_dict, messages_from_dict
+from langchain_core.outputs import ChatGeneration
 from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.outputs import LLMResult
 from langchain_core.embeddings import Embeddings
 from langchain_openai.embeddings import OpenAIEmbeddings
 import os
 
 from factory.factory_util import call_function_or_constructor
+from factory.http_client_factory import add_shared_http_clients_to_kwargs
+from factory.sql_database_factory import create_sql_database_connection
 from common.service.configloader import deep_get, settings
+from common.service.metrics import Counter, Histogram
+import json
 import logging
+import threading
+import time
+from common.utils.hash_util import sha256sum_str
 from common.utils.string_util import str_limit
 
 logger = logging.getLogger(__name__)
@@ -24,6 +37,8 @@ def get_document_summarizer_chat_llm() -> BaseChatModel:
     config_llm_key = deep_get(settings, "config.rag_indexing.document_summarizer_chat_llm")
     llm = setup_llm_for_config_llm_key(config_llm_key)
     logger.info(f"Setup done: config.rag_indexing.document_summarizer_chat_llm={llm}")
+    add_llm_metrics_callback(llm, "summarizer")
+    add_llm_response_cache(llm, "summarizer")
     return llm
 
 
@@ -33,6 +48,8 @@ def get_document_grader_chat_llm() -> BaseChatModel:
     config_llm_key = deep_get(settings, "config.rag_response.document_grader_chat_llm")
     llm = setup_llm_for_config_llm_key(config_llm_key)
     logger.info(f"Setup done: config.rag_response.document_grader_chat_llm={llm}")
+    add_llm_metrics_callback(llm, "grader")
+    add_llm_response_cache(llm, "grader")
     return llm
 
 @cache
@@ -40,6 +57,8 @@ def get_rewrite_question_chat_llm() -> BaseChatModel:
     config_llm_key = deep_get(settings, "config.rag_response.rewrite_question_chat_llm")
     llm = setup_llm_for_config_llm_key(config_llm_key)
     logger.info(f"Setup done: config.rag_response.rewrite_question_chat_llm={llm}")
+    add_llm_metrics_callback(llm, "rewriter")
+    add_llm_response_cache(llm, "rewriter")
     return llm
 
 
@@ -49,6 +68,8 @@ def get_default_chat_llm_without_streaming() -> BaseChatModel:
     config_llm_key = deep_get(settings, "config.rag_response.default_chat_llm")
     llm = setup_llm_for_config_llm_key(config_llm_key)
     logger.info(f"Setup done: config.rag_response.default_chat_llm={llm}")
+    add_llm_metrics_callback(llm, "default")
+    add_llm_response_cache(llm, "default")
     return llm
 
 @cache
@@ -56,12 +77,246 @@ def get_default_chat_llm_with_streaming() -> BaseChatModel:
     config_llm_key = deep_get(settings, "config.rag_response.default_chat_llm_with_streaming")
     llm = setup_llm_for_config_llm_key(config_llm_key)
     logger.info(f"Setup done: config.rag_response.default_chat_llm_with_streaming={llm}")
+    add_llm_metrics_callback(llm, "default_streaming")
+    add_llm_response_cache(llm, "default_streaming")
     return llm
 
 #
 # Helper functions for dynamic LLM setup
 #
 
+#
+# LLM call metrics (for the /metrics endpoint)
+#
+
+llm_call_duration_histogram = Histogram("rag_llm_call_duration_seconds", "Latency of LLM calls per role", ["role"])
+# result = "ok", "error" or "cache_hit" (answered by the LLM response cache: no latency and tokens recorded)
+llm_calls_counter = Counter("rag_llm_calls_total", "Number of LLM calls per role and result", ["role", "result"])
+llm_tokens_counter = Counter("rag_llm_tokens_total", "Number of LLM tokens per role and direction (input/output)", ["role", "direction"])
+
+
+class LlmMetricsCallbackHandler(BaseCallbackHandler):
+    """Record latency, result and token usage of all calls of an LLM (with a fixed role label)."""
+
+    def __init__(self, role: str):
+        self.role = role
+        self._start_times: Dict[UUID, float] = {}
+        self._lock = threading.Lock()
+
+    def _start(self, run_id: UUID) -> None:
+        with self._lock:
+            self._start_times[run_id] = time.perf_counter()
+
+    def _stop(self, run_id: UUID, result: str) -> None:
+        with self._lock:
+            start_time = self._start_times.pop(run_id, None)
+        if start_time is not None and result != "cache_hit":
+            llm_call_duration_histogram.observe(time.perf_counter() - start_time, role=self.role)
+        llm_calls_counter.inc(role=self.role, result=result)
+
+    def on_llm_start(self, serialized: Dict[str, Any], prompts: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        self._start(run_id)
+
+    def on_chat_model_start(self, serialized: Dict[str, Any], messages: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        self._start(run_id)
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs: Any) -> None:
+        if _is_llm_cache_hit(response):
+            self._stop(run_id, "cache_hit")
+            return
+        self._stop(run_id, "ok")
+        input_tokens, output_tokens = _get_token_usage(response)
+        if input_tokens:
+            llm_tokens_counter.inc(input_tokens, role=self.role, direction="input")
+        if output_tokens:
+            llm_tokens_counter.inc(output_tokens, role=self.role, direction="output")
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self._stop(run_id, "error")
+
+
+def _is_llm_cache_hit(response: LLMResult) -> bool:
+    """Was the response answered by the LLM response cache (see SqlLlmResponseCache.lookup())?"""
+    generations = [generation for generations in response.generations for generation in generations]
+    return len(generations) > 0 and all((generation.generation_info or {}).get(LLM_CACHE_HIT_GENERATION_INFO_KEY) for generation in generations)
+
+
+def _get_token_usage(response: LLMResult) -> Tuple[int, int]:
+    """(input_tokens, output_tokens) of an LLM response - 0 if the LLM doesn't report them."""
+    input_tokens = 0
+    output_tokens = 0
+    for generations in response.generations:
+        for generation in generations:
+            usage_metadata = getattr(getattr(generation, "message", None), "usage_metadata", None)
+            if usage_metadata:
+                input_tokens += usage_metadata.get("input_tokens", 0)
+                output_tokens += usage_metadata.get("output_tokens", 0)
+    if not input_tokens and not output_tokens:
+        # fallback: OpenAI-style token usage
+        token_usage = (response.llm_output or {}).get("token_usage") or {}
+        input_tokens = token_usage.get("prompt_tokens", 0) or 0
+        output_tokens = token_usage.get("completion_tokens", 0) or 0
+    return input_tokens, output_tokens
+
+
+def add_llm_metrics_callback(llm: Optional[BaseChatModel], role: str) -> None:
+    """Record metrics of all calls of the LLM, labeled with its role (e.g. 'grader')."""
+    if llm is None:
+        return
+    handler = LlmMetricsCallbackHandler(role)
+    if llm.callbacks is None:
+        llm.callbacks = [handler]
+    elif isinstance(llm.callbacks, list):
+        llm.callbacks.append(handler)
+    else:
+        llm.callbacks.add_handler(handler)
+
+
+#
+# Persistent LLM response cache (SQL DB)
+#
+# Deterministic calls (rewrites, HyDE, grades, summaries, compactions) are repeated with identical prompts.
+# Their responses are cached in the SQL DB table "llm_cache", so they survive restarts and are shared by all workers.
+#
+# The cache is plugged into the chat model instances (langchain's cache extension point),
+# so every chain/structured output built on a get_*_chat_llm() instance uses it transparently.
+# Cache key: sha256 of the model configuration (incl. bound args like tools/structured output schema)
+# and sha256 of the rendered prompt (= prompt template + input variables).
+#
+
+llm_cache_enabled = deep_get(settings, "config.common.llm_cache.enabled", default_value=False)
+llm_cache_ttl_seconds = deep_get(settings, "config.common.llm_cache.ttl_seconds", default_value=7*24*3600)
+llm_cache_max_entries = deep_get(settings, "config.common.llm_cache.max_entries", default_value=100000)
+# cleanup (TTL and max. entries) after every n-th insert
+llm_cache_cleanup_every_inserts = deep_get(settings, "config.common.llm_cache.cleanup_every_inserts", default_value=100)
+# per role, streaming/chat responses are usually not deterministic
+llm_cache_roles_enabled_by_default = {"summarizer": True, "grader": True, "rewriter": True, "default": False, "default_streaming": False}
+
+DB_TABLE_llm_cache = """CREATE TABLE IF NOT EXISTS llm_cache (
+    llm_sha256 TEXT NOT NULL,
+    prompt_sha256 TEXT NOT NULL,
+    role TEXT,
+    generations_json TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (llm_sha256, prompt_sha256)
+)"""
+DB_INDEX_llm_cache_created_at = "CREATE INDEX IF NOT EXISTS llm_cache_created_at ON llm_cache(created_at)"
+
+# marker in the generation_info of cached generations (not stored)
+LLM_CACHE_HIT_GENERATION_INFO_KEY = "llm_cache_hit"
+
+# result = "hit" or "miss"
+llm_cache_requests_counter = Counter("rag_llm_cache_requests_total", "Number of LLM response cache lookups per role and result", ["role", "result"])
+
+
+class SqlLlmResponseCache(BaseCache):
+    """LLM response cache in the SQL DB, with TTL and max. number of entries."""
+
+    def __init__(self, role: str, sqlConnection = None):
+        """
+        Args:
+            role (str): Role of the LLM (for metrics and cleanup only, not part of the cache key).
+            sqlConnection: SQL DB connection, shared by all roles (with own transactions).
+        """
+        self.role = role
+        self._sqlCon = sqlConnection if sqlConnection is not None else _get_llm_cache_sql_database_connection()
+
+    def lookup(self, prompt: str, llm_string: str) -> Optional[Sequence[Any]]:
+        with _llm_cache_lock:
+            cursor = self._sqlCon.cursor()
+            cursor.execute("SELECT generations_json FROM llm_cache WHERE llm_sha256=? AND prompt_sha256=? AND created_at>=?",
+                           (sha256sum_str(llm_string), sha256sum_str(prompt), time.time() - llm_cache_ttl_seconds))
+            row = cursor.fetchone()
+            cursor.close()
+        if row is None:
+            llm_cache_requests_counter.inc(role=self.role, result="miss")
+            return None
+        try:
+            generations = [ChatGeneration(message=messages_from_dict([generation["message"]])[0],
+                                          generation_info={**(generation.get("generation_info") or {}), LLM_CACHE_HIT_GENERATION_INFO_KEY: True})
+                           for generation in json.loads(row[0])]
+        except Exception as e:
+            logger.warning(f"LLM cache ({self.role}): ignore unreadable entry: {e}")
+            llm_cache_requests_counter.inc(role=self.role, result="miss")
+            return None
+        llm_cache_requests_counter.inc(role=self.role, result="hit")
+        return generations
+
+    def update(self, prompt: str, llm_string: str, return_val: Sequence[Any]) -> None:
+        global _llm_cache_inserts
+        if not all(isinstance(generation, ChatGeneration) for generation in return_val):
+            return
+        generations_json = json.dumps([{"message": message_to_dict(generation.message),
+                                        "generation_info": {key: value for key, value in (generation.generation_info or {}).items()
+                                                            if key != LLM_CACHE_HIT_GENERATION_INFO_KEY} or None}
+                                       for generation in return_val], default=str)
+        with _llm_cache_lock:
+            cursor = self._sqlCon.cursor()
+            llm_sha256 = sha256sum_str(llm_string)
+            prompt_sha256 = sha256sum_str(prompt)
+            cursor.execute("DELETE FROM llm_cache WHERE llm_sha256=? AND prompt_sha256=?", (llm_sha256, prompt_sha256))
+            cursor.execute("INSERT INTO llm_cache (llm_sha256, prompt_sha256, role, generations_json, created_at) VALUES (?, ?, ?, ?, ?)",
+                           (llm_sha256, prompt_sha256, self.role, generations_json, time.time()))
+            self._sqlCon.commit()
+            cursor.close()
+            _llm_cache_inserts += 1
+            if llm_cache_cleanup_every_inserts > 0 and _llm_cache_inserts % llm_cache_cleanup_every_inserts == 0:
+                self._cleanup()
+
+    def clear(self, **kwargs: Any) -> None:
+        """Remove all cached responses of this role."""
+        with _llm_cache_lock:
+            self._sqlCon.execute("DELETE FROM llm_cache WHERE role=?", (self.role,))
+            self._sqlCon.commit()
+
+    def _cleanup(self) -> None:
+        """Remove expired entries, and the oldest entries above max. entries (caller holds the lock)."""
+        cursor = self._sqlCon.cursor()
+        cursor.execute("DELETE FROM llm_cache WHERE created_at<?", (time.time() - llm_cache_ttl_seconds,))
+        expired_count = cursor.rowcount
+        cursor.execute("SELECT created_at FROM llm_cache ORDER BY created_at DESC LIMIT 1 OFFSET ?", (llm_cache_max_entries,))
+        row = cursor.fetchone()
+        evicted_count = 0
+        if row is not None:
+            cursor.execute("DELETE FROM llm_cache WHERE created_at<=?", (row[0],))
+            evicted_count = cursor.rowcount
+        self._sqlCon.commit()
+        cursor.close()
+        logger.debug(f"LLM cache cleanup: removed {expired_count} expired and {evicted_count} oldest entries")
+
+
+_llm_cache_lock = threading.Lock()
+_llm_cache_inserts = 0
+
+@cache
+def _get_llm_cache_sql_database_connection():
+    # own connection: commits of the cache must not interfere with the transactions of the indexing
+    sqlCon = create_sql_database_connection()
+    sqlCon.execute(DB_TABLE_llm_cache)
+    sqlCon.execute(DB_INDEX_llm_cache_created_at)
+    sqlCon.commit()
+    return sqlCon
+
+
+def is_llm_response_cache_enabled(role: str) -> bool:
+    """Is the LLM response cache enabled for the role? (config.common.llm_cache.enabled and config.common.llm_cache.roles.<role>)"""
+    if not llm_cache_enabled:
+        return False
+    return bool(deep_get(settings, f"config.common.llm_cache.roles.{role}",
+                         default_value=llm_cache_roles_enabled_by_default.get(role, False)))
+
+
+def add_llm_response_cache(llm: Optional[BaseChatModel], role: str) -> None:
+    """Cache the responses of the LLM in the SQL DB, if enabled for its role (e.g. 'grader')."""
+    if llm is None or not is_llm_response_cache_enabled(role):
+        return
+    try:
+        llm.cache = SqlLlmResponseCache(role)
+        logger.info(f"Setup done: LLM response cache for role '{role}' (ttl_seconds={llm_cache_ttl_seconds}, max_entries={llm_cache_max_entries})")
+    except Exception as e:
+        logger.error(f"LLM response cache setup for role '{role}' failed - continue without: {e}")
+
+
 def setup_llm_for_config_llm_key(config_llm_key: str) -> Optional[BaseChatModel]:
     logger.info(f"Setup LLM from config_llm_key: {config_llm_key}")
     llm_config = deep_get(settings, f"config.common.chat_llms.{config_llm_key}")
@@ -106,6 +361,9 @@ def setup_llm_for_config(
         # remove the auth from class_kwargs
         del class_kwargs["kwargs_header_authorization"]
 
+    # use the shared (pooled) HTTP connections
+    class_kwargs = add_shared_http_clients_to_kwargs(module_and_class, class_kwargs)
+
     # Action: Create instance
     return call_function_or_constructor(module_and_class, class_kwargs, context_str_for_logging)
 
@@ -136,6 +394,9 @@ def get_default_embeddings() -> Embeddings:
         # remove the auth from class_kwargs
         del class_kwargs["kwargs_header_authorization"]
 
+    # use the shared (pooled) HTTP connections
+    class_kwargs = add_shared_http_clients_to_kwargs(module_and_class, class_kwargs)
+
     # Action: Create instance
     return call_function_or_constructor(module_and_class, class_kwargs, context_str_for_logging)
 
@@ -0,0 +1,195 @@
+
+from dataclasses import dataclass
+from functools import cache
+from typing import Callable, Dict, List, Optional
+import threading
+import time
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.embeddings import Embeddings
+
+from factory.llm_factory import (
+    get_default_embeddings,
+    get_document_grader_chat_llm,
+    get_document_summarizer_chat_llm,
+    get_rewrite_question_chat_llm,
+    init_tiktiken_cache,
+)
+from common.service.configloader import deep_get, settings
+from common.service.metrics import Gauge
+import logging
+from common.utils.string_util import str_limit
+
+logger = logging.getLogger(__name__)
+
+
+#
+# Health state of the configured LLMs and embedding model.
+#
+# The results of the (cheap) probes are cached with a TTL and refreshed in the background,
+# so callers (e.g. the indexing loop) can check the readiness of single models without waiting.
+#
+
+healthy_ttl_seconds = deep_get(settings, "config.common.llm_health.healthy_ttl_seconds", default_value=300)
+unhealthy_ttl_seconds = deep_get(settings, "config.common.llm_health.unhealthy_ttl_seconds", default_value=30)
+background_refresh_seconds = deep_get(settings, "config.common.llm_health.background_refresh_seconds", default_value=60)
+
+# Model names
+MODEL_EMBEDDINGS = "embeddings"
+MODEL_SUMMARIZER = "summarizer"
+MODEL_GRADER = "grader"
+MODEL_REWRITER = "rewriter"
+
+llm_healthy_gauge = Gauge("rag_llm_healthy", "Result of the last health probe per model (1 = healthy, 0 = unhealthy)", ["model"])
+
+
+@dataclass
+class ModelHealth:
+    model: str
+    healthy: bool
+    checked_at: float           # time.monotonic()
+    latency_seconds: float
+    error: Optional[str] = None
+
+    def is_fresh(self) -> bool:
+        ttl_seconds = healthy_ttl_seconds if self.healthy else unhealthy_ttl_seconds
+        return time.monotonic() - self.checked_at < ttl_seconds
+
+    def to_dict(self) -> Dict:
+        return {
+            "healthy": self.healthy,
+            "checked_seconds_ago": round(time.monotonic() - self.checked_at, 1),
+            "latency_seconds": round(self.latency_seconds, 3),
+            "error": self.error,
+        }
+
+
+class LlmHealthService:
+    """
+    Per-model health state with TTL-cached probe results.
+    """
+
+    def __init__(self, probes: Dict[str, Callable[[], None]]):
+        """
+        Args:
+            probes: model name -> probe function, which raises an exception if the model is not usable.
+        """
+        self._probes = probes
+        self._states: Dict[str, ModelHealth] = {}
+        self._lock = threading.Lock()
+        self._probe_locks: Dict[str, threading.Lock] = {model: threading.Lock() for model in probes}
+        self._background_thread: Optional[threading.Thread] = None
+
+    def models(self) -> List[str]:
+        return list(self._probes.keys())
+
+    def get_health(self, model: str) -> ModelHealth:
+        """Health state of a model - probed now if there is no fresh cached result."""
+        with self._lock:
+            state = self._states.get(model)
+        if state is not None and state.is_fresh():
+            return state
+        return self._probe(model)
+
+    def is_ready(self, model: str) -> bool:
+        """Is the model healthy? (probed now if there is no fresh cached result)"""
+        return self.get_health(model).healthy
+
+    def get_cached_states(self) -> Dict[str, Dict]:
+        """The last probe results of all models - without probing (e.g. for a health endpoint)."""
+        with self._lock:
+            return {model: state.to_dict() for model, state in self._states.items()}
+
+    def refresh_all(self) -> None:
+        """Probe all models whose cached result is not fresh anymore."""
+        for model in self._probes:
+            self.get_health(model)
+
+    def start_background_refresh(self) -> None:
+        """Refresh the health states in a background thread (once started, it runs forever)."""
+        if self._background_thread is not None or background_refresh_seconds <= 0:
+            return
+        self._background_thread = threading.Thread(target=self._background_refresh_loop, name="llm-health-refresh", daemon=True)
+        self._background_thread.start()
+
+    def _background_refresh_loop(self) -> None:
+        while True:
+            try:
+                self.refresh_all()
+            except Exception as e:
+                logger.warning(f"Error while refreshing LLM health states: {e}")
+            time.sleep(background_refresh_seconds)
+
+    def _probe(self, model: str) -> ModelHealth:
+        # Only one probe per model at the same time, others wait for its result
+        with self._probe_locks[model]:
+            with self._lock:
+                state = self._states.get(model)
+            if state is not None and state.is_fresh():
+                return state
+
+            start_time = time.perf_counter()
+            try:
+                self._probes[model]()
+                state = ModelHealth(model=model, healthy=True, checked_at=time.monotonic(), latency_seconds=time.perf_counter() - start_time)
+                logger.debug(f"LLM health probe of '{model}' successful ({state.latency_seconds:.2f}s)")
+            except Exception as e:
+                state = ModelHealth(model=model, healthy=False, checked_at=time.monotonic(), latency_seconds=time.perf_counter() - start_time,
+                                    error=str_limit(str(e), 300))
+                logger.error(f"LLM health probe of '{model}' failed: {e}")
+            with self._lock:
+                previous_state = self._states.get(model)
+                self._states[model] = state
+            if previous_state is not None and previous_state.healthy != state.healthy:
+                logger.warning(f"LLM '{model}' is now {'healthy' if state.healthy else 'UNHEALTHY'}")
+            llm_healthy_gauge.set(1 if state.healthy else 0, model=model)
+            return state
+
+
+#
+# Cheap probes
+#
+
+def get_cheap_probe_chat_llm(llm: BaseChatModel) -> BaseChatModel:
+    """
+    A copy of the chat LLM that generates a single token only, if the LLM class supports it
+    (Ollama: num_predict, OpenAI-compatible: max_tokens).
+    """
+    # without the LLM response cache: a probe must reach the LLM
+    model_fields = type(llm).model_fields
+    if "num_predict" in model_fields:
+        return llm.model_copy(update={"num_predict": 1, "cache": False})
+    if "max_tokens" in model_fields:
+        return llm.model_copy(update={"max_tokens": 1, "cache": False})
+    return llm.model_copy(update={"cache": False})
+
+
+def create_chat_llm_probe(get_llm: Callable[[], Optional[BaseChatModel]]) -> Callable[[], None]:
+    def probe() -> None:
+        llm = get_llm()
+        if llm is None:
+            raise ValueError("LLM setup failed")
+        get_cheap_probe_chat_llm(llm).invoke("Hi")
+    return probe
+
+
+def create_embeddings_probe(get_embeddings: Callable[[], Optional[Embeddings]]) -> Callable[[], None]:
+    def probe() -> None:
+        embeddings = get_embeddings()
+        if embeddings is None:
+            raise ValueError("Embeddings setup failed")
+        embeddings.embed_query("Hi")
+    return probe
+
+
+@cache
+def get_llm_health_service() -> LlmHealthService:
+    init_tiktiken_cache()
+    health_service = LlmHealthService({
+        MODEL_EMBEDDINGS: create_embeddings_probe(get_default_embeddings),
+        MODEL_SUMMARIZER: create_chat_llm_probe(get_document_summarizer_chat_llm),
+        MODEL_GRADER: create_chat_llm_probe(get_document_grader_chat_llm),
+        MODEL_REWRITER: create_chat_llm_probe(get_rewrite_question_chat_llm),
+    })
+    logger.info(f"Setup done: LLM health service for models {health_service.models()}")
+    return health_service
@@ -1,4 +1,11 @@
+from contextlib import contextmanager
 from functools import cache
+from typing import Callable, Dict, Iterator, List, Optional, TypeVar
+import asyncio
+import queue
+import re
+import threading
+import weakref
 
 # partitially based on idea of
 #   https://stackoverflow.com/questions/52534211/python-type-hinting-with-db-api/77350678#77350678 and
@@ -22,8 +29,8 @@ logger = logging.getLogger(__name__)
 # Uses PEP 249 - Database API Specification 2.0 - https://peps.python.org/pep-0249/
 #
 
-@cache
-def get_sql_database_connection() -> DBAPIConnection:
+def create_sql_database_connection() -> DBAPIConnection:
+    """Create a new (not shared) SQL database connection - usually via the connection pool, see get_sql_connection_pool()."""
     # Start
     config_sql_database = deep_get(settings, "config.common.databases.sql_database")
     context_str_for_logging = f"Setup SQL Database connection: {config_sql_database}"
@@ -44,4 +51,231 @@ def get_sql_database_connection() -> DBAPIConnection:
                 os.makedirs(db_dir)
 
     # Action: Create instance
-    return call_function_or_constructor(module_and_connect_func, connect_func_kwargs, context_str_for_logging)
+    sqlConnection = call_function_or_constructor(module_and_connect_func, connect_func_kwargs, context_str_for_logging)
+    if module_and_connect_func == "sqlite3.connect" and sqlConnection is not None:
+        configure_sqlite_connection(sqlConnection, deep_get(config_sql_database, "sqlite_settings", default_value={}) or {})
+    return sqlConnection
+
+
+def configure_sqlite_connection(sqlConnection: DBAPIConnection, sqlite_settings: Dict) -> None:
+    """
+    Tune a SQLite connection for concurrent indexing and searches:
+    WAL mode (readers don't block the writer and vice versa), synchronous=NORMAL (no fsync per commit in WAL mode,
+    durable after the next checkpoint), a larger page cache and memory-mapped I/O.
+
+    Args:
+        sqlConnection: sqlite3 connection
+        sqlite_settings (Dict): config.common.databases.sql_database.sqlite_settings
+    """
+    journal_mode = deep_get(sqlite_settings, "journal_mode", default_value="WAL")
+    synchronous = deep_get(sqlite_settings, "synchronous", default_value="NORMAL")
+    cache_size_kib = int(deep_get(sqlite_settings, "cache_size_kib", default_value=64*1024))
+    mmap_size_mib = int(deep_get(sqlite_settings, "mmap_size_mib", default_value=256))
+    busy_timeout_millis = int(deep_get(sqlite_settings, "busy_timeout_millis", default_value=5000))
+
+    if not re.fullmatch(r"[A-Za-z]+", journal_mode) or not re.fullmatch(r"[A-Za-z]+", synchronous):
+        raise ValueError(f"Invalid sqlite_settings: journal_mode={journal_mode}, synchronous={synchronous}")
+    effective_journal_mode = sqlConnection.execute(f"PRAGMA journal_mode={journal_mode}").fetchone()[0]
+    sqlConnection.execute(f"PRAGMA synchronous={synchronous}")
+    # negative value: in KiB instead of pages
+    sqlConnection.execute(f"PRAGMA cache_size=-{cache_size_kib}")
+    sqlConnection.execute(f"PRAGMA mmap_size={mmap_size_mib*1024*1024}")
+    sqlConnection.execute(f"PRAGMA busy_timeout={busy_timeout_millis}")
+    logger.info(f"SQLite settings: journal_mode={effective_journal_mode}, synchronous={synchronous}, cache_size_kib={cache_size_kib}, mmap_size_mib={mmap_size_mib}, busy_timeout_millis={busy_timeout_millis}")
+
+
+#
+# Connection pools
+#
+# DB-API connections must not be used by multiple threads at the same time.
+# The pool provides connections for the indexing workers and the search requests, so they can use the SQL DB concurrently:
+#
+#   with get_sql_connection_pool().connection() as sqlConnection:     # short use, e.g. a query of a request
+#       ...
+#   sqlConnection = get_sql_connection_pool().thread_connection()     # pinned to the current thread, e.g. transactions of a worker
+#
+#   await get_async_sql_connection_pool().run(func, arg1, ...)        # func(sqlConnection, arg1, ...) in a worker thread
+#
+
+sql_pool_max_connections = deep_get(settings, "config.common.databases.sql_database.pool.max_connections", default_value=8)
+sql_pool_timeout_seconds = deep_get(settings, "config.common.databases.sql_database.pool.timeout_seconds", default_value=30)
+
+T = TypeVar("T")
+
+
+class SqlConnectionPool:
+    """Base class of the SQL connection pools."""
+
+    def __init__(self, create_connection: Callable[[], DBAPIConnection]):
+        self._create_connection = create_connection
+        self._thread_local = threading.local()
+        self._lock = threading.Lock()
+        self._all_connections: List[DBAPIConnection] = []
+
+    @contextmanager
+    def connection(self) -> Iterator[DBAPIConnection]:
+        """
+        A connection for a short use - uncommitted changes are rolled back if an exception is raised,
+        except pending changes of the current thread on its pinned connection (from before the short use).
+        """
+        raise NotImplementedError()
+
+    def thread_connection(self) -> DBAPIConnection:
+        """The connection pinned to the current thread (created on first use, released when the thread ends)."""
+        sqlConnection = getattr(self._thread_local, "connection", None)
+        if sqlConnection is None:
+            sqlConnection = self._acquire()
+            self._thread_local.connection = sqlConnection
+            weakref.finalize(threading.current_thread(), self._release, sqlConnection)
+        return sqlConnection
+
+    def close_all(self) -> None:
+        """Close all connections (e.g. at shutdown)."""
+        with self._lock:
+            all_connections, self._all_connections = self._all_connections, []
+        for sqlConnection in all_connections:
+            try:
+                sqlConnection.close()
+            except Exception as e:
+                logger.debug(f"Closing SQL DB connection failed: {e}")
+
+    def _new_connection(self) -> DBAPIConnection:
+        sqlConnection = self._create_connection()
+        with self._lock:
+            self._all_connections.append(sqlConnection)
+        return sqlConnection
+
+    def _acquire(self) -> DBAPIConnection:
+        raise NotImplementedError()
+
+    def _release(self, sqlConnection: DBAPIConnection) -> None:
+        raise NotImplementedError()
+
+
+class ThreadLocalSqlConnectionPool(SqlConnectionPool):
+    """
+    One connection per thread - for SQLite (connections are cheap, WAL mode allows concurrent readers and a writer).
+    """
+
+    @contextmanager
+    def connection(self) -> Iterator[DBAPIConnection]:
+        sqlConnection = self.thread_connection()
+        # uncommitted work of the thread (e.g. of an indexing worker) before this short use: not rolled back by it
+        outer_transaction = getattr(sqlConnection, "in_transaction", True)
+        try:
+            yield sqlConnection
+        except BaseException:
+            if not outer_transaction:
+                sqlConnection.rollback()
+            raise
+
+    def _acquire(self) -> DBAPIConnection:
+        return self._new_connection()
+
+    def _release(self, sqlConnection: DBAPIConnection) -> None:
+        # the thread ended
+        with self._lock:
+            if sqlConnection in self._all_connections:
+                self._all_connections.remove(sqlConnection)
+        try:
+            sqlConnection.close()
+        except Exception:
+            pass
+
+
+class QueueSqlConnectionPool(SqlConnectionPool):
+    """
+    Bounded pool of reused connections - for database servers (PostgreSQL/psycopg2, MySQL, MariaDB).
+    """
+
+    def __init__(self, create_connection: Callable[[], DBAPIConnection], max_connections: int, timeout_seconds: Optional[float]):
+        super().__init__(create_connection)
+        self.max_connections = max(1, max_connections)
+        self.timeout_seconds = timeout_seconds
+        self._idle_connections: "queue.LifoQueue[DBAPIConnection]" = queue.LifoQueue()
+        self._connection_count = 0
+
+    @contextmanager
+    def connection(self) -> Iterator[DBAPIConnection]:
+        pinned_connection = getattr(self._thread_local, "connection", None)
+        if pinned_connection is not None:
+            # the thread already has its own connection: don't take a second one from the pool
+            yield pinned_connection
+            return
+        sqlConnection = self._acquire()
+        try:
+            yield sqlConnection
+        except BaseException:
+            sqlConnection.rollback()
+            raise
+        finally:
+            self._release(sqlConnection)
+
+    def _acquire(self) -> DBAPIConnection:
+        try:
+            return self._idle_connections.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            create_new = self._connection_count < self.max_connections
+            if create_new:
+                self._connection_count += 1
+        if create_new:
+            try:
+                return self._new_connection()
+            except BaseException:
+                with self._lock:
+                    self._connection_count -= 1
+                raise
+        try:
+            return self._idle_connections.get(timeout=self.timeout_seconds)
+        except queue.Empty:
+            raise TimeoutError(f"No SQL DB connection available within {self.timeout_seconds} seconds (max_connections={self.max_connections})")
+
+    def _release(self, sqlConnection: DBAPIConnection) -> None:
+        try:
+            # end a (read) transaction, so the connection doesn't keep old snapshots/locks
+            sqlConnection.rollback()
+        except Exception as e:
+            logger.warning(f"Discard broken SQL DB connection: {e}")
+            with self._lock:
+                self._connection_count -= 1
+                if sqlConnection in self._all_connections:
+                    self._all_connections.remove(sqlConnection)
+            return
+        self._idle_connections.put(sqlConnection)
+
+
+class AsyncSqlConnectionPool:
+    """
+    Async variant of a connection pool: the blocking DB-API calls run in worker threads,
+    each with a connection of the underlying pool.
+    """
+
+    def __init__(self, pool: SqlConnectionPool):
+        self.pool = pool
+
+    async def run(self, func: Callable[..., T], *args) -> T:
+        """Run func(sqlConnection, *args) in a worker thread and return its result."""
+        return await asyncio.to_thread(self._run_with_connection, func, *args)
+
+    def _run_with_connection(self, func: Callable[..., T], *args) -> T:
+        with self.pool.connection() as sqlConnection:
+            return func(sqlConnection, *args)
+
+
+@cache
+def get_sql_connection_pool() -> SqlConnectionPool:
+    """The connection pool of the configured SQL database (config.common.databases.sql_database)."""
+    module_and_connect_func = deep_get(settings, "config.common.databases.sql_database.connect")
+    if module_and_connect_func == "sqlite3.connect":
+        pool = ThreadLocalSqlConnectionPool(create_sql_database_connection)
+    else:
+        pool = QueueSqlConnectionPool(create_sql_database_connection, sql_pool_max_connections, sql_pool_timeout_seconds)
+    logger.info(f"Setup done: SQL DB connection pool {type(pool).__name__} for {module_and_connect_func}")
+    return pool
+
+
+@cache
+def get_async_sql_connection_pool() -> AsyncSqlConnectionPool:
+    return AsyncSqlConnectionPool(get_sql_connection_pool())
@@ -18,10 +18,14 @@ from factory.factory_util import call_function_or_constructor
 from factory.llm_factory import get_default_embeddings
 from index_builder_basics.embeddings_cache import get_cached_default_embeddings
 from common.service.configloader import deep_get, settings
+from common.service.metrics import Histogram
 import logging
 
 logger = logging.getLogger(__name__)
 
+# operation = "insert" or "query"
+vectorstore_operation_duration_histogram = Histogram("rag_vectorstore_operation_duration_seconds", "Latency of vectorstore operations", ["operation"])
+
 
 #
 # vectorstore instance and its setup
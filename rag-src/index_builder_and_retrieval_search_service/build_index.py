@@ -22,19 +22,34 @@ import threading
 import time
 from langchain_core.vectorstores import VectorStore
 from common.service.configloader import deep_get, settings
-from factory.llm_factory import test_all_llm_and_embedding_llm_connections
+from factory.llm_health import get_llm_health_service, MODEL_EMBEDDINGS
 from langchain_core.documents import Document
+from langchain_core.documents.base import Blob
 from common.service.logging_tools import plob2str
+from common.service.metrics import Counter, Gauge, Histogram
 import logging
 
 from common.utils.hash_util import sha256sum_str
 from common.utils.string_util import str_limit
 import queue
 
-from .document_storage import save_single_plob_and_its_documents_in_databases
-from index_builder_basics.document_storage_sql_database import print_all_from_sqldb
+from .document_storage import save_single_plob_and_its_documents_in_databases, save_single_streamed_plob_and_its_documents_in_databases
+from index_builder_basics.document_storage_sql_database import print_all_from_sqldb, get_sql_database_connection_after_setup
+from index_builder_basics.text_store import train_text_dictionary_if_necessary
+from index_builder_basics.document_gc import run_document_gc_if_due
+from index_builder_basics.page_store import PlobPage, load_plob_pages_from_sqldb
 from factory.vectorstore_factory import print_vectorstore_stats
 from .document_splitter_and_summarizer import improve_and_split_single_document_into_parts
+from .document_splitter import split_single_document_into_parts_if_needed
+from .process_pool_stage import is_process_pool_stage_enabled, map_in_process_pool
+from .page_change_detection import (
+    get_page_processing_signature,
+    is_page_processed_completely,
+    page_change_detection_pages_counter,
+    page_documents_from_json,
+    page_documents_to_json,
+)
+from .loader_and_parser.blob_parser_document_loader import parse_blob_to_plob
 from common.plob_creator import create_virtual_plob
 from model.plob import Plob
 from common.utils.string_util import str_limit
@@ -43,6 +58,7 @@ logger = logging.getLogger(__name__)
 
 rag_loading_enabled = deep_get(settings, "config.rag_loading.enabled", default_value=False)
 log_all_data_in_sqldb_after_indexing = deep_get(settings, "config.rag_indexing.log_all_data_in_sqldb_after_indexing", default_value=False)
+pdf_page_streaming_pages_per_batch = max(1, deep_get(settings, "config.rag_indexing.pdf_page_streaming.pages_per_batch", default_value=10))
 
 
 #sqlCon: DBAPIConnection | None = None
@@ -53,6 +69,19 @@ vectorStoreRetriever = None
 # in-memory queue of downloaded plocs with documents to process
 downloadedPlogsToProcessQueue = queue.Queue()
 
+#
+# Indexing metrics (for the /metrics endpoint)
+#
+indexing_queue_depth_gauge = Gauge("rag_indexing_queue_depth", "Number of downloaded plobs waiting in the queue to be processed")
+indexing_queue_depth_gauge.set_function(downloadedPlogsToProcessQueue.qsize)
+indexing_runs_counter = Counter("rag_indexing_runs_total", "Number of indexing runs per result", ["result"])
+indexing_run_duration_histogram = Histogram("rag_indexing_run_duration_seconds", "Duration of indexing runs",
+                                            buckets=(10, 30, 60, 300, 600, 1800, 3600, 7200, 21600, 86400))
+indexing_plobs_counter = Counter("rag_indexing_plobs_processed_total", "Number of processed plobs per result", ["result"])
+indexing_chunks_counter = Counter("rag_indexing_chunks_processed_total", "Number of stored documents / parts (chunks) of processed plobs")
+indexing_last_run_plobs_gauge = Gauge("rag_indexing_last_run_plobs", "Number of successfully processed plobs in the last indexing run")
+indexing_last_run_chunks_gauge = Gauge("rag_indexing_last_run_chunks", "Number of stored documents / parts (chunks) in the last indexing run")
+
 # Lazy loading of plobs/documents: don't do this for better understanding of the logging output
 # If you want to lazy load plobs/documents, set this to True.
 minimize_lazyness = True
@@ -80,14 +109,17 @@ def start_indexing():
 
 def indexing_endless_loop_worker():
     load_every_seconds = deep_get(settings, "config.rag_loading.load_every_seconds")
+    llm_health_service = get_llm_health_service()
+    llm_health_service.start_background_refresh()
 
     while True:
         # Preparation
         starttime = time.time()
 
-        # Almost action
-        if test_all_llm_and_embedding_llm_connections():
-            logger.info("===== All LLM and embedding connections are working. Starting indexing run ...")
+        # Almost action: only the embedding model is required,
+        # optional steps with unhealthy LLMs (e.g. summaries) are skipped during the run
+        if llm_health_service.is_ready(MODEL_EMBEDDINGS):
+            logger.info(f"===== Embedding connection is working (LLM health: {llm_health_service.get_cached_states()}). Starting indexing run ...")
 
             if rag_loading_enabled:
                 # Action
@@ -95,7 +127,10 @@ def indexing_endless_loop_worker():
             else:
                 logger.warning("===== rag_loading.enabled=False. Skipping indexing run ...")
         else:
-            logger.error("===== One or more LLM or embedding connections are not working. Skipping indexing run ...")
+            logger.error("===== Embedding connection is not working. Skipping indexing run ...")
+
+        # Retention of the cache rows in the SQL DB (if due) - between the indexing runs
+        run_document_gc_if_due(get_sql_database_connection_after_setup())
 
         # Finish this round
         now = time.time()
@@ -113,6 +148,7 @@ def indexing_single_run():
     global indexing_single_run_counter
     global minimize_lazyness
 
+    starttime = time.perf_counter()
     try:
 
         # "index_build_id" to identify this run,
@@ -140,15 +176,17 @@ def indexing_single_run():
             # Better logging output, but slower
             # (because loading and processing is done sequentially)
             logger.info(f"===== NO lazy loading of Plobs and their document parts (#{indexing_single_run_counter}, '{index_build_id}') =====")
-            download_all_documents_and_put_them_into_queue()
+            download_all_documents_and_put_them_into_queue(index_build_id)
         else:
             # Faster, but more complex logging output
             # (because loading and processing is mixed)
             logger.info(f"===== LAYZ LOADING of Plobs and their document parts (#{indexing_single_run_counter}, '{index_build_id}') =====")
-            threading.Thread(target=download_all_documents_and_put_them_into_queue, args=(), daemon=False).start()
+            threading.Thread(target=download_all_documents_and_put_them_into_queue, args=(index_build_id,), daemon=False).start()
 
         # process all documents from the queue
-        process_all_plobs_from_queue_worker(index_build_id)
+        plobs_count, chunks_count = process_all_plobs_from_queue_worker(index_build_id)
+        indexing_last_run_plobs_gauge.set(plobs_count)
+        indexing_last_run_chunks_gauge.set(chunks_count)
 
         # wait until all documents are completely processed - needed before we can clean the vectorStore
         downloadedPlogsToProcessQueue.join()
@@ -169,6 +207,12 @@ def indexing_single_run():
         logger.info(f"===== RESULTS AFTER CLEANUP (#{indexing_single_run_counter}, '{index_build_id}') =====")
         print_vectorstore_stats()
 
+        # optional shared compression dictionary of the text store (used from now on for new texts)
+        try:
+            train_text_dictionary_if_necessary(get_sql_database_connection_after_setup())
+        except Exception as e:
+            logger.warning(f"Training of the text store dictionary failed: {e}")
+
         # single run done
         logger.info(f"===== ")
         logger.info(f"===== ")
@@ -187,12 +231,17 @@ def indexing_single_run():
         #logger.info(f"vectorStore = {vectorStore}")
         logger.info(f"===== END (#{indexing_single_run_counter}, '{index_build_id}') =====")
         indexing_single_run_counter += 1
+        indexing_runs_counter.inc(result="ok")
 
     except Exception as e:
         logger.error(f"Error during indexing run (#{indexing_single_run_counter}, '{index_build_id}'): {e}")
+        indexing_runs_counter.inc(result="error")
 
+    finally:
+        indexing_run_duration_histogram.observe(time.perf_counter() - starttime)
 
-def download_all_documents_and_put_them_into_queue():
+
+def download_all_documents_and_put_them_into_queue(index_build_id: str):
     logger.info(f"== download_all_documents_and_put_them_into_queue(): Loading ...")
     global minimize_lazyness
 
@@ -207,13 +256,18 @@ def download_all_documents_and_put_them_into_queue():
                 logger.info(f"==")
                 logger.info(f"== Lazy loading plobs using ... {document_loader_info_str}")
                 logger.info(f"==")
-                plobs = document_loader.lazy_load_plobs()
+                if is_process_pool_stage_enabled() and hasattr(document_loader, "yield_blobs"):
+                    # Parse and split in worker processes (CPU-bound)
+                    plobs = parse_and_split_blobs_in_process_pool_stage(index_build_id, document_loader)
+                else:
+                    plobs = document_loader.lazy_load_plobs()
                 if minimize_lazyness:
                     # Un-lazy
                     plobs = list(plobs)
                     for plob in plobs:
-                        # Un-lazy documents in plob
-                        plob.documents = list(plob.documents)
+                        # Un-lazy documents in plob (streamed documents are parsed page by page while processed)
+                        if not plob.documents_streamed:
+                            plob.documents = list(plob.documents)
                 put_downloaded_plobs_into_queue(document_loader_info_str, plobs)
                 logger.info(f"== Lazy loading plobs + putting into queue plobs ... {document_loader_info_str}")
             else:
@@ -260,7 +314,16 @@ def put_downloaded_plobs_into_queue(context_str: str, plobs: Iterator[Plob]):
     logger.info(f"== END {context_str} ... after {counter} documents")
 
 
-def process_all_plobs_from_queue_worker(index_build_id: str):
+def process_all_plobs_from_queue_worker(index_build_id: str) -> Tuple[int, int]:
+    """
+    Process all plobs from the queue until the end signal (None) is received.
+
+    Returns:
+        Tuple[int, int]: Number of successfully processed plobs and number of their stored documents / parts.
+    """
+    plobs_count = 0
+    chunks_count = 0
+
     logger.info(f"==")
     logger.info(f"==")
     logger.info(f"== Split and save documents in databases - START")
@@ -288,13 +351,18 @@ def process_all_plobs_from_queue_worker(index_build_id: str):
                     try:
                         retry_count += 1
                         logger.info(f"Next plob with documents from queue: Processing plob (re/try {retry_count}) ... {plob_str}")
-                        process_single_plob_and_store_results_in_databases(index_build_id, plob)
+                        plob_chunks_count = process_single_plob_and_store_results_in_databases(index_build_id, plob)
+                        plobs_count += 1
+                        chunks_count += plob_chunks_count
+                        indexing_plobs_counter.inc(result="ok")
+                        indexing_chunks_counter.inc(plob_chunks_count)
                         # Exit retry-loop because processing was successful
                         break  
                     except Exception as e:
                         logger.warning(f"Error while processing plob: {e} (retry {retry_count}/{max_retries})", exc_info=True)
                         if retry_count >= max_retries:
                             logger.warning(f"Failed to process plob after {max_retries} retries: {plob_str} - continue with next plob")
+                            indexing_plobs_counter.inc(result="failed")
                             break  # Exit retry-loop and continue with next plob
                         # Sleep before retrying
                         seconds_before_next_retry = 5 ** retry_count
@@ -309,7 +377,53 @@ def process_all_plobs_from_queue_worker(index_build_id: str):
             downloadedPlogsToProcessQueue.task_done()
             continue
 
-    logger.info("== Split and save documents in databases - END")
+    logger.info(f"== Split and save documents in databases - END: {plobs_count} plobs with {chunks_count} documents / parts")
+    return plobs_count, chunks_count
+
+#
+# parsing and splitting blobs in the process pool stage
+#
+
+def parse_and_split_blobs_in_process_pool_stage(index_build_id: str, document_loader: BaseLoader) -> Iterator[Plob]:
+    """
+    Parse the blobs of a BlobParserDocumentLoader and split their documents - in worker processes
+    (in-process for blobs with in-memory data, and as fallback).
+
+    Returns: the plobs with their documents and document_splits, in the order of the blobs
+    """
+    results = map_in_process_pool(parse_and_split_blob,
+                                  document_loader.yield_blobs(),
+                                  args=(document_loader.blobParser, index_build_id),
+                                  in_process=lambda blob: blob.data is not None or blob.path is None)
+    for blob, plob, error in results:
+        if error is not None:
+            logger.warning(f"Error while parsing blob {blob}: {error} - continue with next")
+            continue
+        documents_count = "streamed" if plob.documents_streamed else len(plob.documents)
+        logger.info(f"Extracted and split plob - yielded now: {plob} with {documents_count} documents")
+        yield plob
+
+
+def parse_and_split_blob(blob: Blob, blob_parser: Any, index_build_id: str) -> Plob:
+    """
+    Parse a blob (file by path) into a plob, and split its documents into parts (without summaries).
+
+    Runs in a worker process of the process pool stage (or in-process as fallback).
+    """
+    plob = parse_blob_to_plob(blob_parser, blob)
+    if plob.documents_streamed:
+        # parsed page by page while processed (with the per-page change detection)
+        return plob
+    try:
+        documents = list(_enrich_plob_documents(index_build_id, plob, plob.documents or []))
+        plob.document_splits = [split_single_document_into_parts_if_needed(doc) for doc in documents]
+        plob.documents = documents
+    except Exception as e:
+        # split again later (with re-tries)
+        logger.warning(f"{plob2str(plob)} ... Error while splitting documents in the process pool stage: {e}")
+        plob.document_splits = None
+    return plob
+
 
 #
 # processing multiple documents
@@ -331,12 +445,15 @@ def process_all_plobs_from_queue_worker(index_build_id: str):
 # processing a single plob and its documents
 #
 
-def process_single_plob_and_store_results_in_databases(index_build_id: str, plob: Plob):
+def process_single_plob_and_store_results_in_databases(index_build_id: str, plob: Plob) -> int:
     """
     Process (load and split) a single plob and its documents
     and store (and index) the results in the SQL DB and the vectorstore.
 
     NOT LAZY: The plob is processed and saved in the SQL DB and the vectorstore.
+
+    Returns:
+        int: Number of stored documents / parts of the plob.
     """
 
     plob_str = plob2str(plob) # str_limit(f"plob({plob.id} - '{plob.url}')", 160)
@@ -344,19 +461,25 @@ def process_single_plob_and_store_results_in_databases(index_build_id: str, plob
     logger.info (f"== {plob_str} ... START processing plob with media_type={plob.media_type} ...")
     logger.debug(f"==")
 
+    if plob.documents_streamed:
+        # Documents parsed page by page
+        return process_single_streamed_plob_and_store_results_in_databases(index_build_id, plob)
+
     # Get documents from plob and split them into parts if needed
     documents = plob.documents
     if not documents:
         logger.info(f"{plob_str} ... no documents to process")
-        return
+        return 0
     # One or multiple documents available
-    documents = _enrich_plob_documents(index_build_id, plob, documents)
+    documents = list(_enrich_plob_documents(index_build_id, plob, documents))
+    # parts of the documents, if already split by the process pool stage
+    document_splits = plob.document_splits if plob.document_splits is not None and len(plob.document_splits) == len(documents) else None
     splited_documents: List[Document] = []
-    for doc in documents:
+    for i, doc in enumerate(documents):
         # split document into parts
         try:
             logger.info(f"{plob_str} ... doc: {doc.metadata}")
-            doc_splits = improve_and_split_single_document_into_parts(doc)
+            doc_splits = improve_and_split_single_document_into_parts(doc, doc_splits=document_splits[i] if document_splits is not None else None)
             splited_documents.extend(doc_splits)
         except Exception as e:
             logger.warning(f"{plob_str} ... Error while splitting document: {e}")
@@ -379,6 +502,80 @@ def process_single_plob_and_store_results_in_databases(index_build_id: str, plob
     save_single_plob_and_its_documents_in_databases(plob, splited_documents)
 
     logger.info(f"== {plob_str} ... DONE processing plob: {len(splited_documents)} documents / parts stored in SQL DB and vectorstore")
+    return len(splited_documents)
+
+
+def process_single_streamed_plob_and_store_results_in_databases(index_build_id: str, plob: Plob) -> int:
+    """
+    Process a single plob with streamed documents (pages, e.g. of a PDF) page by page
+    and store the results in the SQL DB and the vectorstore - without holding all pages in memory.
+
+    Pages with the same text as in the last build get their recorded documents / parts back,
+    only changed pages are split, summarized and embedded (see page_change_detection.py).
+    The pages are processed in batches of pdf_page_streaming_pages_per_batch pages, each batch
+    before the (short) transaction storing it - slow LLM calls never hold the write lock of the SQL DB.
+
+    Returns:
+        int: Number of stored documents / parts of the plob.
+    """
+    plob_str = plob2str(plob)
+
+    # Pages of the last build
+    previous_pages = load_plob_pages_from_sqldb(get_sql_database_connection_after_setup(), plob.url)
+    processing_signature = get_page_processing_signature()
+    recorded_page_numbers = set()
+    page_counts = {"changed": 0, "unchanged": 0}
+
+    def process_page(page_doc: Document) -> Tuple[List[Document], Optional[PlobPage]]:
+        page_number = page_doc.metadata.get("page_number")
+        page_sha256 = page_doc.metadata.get("page_sha256")
+
+        # Unchanged page?
+        page_parts = None
+        previous_page = previous_pages.get(page_number)
+        if previous_page is not None and previous_page.page_sha256 == page_sha256 and previous_page.processing_signature == processing_signature:
+            page_parts = page_documents_from_json(previous_page.documents_json, page_doc)
+        if page_parts is not None:
+            documents_json = previous_page.documents_json
+            page_counts["unchanged"] += 1
+            page_change_detection_pages_counter.inc(result="unchanged")
+        else:
+            # Changed (or new) page: split into parts (and summarize)
+            page_parts = improve_and_split_single_document_into_parts(page_doc)
+            page_parts = list(_enrich_plob_documents(index_build_id, plob, page_parts))
+            documents_json = page_documents_to_json(page_parts) if is_page_processed_completely(page_parts) else None
+            page_counts["changed"] += 1
+            page_change_detection_pages_counter.inc(result="changed")
+
+        if documents_json is None or page_number is None or not page_sha256 or page_number in recorded_page_numbers:
+            return page_parts, None
+        recorded_page_numbers.add(page_number)
+        return page_parts, PlobPage(page_number=page_number, page_sha256=page_sha256,
+                                    processing_signature=processing_signature, documents_json=documents_json)
+
+    def process_page_batches() -> Iterator[Tuple[List[Document], List[PlobPage]]]:
+        # (runs between the transactions of the storage)
+        batch_documents: List[Document] = []
+        batch_pages: List[PlobPage] = []
+        batch_page_count = 0
+        for page_doc in _enrich_plob_documents(index_build_id, plob, plob.documents):
+            page_parts, plob_page = process_page(page_doc)
+            batch_documents.extend(page_parts)
+            if plob_page is not None:
+                batch_pages.append(plob_page)
+            batch_page_count += 1
+            if batch_page_count >= pdf_page_streaming_pages_per_batch:
+                yield batch_documents, batch_pages
+                batch_documents, batch_pages, batch_page_count = [], [], 0
+        if batch_documents or batch_pages:
+            yield batch_documents, batch_pages
+
+    # Save plob in SQL DB and in vectorstore - the pages are parsed and processed batch by batch while they are stored
+    logger.info(f"== {plob_str} ... Process pages and save plob and their documents / parts in SQL DB and vectorstore ({len(previous_pages)} pages recorded in the last build) ...")
+    _, chunks_count = save_single_streamed_plob_and_its_documents_in_databases(plob, process_page_batches())
+
+    logger.info(f"== {plob_str} ... DONE processing plob: {page_counts['changed']} changed and {page_counts['unchanged']} unchanged pages, {chunks_count} documents / parts stored in SQL DB and vectorstore")
+    return chunks_count
 
 
 
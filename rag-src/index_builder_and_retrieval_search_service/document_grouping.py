@@ -0,0 +1,162 @@
+### Grouping and Ordering of Retrieved Documents
+
+import logging
+from functools import lru_cache
+from typing import (
+    Dict,
+    List,
+    Optional,
+    Tuple,
+)
+from langchain_core.documents import Document
+
+from model.plob_documents import PlobDocuments
+
+logger = logging.getLogger(__name__)
+
+
+#
+# Grouping
+#
+
+def group_documents_by_plob_id(documents: List[Document]) -> List[PlobDocuments]:
+    """
+    Group documents by their plob_id.
+
+    The order of the groups is the order of the first occurrence of each plob_id,
+    the order of the documents within a group is kept.
+
+    Args:
+        documents (List[Document]): List of documents to group.
+
+    Returns:
+        List[PlobDocuments]: List of groups, each containing a plob_id and the corresponding list of documents.
+    """
+    results: Dict[str, PlobDocuments] = {}
+    for doc in documents:
+        plob_id = doc.metadata.get('plob_id', None)
+        plob_docs = results.get(plob_id)
+        if plob_docs is None:
+            # Create a new PlobDocuments instance if plob_id not found
+            results[plob_id] = PlobDocuments(plob_id=plob_id, documents=[doc])
+        else:
+            # Found the plob_id, append the document
+            plob_docs.documents.append(doc)
+
+    return list(results.values())
+
+
+#
+# Ordering by rank
+#
+
+def build_rank_map(documents: List[Document], metadata_key: str = 'source') -> Dict[str, int]:
+    """
+    Map each value of a metadata key (e.g. the source) to the position of its first occurrence.
+
+    Args:
+        documents (List[Document]): List of documents, e.g. sorted by relevance.
+        metadata_key (str): The metadata key. Defaults to 'source'.
+
+    Returns:
+        Dict[str, int]: Rank (0 = first) for each value of the metadata key.
+    """
+    rank_map: Dict[str, int] = {}
+    for doc in documents:
+        value = doc.metadata.get(metadata_key, None)
+        if value is not None and value not in rank_map:
+            rank_map[value] = len(rank_map)
+    return rank_map
+
+
+def sort_documents_by_rank_map(documents: List[Document], rank_map: Dict[str, int], metadata_key: str = 'source') -> List[Document]:
+    """
+    Sort documents by the rank of their metadata value (stable).
+    Documents with an unknown value are moved to the end.
+
+    Args:
+        documents (List[Document]): List of documents to sort.
+        rank_map (Dict[str, int]): Rank for each value of the metadata key, see build_rank_map().
+        metadata_key (str): The metadata key. Defaults to 'source'.
+
+    Returns:
+        List[Document]: Sorted list of documents.
+    """
+    unknown_rank = len(rank_map)
+    return sorted(documents, key=lambda doc: rank_map.get(doc.metadata.get(metadata_key, ''), unknown_rank))
+
+
+#
+# Ordering by part
+#
+
+def sort_documents_of_a_plob_by_part(documents: List[Document]) -> List[Document]:
+    """
+    Sort documents of a plob by their 'part' metadata (in place), see part_sort_key().
+
+    Args:
+        documents (List[Document]): List of documents to sort.
+
+    Returns:
+        List[Document]: Sorted list of documents.
+    """
+    documents.sort(key=lambda doc: part_sort_key(doc.metadata.get('part', '')))
+    return documents
+
+
+@lru_cache(maxsize=4096)
+def part_sort_key(part: str) -> Tuple[int, Tuple[Tuple[int, int, str], ...]]:
+    """
+    Sort key for the 'part' metadata of a document.
+
+    Parts with fewer components come first, then the components are compared one by one:
+    numeric components as integers (before non-numeric ones), other components as strings.
+
+    Example parts:
+        /split/5
+        /split/5/summary
+        /split/5/summary/join
+        /split/13
+        /split/13/summary
+        /split/14
+        /split/14/summary
+
+    Become:
+        /split/5
+        /split/13
+        /split/14
+        /split/5/summary
+        /split/13/summary
+        /split/14/summary
+        /split/5/summary/join
+
+    Args:
+        part (str): The 'part' metadata, e.g. "/split/5/summary".
+
+    Returns:
+        A tuple that can be compared with other keys of this function.
+    """
+    components = part.split('/')
+    component_keys = tuple(
+        (0, int(component), "") if component.isdecimal() else (1, 0, component)
+        for component in components
+    )
+    return (len(components), component_keys)
+
+
+@lru_cache(maxsize=4096)
+def get_split_parent_part(part: str) -> Optional[str]:
+    """
+    The 'part' metadata of the parent document of a split, e.g. "/section/3" of "/section/3/split/5".
+    Only splits of the same parent document can overlap.
+
+    Args:
+        part (str): The 'part' metadata.
+
+    Returns:
+        The part of the parent document, or None if the document is not a split.
+    """
+    parent_part, separator, split_index = part.rpartition('/split/')
+    if not separator or not split_index.isdecimal():
+        return None
+    return parent_part
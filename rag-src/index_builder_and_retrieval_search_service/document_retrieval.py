@@ -1,9 +1,10 @@
 ### Retrieval of (Graded) Documents
 
+import asyncio
 import logging
-from functools import cmp_to_key
 from typing import (
     Any,
+    AsyncIterator,
     Dict,
     Iterator,
     List,
@@ -12,18 +13,24 @@ from typing import (
 )
 from langchain_core.documents import Document
 
-from factory.vectorstore_factory import get_vectorstore
+from factory.vectorstore_factory import get_vectorstore, vectorstore_operation_duration_histogram
 from .document_retrieval_grader import filter_documents_based_on_binary_grade_for_question, filter_and_sort_documents_by_numeric_relevance_score_for_question
 from .question_rewriter import rewrite_question_for_vectorsearch_retrieval, rewrite_question_for_keywordsearch_retrieval, create_hypothetical_answer_for_hyde
+from .question_rewriter import expand_question_for_retrieval, QueryExpansion
 from .document_summarizer import compact_and_deduplicate_text
+from .document_grouping import group_documents_by_plob_id, sort_documents_of_a_plob_by_part, build_rank_map, sort_documents_by_rank_map, get_split_parent_part
+from .search_budget import SearchBudget, DEGRADED_ERROR
 
 from common.service.configloader import deep_get, settings
 
 from async_lru import alru_cache
 import common.service.config as config
 from common.utils.hash_util import sha256sum_str
-from common.utils.string_util import str_limit, merge_strings_with_with_overlap_detection_and_tail_recursion, merge_two_strings_with_with_overlap_detection
+from common.utils.ttl_cache import TtlCache
+from common.utils.string_util import str_limit, merge_strings_with_overlap_detection, merge_two_strings_with_with_overlap_detection
 from common.service.logging_tools import log_docs, doc2str
+from common.service.span_recorder import timing_span
+from index_builder_basics.document_storage_sql_database import aget_texts_from_sqldb
 from model.plob_document import PlobDocument
 from model.plob_documents import PlobDocuments
 
@@ -35,6 +42,8 @@ enable_final_result_filtering_with_llm = deep_get(settings, "config.rag_response
 enable_rewrite_question_for_vectorsearch_retrieval = deep_get(settings, "config.rag_response.rewrite_question_for_vectorsearch_retrieval", default_value=False)
 enable_rewrite_question_for_keywordsearch_retrieval = deep_get(settings, "config.rag_response.rewrite_question_for_keywordsearch_retrieval", default_value=False)
 enable_hyde_for_vectorsearch_retrieval = deep_get(settings, "config.rag_response.hyde_for_vectorsearch_retrieval", default_value=False)
+# one LLM call for all enabled rewrites/HyDE above (the separate calls are the fallback)
+enable_combined_query_expansion = deep_get(settings, "config.rag_response.combined_query_expansion", default_value=False)
 deliver_extended_content = deep_get(settings, "config.rag_response.deliver_extended_content", default_value=True)
 
 enable_rewrite_summaries = deep_get(settings, "config.rag_response.rewrite_summaries", default_value=False)
@@ -44,17 +53,74 @@ enable_rewrite_complete_response = deep_get(settings, "config.rag_response.rewri
 default_max_search_results = deep_get(settings, "config.rag_response.default_max_search_results", default_value=10)
 max_max_search_results = deep_get(settings, "config.rag_response.max_max_search_results", default_value=25)
 
+# Complete (non-degraded) results of find_relevant_documents_tuned()
+_complete_results_cache: TtlCache[List[Document]] = TtlCache(ttl_seconds=config.responseCacheTtlSeconds, maxsize=config.maxCachedQuestions)
 
-@alru_cache(ttl=config.responseCacheTtlSeconds, maxsize=config.maxCachedQuestions)
-async def find_relevant_documents_tuned(question: str, max_results: Optional[int]) -> List[Document]:
+# Stages of find_relevant_documents_tuned_stream() with (intermediate) results
+STAGE_RAW = "raw"              # hybrid search hits of the original question
+STAGE_EXPANDED = "expanded"    # + hits of HyDE and rewritten questions (only if used)
+STAGE_GRADED = "graded"        # filtered and re-ranked with LLM (only if used)
+STAGE_FINAL = "final"          # merged per plob and sorted - the final result
+
+
+async def find_relevant_documents_tuned(question: str, max_results: Optional[int], search_budget: Optional[SearchBudget] = None) -> List[Document]:
     """Get relevant documents for a given question.
        Enrich with a tuned question
+
+       Optional (LLM-based) stages are skipped or cut short if the search_budget is (almost) exhausted,
+       degraded stages are recorded in search_budget. Only complete results are cached.
+    """
+    retrieved_docs: List[Document] = []
+    async for stage, docs in find_relevant_documents_tuned_stream(question, max_results, search_budget):
+        if stage == STAGE_FINAL:
+            retrieved_docs = docs
+    return retrieved_docs
+
+
+async def find_relevant_documents_tuned_stream(question: str, max_results: Optional[int], search_budget: Optional[SearchBudget] = None) -> AsyncIterator[Tuple[str, List[Document]]]:
+    """Get relevant documents for a given question, as soon as the single stages are done.
+
+       Yields (stage, documents) tuples: intermediate results (STAGE_RAW, STAGE_EXPANDED, STAGE_GRADED)
+       and finally the result of find_relevant_documents_tuned() (STAGE_FINAL).
+       Cached results are yielded immediately as STAGE_FINAL.
     """
 
     # Parameters
+    max_results = normalize_max_results(max_results)
+    if search_budget is None:
+        search_budget = SearchBudget()
+
+    # Cached?
+    cache_key = (question, max_results)
+    cached_docs = get_cached_complete_results(question, max_results)
+    if cached_docs is not None:
+        logger.info(f"Found {len(cached_docs)} docs in results cache")
+        yield STAGE_FINAL, cached_docs
+        return
+
+    async for stage, docs in _find_relevant_documents_tuned_stream(question, max_results, search_budget):
+        # Cache complete results only
+        if stage == STAGE_FINAL and not search_budget.is_degraded():
+            _complete_results_cache.put(cache_key, docs)
+        yield stage, list(docs)
+
+
+def get_cached_complete_results(question: str, max_results: Optional[int]) -> Optional[List[Document]]:
+    """The cached complete result of find_relevant_documents_tuned() (without any LLM or vectorstore call), None if not cached."""
+    cached_docs = _complete_results_cache.get((question, normalize_max_results(max_results)))
+    return list(cached_docs) if cached_docs is not None else None
+
+
+def normalize_max_results(max_results: Optional[int]) -> int:
+    """Requested max. number of results -> effective number (default if not set, limited to the configured maximum)."""
     if max_results is None or max_results <= 0:
         max_results = default_max_search_results
-    max_results = min(max_results, max_max_search_results)
+    return min(max_results, max_max_search_results)
+
+
+async def _find_relevant_documents_tuned_stream(question: str, max_results: int, search_budget: SearchBudget) -> AsyncIterator[Tuple[str, List[Document]]]:
+    """Get relevant documents for a given question, as soon as the single stages are done - without results cache."""
+
 
     # Store result in list of list to later mix tge order
     list_of_list_of_retrieved_docs: List[List[Document]] = []
@@ -63,9 +129,22 @@ async def find_relevant_documents_tuned(question: str, max_results: Optional[int
     normal_retrieved_docs: List[Document] = await find_documents(question, k=2*max_results)
     logger.info(f"Found {str(len(normal_retrieved_docs))} docs with original question")
     list_of_list_of_retrieved_docs.append(normal_retrieved_docs)
+    yield STAGE_RAW, normal_retrieved_docs[:max_results]
+
+    # Combined query expansion (rewrites + HyDE with a single LLM call)?
+    query_expansion: Optional[QueryExpansion] = None
+    if (enable_combined_query_expansion
+            and (enable_hyde_for_vectorsearch_retrieval or enable_rewrite_question_for_vectorsearch_retrieval or enable_rewrite_question_for_keywordsearch_retrieval)
+            and search_budget.check_time_for_optional_stage("query_expansion")):
+        try:
+            logger.info("Expand question (rewrites + HyDE) with a single LLM call now ...")
+            query_expansion = await search_budget.run_optional_stage("query_expansion", expand_question_for_retrieval(question))
+        except Exception as e:
+            # The separate LLM calls below are the fallback (if there is still time for them)
+            logger.warning(f"Error while expanding question with a single LLM call - use separate calls: {e}")
 
     # Enrich further to fine more documents - with HyDE (Hypothetical Document Embeddings)?
-    if enable_hyde_for_vectorsearch_retrieval:
+    if enable_hyde_for_vectorsearch_retrieval and search_budget.check_time_for_optional_stage("hyde"):
         # Yes - use HyDE (Hypothetical Document Embeddings):
         #
         # Generate a hypothetical answer using an LLM-based template,
@@ -76,51 +155,63 @@ async def find_relevant_documents_tuned(question: str, max_results: Optional[int
             logger.info("Use HyDE (Hypothetical Document Embeddings) now ...")
 
             # Improve the question for keywordsearch retrieval
-            hypothetical_answer: str = await create_hypothetical_answer_for_hyde(question)
+            if query_expansion is not None and query_expansion.hypothetical_document:
+                hypothetical_answer: str = query_expansion.hypothetical_document
+            else:
+                hypothetical_answer: str = await search_budget.run_optional_stage("hyde", create_hypothetical_answer_for_hyde(question))
 
             # Get the relevant documents (again)
             further_retrieved_docs = await find_documents(question, hypothetical_answer, k=max_results)
             logger.info(f"Found {str(len(further_retrieved_docs))} further docs with HyDE (Hypothetical Document Embeddings)")
             list_of_list_of_retrieved_docs.append(further_retrieved_docs)
         except Exception as e:
-            # Probably LLM request failed,
+            # Probably LLM request failed (or timed out),
             # no re-try because of performance reasons
+            search_budget.mark_degraded("hyde", DEGRADED_ERROR)
             logger.warning(f"Error while using HyDE (Hypothetical Document Embeddings): {e}")
 
     # Enrich further to fine more documents - rewrite question for vectorsearch retrieval?
-    if enable_rewrite_question_for_vectorsearch_retrieval: # and (retrieved_docs is None or len(retrieved_docs) == 0):
+    if enable_rewrite_question_for_vectorsearch_retrieval and search_budget.check_time_for_optional_stage("rewrite_vectorsearch"): # and (retrieved_docs is None or len(retrieved_docs) == 0):
         # Yes
         try:
             logger.info("Rewrite question for vectorsearch retrieval now ...")
 
             # Improve the question for vectorsearch retrieval
-            tuned_question_str: str = await rewrite_question_for_vectorsearch_retrieval(question)
+            if query_expansion is not None and query_expansion.vectorsearch_question:
+                tuned_question_str: str = query_expansion.vectorsearch_question
+            else:
+                tuned_question_str: str = await search_budget.run_optional_stage("rewrite_vectorsearch", rewrite_question_for_vectorsearch_retrieval(question))
 
             # Get the relevant documents (again)
             further_retrieved_docs = await find_documents(tuned_question_str, k=max_results, alpha=1.0)
             logger.info(f"Found {str(len(further_retrieved_docs))} docs with 1st tuned question (Rewrite question for vectorsearch retrieval)")
             list_of_list_of_retrieved_docs.append(further_retrieved_docs)
         except Exception as e:
-            # Probably LLM request failed,
+            # Probably LLM request failed (or timed out),
             # no re-try because of performance reasons
+            search_budget.mark_degraded("rewrite_vectorsearch", DEGRADED_ERROR)
             logger.warning(f"Error while rewriting question for vectorsearch retrieval: {e}")
 
     # Enrich further to fine more documents - rewrite question for keywordsearch retrieval?
-    if enable_rewrite_question_for_keywordsearch_retrieval: # and (retrieved_docs is None or len(retrieved_docs) == 0):
+    if enable_rewrite_question_for_keywordsearch_retrieval and search_budget.check_time_for_optional_stage("rewrite_keywordsearch"): # and (retrieved_docs is None or len(retrieved_docs) == 0):
         # Yes
         try:
             logger.info("Rewrite question for keywordsearch retrieval now ...")
 
             # Improve the question for keywordsearch retrieval
-            tuned2_question_str: str = await rewrite_question_for_keywordsearch_retrieval(question)
+            if query_expansion is not None and query_expansion.keywordsearch_keyword:
+                tuned2_question_str: str = query_expansion.keywordsearch_keyword
+            else:
+                tuned2_question_str: str = await search_budget.run_optional_stage("rewrite_keywordsearch", rewrite_question_for_keywordsearch_retrieval(question))
 
             # Get the relevant documents (again)
             further_retrieved_docs = await find_documents(tuned2_question_str, k=((1+max_results)//2), alpha=0.0)
             logger.info(f"Found {str(len(further_retrieved_docs))} docs with 2nd tuned question (Rewrite question for keywordsearch retrieval)")
             list_of_list_of_retrieved_docs.append(further_retrieved_docs)
         except Exception as e:
-            # Probably LLM request failed,
+            # Probably LLM request failed (or timed out),
             # no re-try because of performance reasons
+            search_budget.mark_degraded("rewrite_keywordsearch", DEGRADED_ERROR)
             logger.warning(f"Error while rewriting question for keywordsearch retrieval: {e}")
 
     # Un-lazy
@@ -151,16 +242,17 @@ async def find_relevant_documents_tuned(question: str, max_results: Optional[int
     len_after = len(retrieved_docs)
     msg = f"Removed duplicates from {len_before} -> {len_after} retrieved docs"
     log_docs(logger, logging.INFO, msg, retrieved_docs)
+    if len(unlazy_list_of_list_of_retrieved_docs) > 1:
+        yield STAGE_EXPANDED, retrieved_docs[:max_results]
 
     # Sort and filter the documents?
-    docs_sources_sorted_by_relevance_score: List[str] = []
-    if enable_intermediate_result_filtering_with_llm:
+    if enable_intermediate_result_filtering_with_llm and search_budget.check_time_for_optional_stage("intermediate_grading"):
         # Yes: Sort and filter the documents with LLM (intermediate)
         logger.info("Filter and sort with LLM (intermediate) documents by numeric relevance score for question now ...")
         len_before = len(retrieved_docs)
         try:
-            retrieved_docs = await filter_and_sort_documents_by_numeric_relevance_score_for_question(
-                question, retrieved_docs)
+            retrieved_docs = await search_budget.run_optional_stage("intermediate_grading", filter_and_sort_documents_by_numeric_relevance_score_for_question(
+                question, retrieved_docs, search_budget, "intermediate_grading"))
 
             # Un-lazy
             retrieved_docs = list(retrieved_docs)
@@ -168,50 +260,51 @@ async def find_relevant_documents_tuned(question: str, max_results: Optional[int
             len_after = len(retrieved_docs)
             msg = f"Filtered and sorted with LLM (intermediate): from {len_before} -> {len_after} retrieved docs"
             log_docs(logger, logging.INFO, msg, retrieved_docs)
+            yield STAGE_GRADED, retrieved_docs[:max_results]
         except Exception as e:
-            # Probably LLM request(s) failed,
+            # Probably LLM request(s) failed (or timed out),
             # no re-try because of performance reasons
+            search_budget.mark_degraded("intermediate_grading", DEGRADED_ERROR)
             len_after = len(retrieved_docs)
             logger.warning(f"Error while filtering and sorting documents by numeric relevance score - continue with {len_before} of {len_after} retrieved docs: {e}")
     else:
         # No: Skip filtering and sorting with LLM (intermediate),
         # keep the original retrieval order
         len_after = len(retrieved_docs)
-        msg = f"Skipped filtering and sorting with LLM because of configuration (intermediate_result_filtering_with_llm=False), continue with all {len_after} retrieved docs"
+        msg = f"Skipped filtering and sorting with LLM because of configuration (intermediate_result_filtering_with_llm=False) or exhausted search budget, continue with all {len_after} retrieved docs"
         log_docs(logger, logging.INFO, msg, retrieved_docs)
     # Collect sources sorted by relevance score (for later re-use)
-    for doc in retrieved_docs:
-        source = doc.metadata.get('source', None)
-        if source is not None and source not in docs_sources_sorted_by_relevance_score:
-            docs_sources_sorted_by_relevance_score.append(source)
+    docs_sources_rank_by_relevance_score = build_rank_map(retrieved_docs, 'source')
 
     # Merge documents form the same source / same URL (except anker)
     len_before = len(retrieved_docs)
-    retrieved_docs = await merge_documents_per_plob_id(retrieved_docs)
+    with timing_span("merge"):
+        retrieved_docs = await merge_documents_per_plob_id(retrieved_docs, search_budget)
     len_after = len(retrieved_docs)
     msg = f"Merged from {len_before} -> {len_after} retrieved docs"
     log_docs(logger, logging.INFO, msg, retrieved_docs)
 
     # Filter and sort result documents again
-    if enable_final_result_filtering_with_llm:
+    if enable_final_result_filtering_with_llm and search_budget.check_time_for_optional_stage("final_grading"):
         # Yes: Filter and sort the documents with LLM (final)
         logger.info("Final result filtering and sorting with LLM now ...")
         try:
-            retrieved_docs = await filter_and_sort_documents_by_numeric_relevance_score_for_question(
-                question, retrieved_docs)
+            retrieved_docs = await search_budget.run_optional_stage("final_grading", filter_and_sort_documents_by_numeric_relevance_score_for_question(
+                question, retrieved_docs, search_budget, "final_grading"))
         except Exception as e:
-            # Probably LLM request(s) failed,
+            # Probably LLM request(s) failed (or timed out),
             # no re-try because of performance reasons
+            search_budget.mark_degraded("final_grading", DEGRADED_ERROR)
             logger.warning(f"Error while filtering and sorting final documents by numeric relevance score - continue with {len(retrieved_docs)} retrieved docs: {e}")
 
         # Un-lazy
         retrieved_docs = list(retrieved_docs)
     else:
         # No: Skip filtering and sorting with LLM (final)
-        if len(docs_sources_sorted_by_relevance_score) > 0:
-            # Sort by relevance score stored in docs_sources_sorted_by_relevance_score
-            logger.info("Final result sorting by earlier calculated relevance score without LLM because of configuration (final_result_filtering_with_llm=False)")
-            retrieved_docs = sorted(retrieved_docs, key=lambda doc: docs_sources_sorted_by_relevance_score.index(doc.metadata.get('source', '')), reverse=False)
+        if len(docs_sources_rank_by_relevance_score) > 0:
+            # Sort by relevance score stored in docs_sources_rank_by_relevance_score
+            logger.info("Final result sorting by earlier calculated relevance score without LLM because of configuration (final_result_filtering_with_llm=False) or exhausted search budget")
+            retrieved_docs = sort_documents_by_rank_map(retrieved_docs, docs_sources_rank_by_relevance_score, 'source')
         else:
             # No previous relevance score, sort by source
             logger.info("No final result filtering and sorting at all: neither with LLM (final_result_filtering_with_llm=False) nor by earlier calculated relevance score (non-existing)")
@@ -223,7 +316,7 @@ async def find_relevant_documents_tuned(question: str, max_results: Optional[int
     # Result
     log_docs(logger, logging.INFO, "Final retrieved docs", retrieved_docs)
 
-    return retrieved_docs
+    yield STAGE_FINAL, retrieved_docs
 
 
 #
@@ -264,7 +357,7 @@ def remove_duplicates_from_documents(documents: List[Document]) -> List[Document
     return unique_documents
 
 
-async def merge_documents_per_plob_id(documents: List[Document]) -> List[Document]:
+async def merge_documents_per_plob_id(documents: List[Document], search_budget: Optional[SearchBudget] = None) -> List[Document]:
     """
     Merge documents per plob_id into a single document.
 
@@ -273,28 +366,30 @@ async def merge_documents_per_plob_id(documents: List[Document]) -> List[Documen
     
     Args:
         documents (List[Document]): List of documents to merge.
+        search_budget (Optional[SearchBudget]): Latency budget, LLM-based rewriting is skipped if exhausted.
     
     Returns:
         List[Document]: List of merged documents, one per plob_id.
     """
-    merged_documents = await _merge_documents_per_plob_id(documents)
+    merged_documents = await _merge_documents_per_plob_id(documents, search_budget)
     return [doc.document for doc in merged_documents if doc.document is not None]
 
 
-async def _merge_documents_per_plob_id(documents: List[Document]) -> List[PlobDocuments]:
+async def _merge_documents_per_plob_id(documents: List[Document], search_budget: Optional[SearchBudget] = None) -> List[PlobDocuments]:
     """
     Merge documents per plob_id into a single document.
     
     Args:
         documents (List[Document]): List of documents to merge.
+        search_budget (Optional[SearchBudget]): Latency budget, LLM-based rewriting is skipped if exhausted.
     
     Returns:
         List[PlobDocument]: List of merged documents, one per plob_id.
     """
-    documents_by_plob_id: List[PlobDocuments] = _group_documents_by_plob_id(documents)
+    documents_by_plob_id: List[PlobDocuments] = group_documents_by_plob_id(documents)
     merged_documents: List[PlobDocument] = []
     for plob_docs in documents_by_plob_id:
-        merged_doc = await merge_some_documents_of_a_plob_to_single_document(plob_docs.documents)
+        merged_doc = await merge_some_documents_of_a_plob_to_single_document(plob_docs.documents, search_budget)
         plob_id = plob_docs.plob_id
         if merged_doc:
             merged_documents.append(PlobDocument(plob_id=plob_docs.plob_id, document=merged_doc))
@@ -303,12 +398,36 @@ async def _merge_documents_per_plob_id(documents: List[Document]) -> List[PlobDo
     return merged_documents
 
 
-async def merge_some_documents_of_a_plob_to_single_document(documents: List[Document]) -> Document | None:
+def _merge_page_contents_of_parts(documents: List[Document], separator: str) -> str:
+    """
+    Merge the page contents of documents of a plob (sorted by part):
+    with overlap detection only between consecutive splits of the same parent document (e.g. a section),
+    other documents don't overlap and are simply concatenated.
+    """
+    runs: List[List[str]] = []
+    previous_parent_part: Optional[str] = None
+    for doc in documents:
+        if not doc.page_content:
+            continue
+        parent_part = get_split_parent_part(doc.metadata.get('part', ''))
+        if runs and parent_part is not None and parent_part == previous_parent_part:
+            runs[-1].append(doc.page_content)
+        else:
+            runs.append([doc.page_content])
+        previous_parent_part = parent_part
+    return separator.join(
+        merge_strings_with_overlap_detection(run, separator_in_case_of_simple_concatenation=separator) if len(run) > 1 else run[0]
+        for run in runs
+    )
+
+
+async def merge_some_documents_of_a_plob_to_single_document(documents: List[Document], search_budget: Optional[SearchBudget] = None) -> Document | None:
     """
     Merge all documents (mainly the page content) into a single document.
     
     Args:
         documents (List[Document]): List of documents to merge.
+        search_budget (Optional[SearchBudget]): Latency budget, LLM-based rewriting is skipped if exhausted.
     
     Returns:
         Document | None: A single merged document or None if the list is empty.
@@ -321,7 +440,7 @@ async def merge_some_documents_of_a_plob_to_single_document(documents: List[Docu
         return documents[0]
 
     # Sort first by part
-    documents = _sort_documents_of_a_plob_by_part(documents)
+    documents = sort_documents_of_a_plob_by_part(documents)
     base_document = documents[0]
 
     # Separate documents with summaries from those without
@@ -330,24 +449,21 @@ async def merge_some_documents_of_a_plob_to_single_document(documents: List[Docu
     logger.debug(f"Documents to merge: {len(documents_without_summary)} documents without summary, {len(documents_with_summary)} documents with summary")
 
     # Merge the page contents of documents without summary
-    without_summary_contents = [doc.page_content for doc in documents_without_summary if doc.page_content]
-    without_summary_merged_content = merge_strings_with_with_overlap_detection_and_tail_recursion(
-        "", without_summary_contents, separator_in_case_of_simple_concatenation="\n\n...\n\n"
-    )
+    without_summary_merged_content = _merge_page_contents_of_parts(documents_without_summary, separator="\n\n...\n\n")
 
     # Merge the page contents of documents with summary
     with_summary_contents = [doc.page_content for doc in documents_with_summary if doc.page_content]
-    with_summary_merged_content = merge_strings_with_with_overlap_detection_and_tail_recursion(
-        "", with_summary_contents, separator_in_case_of_simple_concatenation="\n\n...\n\n"
+    with_summary_merged_content = merge_strings_with_overlap_detection(
+        with_summary_contents, separator_in_case_of_simple_concatenation="\n\n...\n\n"
     )
     if len(with_summary_merged_content) > 0:
         if len(with_summary_contents) >= 2:
             # Multiple documents with summary
-            if enable_rewrite_summaries:
+            if enable_rewrite_summaries and _check_time_for_merge_rewrite(search_budget):
                 # Summarized the summaries
                 len_before = len(with_summary_merged_content)
                 logger.debug(f"Merged_content contains multiple summaries, rewriting it now: '{with_summary_merged_content}'")
-                with_summary_merged_content = await compact_and_deduplicate_text(with_summary_merged_content)
+                with_summary_merged_content = await _compact_and_deduplicate_text_within_budget(with_summary_merged_content, search_budget)
                 len_after = len(with_summary_merged_content)
                 logger.debug(f"Merged_content contains multiple summaries, after rewriting: '{with_summary_merged_content}'")
                 logger.info(f"Rewrote merged content (multiple summaries) from {len_before} -> {len_after} characters")
@@ -364,7 +480,7 @@ async def merge_some_documents_of_a_plob_to_single_document(documents: List[Docu
     # Merge the contents: without summary + with summary
     merged_content = ""
     logger.debug(f"enable_rewrite_complete_response={enable_rewrite_complete_response}, len(without_summary_merged_content)={len(without_summary_merged_content)}, len(with_summary_merged_content)={len(with_summary_merged_content)}")
-    if not enable_rewrite_complete_response:
+    if not enable_rewrite_complete_response or not _check_time_for_merge_rewrite(search_budget):
         # Simply merge the contents without rewriting
         if len(without_summary_merged_content) > 0 and len(with_summary_merged_content) > 0:
             # Both contents exist, merge them
@@ -390,7 +506,7 @@ async def merge_some_documents_of_a_plob_to_single_document(documents: List[Docu
         # Rewrite merged content if it conains a summary
         len_before = len(merged_content)
         logger.debug(f"Merged_content contains a summary, rewriting it now: '{merged_content}'")
-        merged_content = await compact_and_deduplicate_text(merged_content)
+        merged_content = await _compact_and_deduplicate_text_within_budget(merged_content, search_budget)
         len_after = len(merged_content)
         logger.debug(f"Merged_content after rewriting: '{merged_content}'")
         logger.info (f"Rewrote merged content from {len_before} -> {len_after} characters")
@@ -410,113 +526,29 @@ async def merge_some_documents_of_a_plob_to_single_document(documents: List[Docu
     return merged_document
 
 
-def _sort_documents_of_a_plob_by_part(documents: List[Document]) -> List[Document]:
-    """
-    Sort documents of a plob by their 'part' metadata.
-    
-    Args:
-        documents (List[Document]): List of documents to sort.
-    
-    Returns:
-        List[Document]: Sorted list of documents.
-    """
-
-    # Sort documents by their 'part' metadata using a custom comparison function
-    documents.sort(key=cmp_to_key(_comparison_function_for_documents_by_part))
-    return documents
+def _check_time_for_merge_rewrite(search_budget: Optional[SearchBudget]) -> bool:
+    """Is enough time left for rewriting merged content with LLM? (True if there is no budget)"""
+    return search_budget is None or search_budget.check_time_for_optional_stage("merge_rewrite")
 
 
-def _comparison_function_for_documents_by_part(doc1: Document, doc2: Document) -> int:
+async def _compact_and_deduplicate_text_within_budget(text: str, search_budget: Optional[SearchBudget]) -> str:
     """
-    Comparison function for sorting documents by their 'part' metadata.
-
-    Example parts:
-        /split/5
-        /split/5/summary
-        /split/5/summary/join
-        /split/13
-        /split/13/summary
-        /split/14
-        /split/14/summary
-
-    Become:
-        /split/5
-        /split/13
-        /split/14
-        /split/13/summary
-        /split/5/summary
-        /split/14/summary
-        /split/5/summary/join
-
-    Args:
-        doc1 (Document): First document to compare.
-        doc2 (Document): Second document to compare.
-    
-    Returns:
-        int: Negative if doc1 < doc2, positive if doc1 > doc2, zero if equal.
+    Compact and deduplicate text with LLM, within the search budget.
+    Falls back to the original text if the LLM request fails or times out.
     """
-    part1: str = doc1.metadata.get('part', '')
-    part2: str = doc2.metadata.get('part', '')
-
-    # Split the parts into components
-    part1_components = part1.split('/')
-    part2_components = part2.split('/')
-
-    # Compare the number of components first
-    if len(part1_components) < len(part2_components):
-        return -1
-    elif len(part1_components) > len(part2_components):
-        return 1
-
-    # Compare the components one by one
-    for comp1, comp2 in zip(part1_components, part2_components):
-        if comp1.isdigit() and comp2.isdigit():
-            # Compare as integers if both components are digits
-            if int(comp1) < int(comp2):
-                return -1
-            elif int(comp1) > int(comp2):
-                return 1
+    try:
+        if search_budget is None:
+            compacted_text = await compact_and_deduplicate_text(text)
         else:
-            # Compare as strings otherwise
-            if comp1 < comp2:
-                return -1
-            elif comp1 > comp2:
-                return 1
-    # If all components are equal, compare by length
-    if len(part1_components) < len(part2_components):
-        return -1
-    elif len(part1_components) > len(part2_components):
-        return 1
-    else:
-        return 0
-
-def _group_documents_by_plob_id(documents: List[Document]) -> List[PlobDocuments]:
-    """
-    Group documents by their plob_id.
-    
-    Args:
-        documents (List[Document]): List of documents to group.
-    
-    Returns:
-        List[PlobDocuments]: List of tuples, each containing a plob_id and the corresponding list of documents.
-    """
-    results: List[PlobDocuments] = []
-    for doc in documents:
-        plob_id = doc.metadata.get('plob_id', None)
-        # Looking for plob_id in results
-        found_blob_id = False
-        for plob_docs in results:
-            if plob_docs.plob_id == plob_id:
-                # Found the plob_id, append the document
-                plob_docs.documents.append(doc)
-                found_blob_id = True
-                break
-        if not found_blob_id:
-            # Create a new PlobDocuments instance if plob_id not found
-            new_plob_docs = PlobDocuments(plob_id=plob_id, documents=[doc])
-            results.append(new_plob_docs)
-
-    return results
+            compacted_text = await search_budget.run_optional_stage("merge_rewrite", compact_and_deduplicate_text(text))
+        return compacted_text or text
+    except Exception as e:
+        # Probably LLM request failed (or timed out),
+        # no re-try because of performance reasons
+        if search_budget is not None:
+            search_budget.mark_degraded("merge_rewrite", DEGRADED_ERROR)
+        logger.warning(f"Error while rewriting merged content - continue with original content: {e}")
+        return text
 
 
 #
@@ -560,15 +592,21 @@ async def find_documents(
     #    alpha = 1 forces using a pure vector search method
     #    alpha = 0.5 weighs the BM25 and vector methods evenly
     logger.info(f"Find documents for question: '{str_limit(str_for_embedding, 150)}' (k={k}, alpha={alpha})")
-    docs = vectorStore.similarity_search(str_for_embedding, k=k, alpha=alpha)
+    # (in a worker thread to allow concurrent searches, e.g. of batch requests)
+    with timing_span("vector_search", external=True), vectorstore_operation_duration_histogram.time(operation="query"):
+        docs = await asyncio.to_thread(vectorStore.similarity_search, str_for_embedding, k=k, alpha=alpha)
  
+    # Texts referenced by the documents: resolved with a single (cached) bulk lookup
+    with timing_span("text_lookup"):
+        text_by_sha256 = await aget_texts_from_sqldb(_get_referenced_text_sha256s(docs))
+
     # Content from metadata - if index data and search results are not the same
     consider_metadata_page_content = True
     if consider_metadata_page_content:
         # Yes, deliver extended content
         updated_docs: List[Document] = []        
         for doc in docs:
-            metadata_page_content = doc.metadata.get('page_content', None)
+            metadata_page_content = doc.metadata.get('page_content', None) or text_by_sha256.get(doc.metadata.get('page_content_sha256', None))
             if metadata_page_content:
                 # metadata_page_content exists, use it
                 logger.debug(f"  Use metadata_page_content for: {doc2str(doc)}")
@@ -586,7 +624,7 @@ async def find_documents(
         # Yes, deliver extended content
         updated_docs: List[Document] = []
         for doc in docs:
-            extended_page_content = doc.metadata.get("extended_page_content", None)
+            extended_page_content = _get_extended_page_content(doc, text_by_sha256)
             if extended_page_content:
                 # Extended content exists, use it
                 logger.debug(f"  Use extended_page_content for: {doc2str(doc)}")
@@ -610,3 +648,40 @@ async def find_documents(
     logger.debug(f"found {str(len(relevant_docs))} relevant docs out of {str(len(docs))} candidates")
     return relevant_docs
 
+
+def _get_referenced_text_sha256s(docs: List[Document]) -> List[str]:
+    """sha256 hashes of the texts in the SQL DB referenced by the metadata of the documents."""
+    sha256s: List[str] = []
+    for doc in docs:
+        if not doc.metadata.get("page_content", None) and doc.metadata.get("page_content_sha256", None):
+            sha256s.append(doc.metadata["page_content_sha256"])
+        if deliver_extended_content and doc.metadata.get("plob_text_sha256", None):
+            sha256s.append(doc.metadata["plob_text_sha256"])
+    return sha256s
+
+
+def _get_extended_page_content(doc: Document, text_by_sha256: Dict[str, str]) -> str | None:
+    """
+    Get the extended page content (page content + previous and next page contents) of a document.
+
+    The extended page content is sliced from the stored full text of the parent document,
+    based on the character offsets in the metadata.
+    
+    Args:
+        doc (Document): The document (usually a split).
+        text_by_sha256 (Dict[str, str]): Texts loaded from the SQL DB, see _get_referenced_text_sha256s().
+    
+    Returns:
+        str | None: The extended page content or None if not available.
+    """
+    plob_text_sha256 = doc.metadata.get("plob_text_sha256", None)
+    extended_start_index = doc.metadata.get("extended_start_index", None)
+    extended_end_index = doc.metadata.get("extended_end_index", None)
+    if plob_text_sha256 and extended_start_index is not None and extended_end_index is not None:
+        plob_text = text_by_sha256.get(plob_text_sha256)
+        if plob_text is not None:
+            return plob_text[int(extended_start_index):int(extended_end_index)]
+        logger.warning(f"Text of parent document not found in SQL DB: plob_text_sha256={plob_text_sha256}")
+
+    # Fallback: extended page content stored in the metadata (older index builds)
+    return doc.metadata.get("extended_page_content", None)
@@ -1,7 +1,7 @@
 ### Retrieval/Document Grader
 
 import logging
-from typing import List
+from typing import List, Optional
 from langchain_core.prompts import ChatPromptTemplate
 from pydantic import BaseModel, Field
 from langchain_core.documents import Document
@@ -10,6 +10,9 @@ from factory.llm_factory import get_document_grader_chat_llm
 #from rag_index_service.build_index import get_vectorstore, get_vectorstore_retriever, vectorStoreRetriever
 from common.utils.string_util import str_limit
 from model.ranked_document import RankedDocument
+from common.service.span_recorder import timing_span
+from common.service.admission_control import get_llm_limiter
+from .search_budget import SearchBudget, DEGRADED_CUT_SHORT
 
 logger = logging.getLogger(__name__)
 
@@ -53,11 +56,11 @@ async def filter_documents_based_on_binary_grade_for_question(question: str, doc
     retrieval_grader = grade_prompt | structured_llm_grader
 
     # Iterate over the documents
-    # TODO: make this parallel/async with ainvoke
+    # TODO: make this parallel
     relevant_docs: List[Document] = []
     for doc in documents:
         doc_txt = doc.page_content
-        relevance_binary_score = retrieval_grader.invoke({"question": question, "document": doc_txt})
+        relevance_binary_score = await retrieval_grader.ainvoke({"question": question, "document": doc_txt})
         logger.debug(f"relevance_binary_score={relevance_binary_score} for doc={str_limit(doc_txt, 1000)}")
         if (relevance_binary_score.binary_score == "yes"):
             relevant_docs.append(doc)
@@ -72,7 +75,9 @@ async def filter_documents_based_on_binary_grade_for_question(question: str, doc
 #
 async def filter_and_sort_documents_by_numeric_relevance_score_for_question(
         question: str,
-        documents: List[Document]
+        documents: List[Document],
+        search_budget: Optional[SearchBudget] = None,
+        stage: str = "grading"
         ) -> List[Document]:
     """
     Calculate a numeric score of relevance for each document.
@@ -80,9 +85,12 @@ async def filter_and_sort_documents_by_numeric_relevance_score_for_question(
     Sort the documents by their relevance score: most relevant first, less relevant last.
 
     This is a more advanced version of the document grader.
+
+    If the search_budget is exhausted, grading is cut short:
+    the remaining documents are kept ungraded (with minimum relevance score), and the stage is recorded as degraded.
     """
     # Action
-    result_ranked_docs: List[RankedDocument] = await _filter_and_sort_documents_by_numeric_relevance_score_for_question(question, documents)
+    result_ranked_docs: List[RankedDocument] = await _filter_and_sort_documents_by_numeric_relevance_score_for_question(question, documents, search_budget, stage)
 
     # Convert the list of tuples back to a list of Documents
     result_docs: List[Document] = [doc for _, doc in result_ranked_docs]
@@ -91,7 +99,9 @@ async def filter_and_sort_documents_by_numeric_relevance_score_for_question(
 
 async def _filter_and_sort_documents_by_numeric_relevance_score_for_question(
         question: str,
-        documents: List[Document]
+        documents: List[Document],
+        search_budget: Optional[SearchBudget] = None,
+        stage: str = "grading"
         ) -> List[RankedDocument]:
     """
     Calculate a numeric score of relevance for each document.
@@ -133,12 +143,20 @@ async def _filter_and_sort_documents_by_numeric_relevance_score_for_question(
     retrieval_grader = grade_prompt | structured_llm_grader
 
     # Iterate over the documents
-    # TODO: make this parallel/async with ainvoke
+    # TODO: make this parallel
     scored_docs: List[RankedDocument] = []
     for i, doc in enumerate(documents):
         doc_txt = doc.page_content
+        if search_budget is not None and not search_budget.has_time_for_optional_stage():
+            # Cut short: keep the remaining documents ungraded
+            search_budget.mark_degraded(stage, DEGRADED_CUT_SHORT)
+            logger.warning(f"Grading cut short after {i} of {len(documents)} docs - use minimum relevance score for the remaining docs")
+            scored_docs.extend((minimum_relevance_score, remaining_doc) for remaining_doc in documents[i:])
+            break
         try:
-            relevance_score = retrieval_grader.invoke({"question": question, "document": doc_txt})
+            async with get_llm_limiter("grader"):
+                with timing_span("llm_grade", external=True):
+                    relevance_score = await retrieval_grader.ainvoke({"question": question, "document": doc_txt})
             logger.debug(f"relevance_core={relevance_score} for #{i+1} doc={str_limit(doc_txt, 1000)}")
             if (relevance_score.numeric_score >= minimum_relevance_score):
                 scored_docs.append((relevance_score.numeric_score, doc))
@@ -2,16 +2,22 @@ from typing import TYPE_CHECKING
 from typing import (
     Any,
     List,
+    Optional,
+    Tuple,
 )
-import mimetypes
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+from bisect import bisect_left
+from itertools import accumulate, compress
+from collections import deque
+from dataclasses import dataclass
+from functools import cache
+import copy
 from langchain_core.documents import Document
 
 import logging
 
 from common.utils.hash_util import sha256sum_str
-from common.utils.string_util import str_limit, merge_two_strings_with_with_overlap_detection
-from langchain.text_splitter import TokenTextSplitter
+from common.utils.string_util import str_limit
+from factory.llm_factory import init_tiktiken_cache
 import tiktoken
 
 logger = logging.getLogger(__name__)
@@ -19,6 +25,170 @@ logger = logging.getLogger(__name__)
 chunk_size_tokens = 500
 chunk_overlap_tokens = 50
 
+# bytes 0x80..0xBF: continuation bytes of UTF-8 encoded characters
+_utf8_continuation_bytes = bytes(range(0x80, 0xC0))
+
+
+#
+# Splitter service
+#
+# The tokenizer is set up once, and each text is tokenized once:
+# the character offsets of its tokens are used for the size check and to measure the pieces
+# while searching the split boundaries (pieces are never re-tokenized).
+# Splits are character ranges of the text, so their offsets in the text are exact.
+#
+# The split boundaries follow the recursive character splitting of langchain's RecursiveCharacterTextSplitter
+# (paragraphs, lines, words, tokens - separators are kept at the start of the following piece).
+#
+
+@dataclass
+class TokenizedText:
+    text: str
+    # character offset of each token in text (ascending)
+    token_offsets: List[int]
+
+    @property
+    def token_count(self) -> int:
+        return len(self.token_offsets)
+
+    def count_tokens(self, start: int, end: int) -> int:
+        """Number of tokens starting in text[start:end]."""
+        return bisect_left(self.token_offsets, end) - bisect_left(self.token_offsets, start)
+
+
+class TokenTextSplitterService:
+    separators = ["\n\n", "\n", " ", ""]
+
+    def __init__(self, encoding: tiktoken.Encoding, chunk_size: int, chunk_overlap: int):
+        """
+        Args:
+            encoding: tokenizer
+            chunk_size (int): Max. number of tokens per split.
+            chunk_overlap (int): Max. number of tokens of the previous split repeated at the start of a split.
+        """
+        self.encoding = encoding
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+
+        # per token of the vocabulary: number of characters starting in it, and whether it starts within a character
+        self._token_char_counts: List[int] = []
+        self._token_starts_within_char: List[bool] = []
+        for token in range(encoding.n_vocab):
+            try:
+                token_bytes = encoding.decode_single_token_bytes(token)
+            except KeyError:
+                token_bytes = b""
+            self._token_char_counts.append(len(token_bytes.translate(None, _utf8_continuation_bytes)))
+            self._token_starts_within_char.append(bool(token_bytes) and 0x80 <= token_bytes[0] < 0xC0)
+
+    def tokenize(self, text: str) -> TokenizedText:
+        # special tokens in the text (e.g. "<|endoftext|>") are treated as normal text
+        tokens = self.encoding.encode(text, disallowed_special=())
+        # (same offsets as encoding.decode_with_offsets(), but with lookups instead of a Python loop over the bytes of the tokens)
+        token_offsets = list(accumulate(map(self._token_char_counts.__getitem__, tokens[:-1]), initial=0)) if tokens else []
+        # a token starting within a character belongs to that character (non-ASCII texts only)
+        for i in compress(range(len(tokens)), map(self._token_starts_within_char.__getitem__, tokens)):
+            token_offsets[i] = max(0, token_offsets[i] - 1)
+        return TokenizedText(text=text, token_offsets=token_offsets)
+
+    def count_tokens(self, text: str) -> int:
+        return len(self.encoding.encode(text, disallowed_special=()))
+
+    def split(self, tokenized: TokenizedText) -> List[Tuple[int, int]]:
+        """
+        Split a tokenized text.
+
+        Returns: character ranges (start, end) of the splits, in the order of the text
+        """
+        ranges = self._split_range(tokenized, 0, len(tokenized.text), self.separators)
+        return [stripped_range for stripped_range in (self._strip_range(tokenized.text, start, end) for start, end in ranges)
+                if stripped_range[0] < stripped_range[1]]
+
+    def _split_range(self, tokenized: TokenizedText, start: int, end: int, separators: List[str]) -> List[Tuple[int, int]]:
+        text = tokenized.text
+
+        # the first separator found in the range
+        separator = separators[-1]
+        new_separators: List[str] = []
+        for i, candidate_separator in enumerate(separators):
+            if candidate_separator == "":
+                separator = ""
+                break
+            if text.find(candidate_separator, start, end) != -1:
+                separator = candidate_separator
+                new_separators = separators[i + 1:]
+                break
+
+        # pieces of the range
+        if separator:
+            boundaries = [start]
+            position = text.find(separator, start + 1, end)
+            while position != -1:
+                boundaries.append(position)
+                position = text.find(separator, position + len(separator), end)
+        else:
+            # single tokens
+            boundaries = [start] + tokenized.token_offsets[bisect_left(tokenized.token_offsets, start + 1):bisect_left(tokenized.token_offsets, end)]
+        boundaries.append(end)
+        pieces = [(piece_start, piece_end) for piece_start, piece_end in zip(boundaries, boundaries[1:]) if piece_start < piece_end]
+
+        # merge small pieces, split large pieces recursively
+        ranges: List[Tuple[int, int]] = []
+        good_pieces: List[Tuple[int, int]] = []
+        for piece_start, piece_end in pieces:
+            if tokenized.count_tokens(piece_start, piece_end) < self.chunk_size:
+                good_pieces.append((piece_start, piece_end))
+            else:
+                if good_pieces:
+                    ranges.extend(self._merge_ranges(tokenized, good_pieces))
+                    good_pieces = []
+                if not new_separators:
+                    ranges.append((piece_start, piece_end))
+                else:
+                    ranges.extend(self._split_range(tokenized, piece_start, piece_end, new_separators))
+        if good_pieces:
+            ranges.extend(self._merge_ranges(tokenized, good_pieces))
+        return ranges
+
+    def _merge_ranges(self, tokenized: TokenizedText, pieces: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+        """Merge adjacent pieces to splits of up to chunk_size tokens, with up to chunk_overlap tokens overlap."""
+        ranges: List[Tuple[int, int]] = []
+        current: deque = deque()   # (start, end, token_count)
+        total = 0
+        for piece_start, piece_end in pieces:
+            piece_tokens = tokenized.count_tokens(piece_start, piece_end)
+            if total + piece_tokens > self.chunk_size and current:
+                ranges.append((current[0][0], current[-1][1]))
+                # keep the last pieces as overlap
+                while total > self.chunk_overlap or (total + piece_tokens > self.chunk_size and total > 0):
+                    total -= current.popleft()[2]
+            current.append((piece_start, piece_end, piece_tokens))
+            total += piece_tokens
+        if current:
+            ranges.append((current[0][0], current[-1][1]))
+        return ranges
+
+    @staticmethod
+    def _strip_range(text: str, start: int, end: int) -> Tuple[int, int]:
+        while start < end and text[start].isspace():
+            start += 1
+        while end > start and text[end - 1].isspace():
+            end -= 1
+        return start, end
+
+
+@cache
+def get_text_splitter_service() -> TokenTextSplitterService:
+    init_tiktiken_cache()
+    llm_model = "text-embedding-3-small" # doesn't need to be exact - we just need a rought guess here
+    encoding = tiktoken.encoding_for_model(llm_model)
+    logger.info(f"Setup done: text splitter with tokenizer {encoding.name} (chunk_size_tokens={chunk_size_tokens}, chunk_overlap_tokens={chunk_overlap_tokens})")
+    return TokenTextSplitterService(encoding, chunk_size_tokens, chunk_overlap_tokens)
+
+
+#
+# Splitting of documents
+#
 
 def split_single_document_into_parts_if_needed(doc: Document) -> List[Document]:
     """Split a single document into parts if needed.
@@ -31,14 +201,12 @@ def split_single_document_into_parts_if_needed(doc: Document) -> List[Document]:
     """
     text = doc.page_content
 
-    # Check if the document is too large
-    llm_model = "text-embedding-3-small" # doesn't need to be exact - we just need a rought guess here
-    encoding = tiktoken.encoding_for_model(llm_model)
-    token_count = len(encoding.encode(text))
+    # Check if the document is too large (the tokens are reused for the split)
+    tokenized = get_text_splitter_service().tokenize(text)
 
-    if token_count > chunk_size_tokens:
+    if tokenized.token_count > chunk_size_tokens:
         # Split
-        return split_single_document_into_parts(doc)
+        return split_single_document_into_parts(doc, tokenized)
     else:
         # No need to split, but also add metadata
         doc_part = doc.metadata.get("part", "")
@@ -51,42 +219,48 @@ def split_single_document_into_parts_if_needed(doc: Document) -> List[Document]:
         return [doc]
 
 
-def split_single_document_into_parts(doc: Document) -> List[Document]:
+def split_single_document_into_parts(doc: Document, tokenized: Optional[TokenizedText] = None) -> List[Document]:
+    """
+    Args:
+        doc: The document to split.
+        tokenized: The tokenized page content of the document, if already available.
+    """
+    # The parent text is stored only once (see document_storage.py),
+    # splits reference it with its sha256 and character offsets
+    plob_text = doc.page_content
+    plob_text_sha256 = sha256sum_str(plob_text)
+
     # Split
-    text_splitter = RecursiveCharacterTextSplitter.from_tiktoken_encoder(
-        chunk_size=chunk_size_tokens, chunk_overlap=chunk_overlap_tokens
-    )
-    doc_splits = text_splitter.split_documents([doc])
+    text_splitter = get_text_splitter_service()
+    if tokenized is None:
+        tokenized = text_splitter.tokenize(plob_text)
+    split_ranges = text_splitter.split(tokenized)
 
     # add to metadata
     doc_part = doc.metadata.get("part", "")
-    for i, doc_split in enumerate(doc_splits):
+    doc_splits: List[Document] = []
+    for i, (start_index, end_index) in enumerate(split_ranges):
+        doc_split = Document(page_content=plob_text[start_index:end_index], metadata=copy.deepcopy(doc.metadata))
         # doesn't exist yet: doc_split.metadata["document_id"] = doc.metadata["id"]
         doc_split.metadata["part"] = f"{doc_part}/split/{i}"
         doc_split.metadata["part_index"] = i
         doc_split.metadata["sha256"] = sha256sum_str(doc_split.page_content)
         doc_split.metadata["size"] = len(doc_split.page_content)
+        doc_split.metadata["start_index"] = start_index
+        doc_split.metadata["end_index"] = end_index
+        doc_splits.append(doc_split)
 
-    # add extended_page_content, i.e. the page_content + previous and next page_contents
+    # add offsets of the extended page content, i.e. the page_content + previous and next page_contents;
+    # the extended page content itself is sliced from the stored parent text at query time
     for i, doc_split in enumerate(doc_splits):
-        # add previous page content
-        extended_page_content = doc_split.page_content
-        if i > 0:
-            # previous page content exists
-            extended_page_content = merge_two_strings_with_with_overlap_detection(
-                doc_splits[i - 1].page_content,
-                doc_split.page_content
-            )
-        # add next page content
-        if i < len(doc_splits) - 1:
-            # next page content exists
-            extended_page_content = merge_two_strings_with_with_overlap_detection(
-                extended_page_content,
-                doc_splits[i + 1].page_content
-            )
-        # set the extended page content and futher metadata
-        doc_split.metadata["extended_page_content"] = extended_page_content
-        doc_split.metadata["extended_size"] = len(extended_page_content)
-        doc_split.metadata["extended_sha256"] = sha256sum_str(extended_page_content)
+        extended_start_index = doc_splits[max(i - 1, 0)].metadata["start_index"]
+        extended_end_index = doc_splits[min(i + 1, len(doc_splits) - 1)].metadata["end_index"]
+        # "plob_text" is transient: it's moved to the SQL DB before the split is stored in the vectorstore
+        doc_split.metadata["plob_text"] = plob_text
+        doc_split.metadata["plob_text_sha256"] = plob_text_sha256
+        doc_split.metadata["extended_start_index"] = extended_start_index
+        doc_split.metadata["extended_end_index"] = extended_end_index
+        doc_split.metadata["extended_size"] = extended_end_index - extended_start_index
 
+    logger.debug(f"Split document into {len(doc_splits)} parts ({tokenized.token_count} tokens): {str_limit(doc.metadata.get('title', 'No title'))}")
     return doc_splits
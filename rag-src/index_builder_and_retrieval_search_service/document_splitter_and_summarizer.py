@@ -2,14 +2,15 @@ from typing import TYPE_CHECKING
 from typing import (
     Any,
     List,
+    Optional,
 )
 from common.utils.hash_util import sha256sum_str
 import logging
-import asyncio
 from langchain_core.documents import Document
 from .document_splitter import split_single_document_into_parts_if_needed
-from .document_summarizer import summarize_text
+from .document_summarizer import summarize_text_blocking
 from common.service.configloader import deep_get, settings
+from factory.llm_health import get_llm_health_service, MODEL_SUMMARIZER
 
 
 logger = logging.getLogger(__name__)
@@ -21,21 +22,27 @@ include_summary_in_search_results = deep_get(settings, "config.rag_indexing.incl
 # Put all logic together to split a document into parts here and to summarize
 #
 
-def improve_and_split_single_document_into_parts(doc: Document, logging_prefix: str = "") -> List[Document]:
+def improve_and_split_single_document_into_parts(doc: Document, logging_prefix: str = "", doc_splits: Optional[List[Document]] = None) -> List[Document]:
     """
     Split a single document into parts if needed,
     and improve / enrich with additional LLM-generated summaries.
+
+    Args:
+        doc_splits: the parts of the document if already split (by the process pool stage)
     """
 
     doc_results = []
 
     # Get the document parts
-    doc_splits = split_single_document_into_parts_if_needed(doc)
+    if doc_splits is None:
+        doc_splits = split_single_document_into_parts_if_needed(doc)
     doc_results.extend(doc_splits)
     logger.info(f"{logging_prefix}DONE: Split document into {len(doc_splits)} document / parts: {doc.metadata.get('title', 'No title')}")
 
     # Optionally, caclulate and index summaries
-    if include_summary_in_search_index:
+    if include_summary_in_search_index and not get_llm_health_service().is_ready(MODEL_SUMMARIZER):
+        logger.warning(f"{logging_prefix}  Summarizer LLM is not healthy - skip adding summaries for document: {doc.metadata.get('title', 'No title')}")
+    elif include_summary_in_search_index:
         # Get summaries for each part
         logger.info(f"{logging_prefix}  Start adding about {len(doc_splits)} summaries for document: {doc.metadata.get('title', 'No title')} ...")
         summaries_of_doc_splits = [get_summary_document(doc_split) for doc_split in doc_splits]
@@ -81,7 +88,7 @@ def get_summary_document(doc: Document) -> Document | None:
     """
     # summarize into a single (temporary) document
     original_page_content = doc.page_content
-    summarized_text = asyncio.run(summarize_text(original_page_content))
+    summarized_text = summarize_text_blocking(original_page_content)
     #logger.debug(f"Summarized text: {summarized_text} for document: {doc.metadata.get('title', 'No title')}")
     if not summarized_text:
         logger.warning(f"No summary generated for document: {doc.metadata.get('title', 'No title')}")
@@ -91,6 +98,8 @@ def get_summary_document(doc: Document) -> Document | None:
 
         # add metadata, mainly from the first document
         summary_doc = enrich_document_from_parent_document(summary_doc, doc, "summary")
+        # (explicit marker: the "part" of the summary is replaced by the part of the original text below)
+        summary_doc.metadata["is_summary"] = True
 
         # add extended page content
         if include_summary_in_search_results:
@@ -102,9 +111,10 @@ def get_summary_document(doc: Document) -> Document | None:
             summary_doc.metadata["page_content"] = original_page_content
             summary_doc.metadata["part"] = doc.metadata.get("part", None)
             summary_doc.metadata["part_index"] = doc.metadata.get("part_index", None)
-            summary_doc.metadata["extended_page_content"] = doc.metadata.get("extended_page_content", None)
+            summary_doc.metadata["plob_text_sha256"] = doc.metadata.get("plob_text_sha256", None)
+            summary_doc.metadata["extended_start_index"] = doc.metadata.get("extended_start_index", None)
+            summary_doc.metadata["extended_end_index"] = doc.metadata.get("extended_end_index", None)
             summary_doc.metadata["extended_size"] = doc.metadata.get("extended_size", None)
-            summary_doc.metadata["extended_sha256"] = doc.metadata.get("extended_sha256", None)
 
         return summary_doc
 
@@ -16,23 +16,22 @@ else:
     DBAPICursor = any
 from langchain_core.vectorstores import VectorStore
 from common.service.configloader import deep_get, settings
-from factory.vectorstore_factory import get_vectorstore
+from factory.vectorstore_factory import get_vectorstore, vectorstore_operation_duration_histogram
 
 from langchain_core.documents import Document
 from langchain_core.embeddings import Embeddings
 import logging
 from common.utils.hash_util import sha256sum_str
 from common.utils.string_util import str_limit
-from index_builder_basics.document_storage_sql_database import get_sql_database_connection_after_setup, get_2nd_sql_database_connection_after_setup
-from index_builder_basics.embeddings_cache import get_or_caclulate_and_save_text_sha256_and_embedding_with_sqldb
+from index_builder_basics.document_storage_sql_database import get_sql_database_connection_after_setup, save_plob_text_in_sqldb
+from index_builder_basics.page_store import PlobPage, delete_plob_pages_from_sqldb, save_plob_pages_in_sqldb
+from index_builder_basics.embeddings_cache import get_or_caclulate_and_save_text_sha256_and_embedding_with_sqldb, get_or_caclulate_and_save_texts_sha256_and_embeddings_with_sqldb
+from index_builder_basics.sql_batch_writer import SqlBatchWriter
+from index_builder_basics.text_store import save_texts_in_sqldb, text_store_enabled
 from model.plob import Plob
 
 logger = logging.getLogger(__name__)
 
-#_sqlCon: DBAPIConnection | None = None
-_sqlCon = None
-
-
 
 #
 # processing multiple documents
@@ -56,43 +55,45 @@ _sqlCon = None
 #
 def save_single_plob_and_its_documents_in_databases(plob: Plob,
                                                     doc_contents: Iterator[Document]
-                                                   ) -> Tuple[Document, Iterator[Document]]:
+                                                   ) -> Tuple[Plob, int]:
     """
     Save a single document and its parts (contents)in the SQL DB and the vectorstore.
 
-    NOT LAZY: The document and its parts are processed and saved in the SQL DB and the vectorstore.
+    NOT LAZY: The document and its parts are processed and saved in the SQL DB and the vectorstore:
+    1. The parts are saved in the vectorstore batch by batch, their embeddings and texts in the SQL DB
+       (committed per batch - a cache, valid independent of the plob).
+    2. The old plob is replaced by the new one with its plob_document rows in a single short transaction.
+    So the slow calls of the embedding model and the vectorstore never hold the write lock of the SQL DB.
+
+    Returns: the stored plob and its number of stored parts
     """
 
+    # Save documents of plob in vectorstore (and their embeddings and texts in SQL DB)
+    now_timestamp = datetime.now(timezone.utc).isoformat()
+    plob_document_rows = [(document.metadata["document_sha256"], document.metadata.get("anker"))
+                          for document in save_documents_of_plob_in_vectorstore_and_sqldb(plob, doc_contents, now_timestamp)]
+    logger.debug(f"url={plob.url} - saved doc parts in vectorstore: plob_id={plob.id}, doc_contents_stored={len(plob_document_rows)}")
+
     sqlConnection = get_sql_database_connection_after_setup()
-    sqlConnection4Embeddings = get_2nd_sql_database_connection_after_setup()
+    sqlBatchWriter = SqlBatchWriter(sqlConnection)
     try:
         # Cleanup: delete old document entry from SQL DB
         delete_old_plob_from_sqldb(sqlConnection, plob.url)
-
         logger.debug(f"url={plob.url} - deleted old plob entry from SQL DB")
 
-        # Save plob in SQL DB
-        now_timestamp = datetime.now(timezone.utc).isoformat()
+        # Save plob and its plob_document rows in SQL DB
         plob_stored = save_plob_only_in_sqldb(sqlConnection, plob, now_timestamp)
-        plob_id = plob_stored.id
-        logger.debug(f"url={plob.url} - saved plob in SQL DB: plob_id={plob_id}")
-
-        # Save documents of plob in SQL DB and vectorstore
-        doc_contents_list = list(doc_contents)
-        plob_documents_stored = save_documents_of_plob_in_vectorstore_and_sqldb(sqlConnection, sqlConnection4Embeddings, plob_stored, doc_contents_list, now_timestamp)
-        # Un-lazy
-        plob_documents_stored_done = list(plob_documents_stored)
-        logger.debug(f"url={plob.url} - saved doc parts in SQL DB and vectorstore: plob_id={plob_id}, doc_contents_stored={str_limit(plob_documents_stored_done, 1024)}")
+        save_plob_document_rows_in_sqldb(sqlBatchWriter, plob_stored.id, plob_document_rows, now_timestamp)
 
         # Done
-        sqlConnection.commit()
-        logger.debug(f"url={plob.url} - DONE - Saved plob and doc parts in SQL DB and vectorstore: plob_id={plob_id} with {len(plob_documents_stored_done)} doc parts")
-        return plob_stored, plob_documents_stored_done
+        sqlBatchWriter.commit()
+        logger.debug(f"url={plob.url} - DONE - Saved plob and doc parts in SQL DB and vectorstore: plob_id={plob_stored.id} with {len(plob_document_rows)} doc parts")
+        return plob_stored, len(plob_document_rows)
 
     except Exception as e:
         logger.warning(f"url={plob.url}: {e}")
         try:
-            sqlConnection.rollback()
+            sqlBatchWriter.rollback()
         except Exception as e2:
             logger.warning(f"url={plob.url}: after exception {e}: rollback failed: {e2}")
         raise e
@@ -103,6 +104,57 @@ def save_single_plob_and_its_documents_in_databases(plob: Plob,
     #    sqlConnection.close()
 
 
+def save_single_streamed_plob_and_its_documents_in_databases(plob: Plob,
+                                                             doc_content_batches: Iterator[Tuple[List[Document], List[PlobPage]]]
+                                                            ) -> Tuple[Plob, int]:
+    """
+    Variant of save_single_plob_and_its_documents_in_databases() for plobs with streamed documents
+    (e.g. PDFs parsed page by page): a short transaction per batch of parts.
+
+    The batches are created (parsed, split, summarized, ...) and saved in the vectorstore between the transactions,
+    i.e. without holding the write lock of the SQL DB during slow LLM calls.
+    Therefore the plob is stored incrementally: after a failure it keeps the batches stored so far
+    until it is stored again (the next try deletes the old plob first).
+
+    Args:
+        doc_content_batches: per batch: the parts, and the pages to record for the per-page change detection (see page_store.py)
+
+    Returns: the stored plob and its number of stored parts
+    """
+
+    sqlConnection = get_sql_database_connection_after_setup()
+    sqlBatchWriter = SqlBatchWriter(sqlConnection)
+    try:
+        # Replace the old plob entry in SQL DB
+        now_timestamp = datetime.now(timezone.utc).isoformat()
+        delete_old_plob_from_sqldb(sqlConnection, plob.url)
+        plob_stored = save_plob_only_in_sqldb(sqlConnection, plob, now_timestamp)
+        sqlBatchWriter.commit()
+        logger.debug(f"url={plob.url} - replaced plob entry in SQL DB: plob_id={plob_stored.id}")
+
+        # Save the parts batch by batch - each batch is created and saved in the vectorstore outside of a transaction
+        plob_documents_stored_count = 0
+        for documents, plob_pages in doc_content_batches:
+            plob_document_rows = [(document.metadata["document_sha256"], document.metadata.get("anker"))
+                                  for document in save_documents_of_plob_in_vectorstore_and_sqldb(plob_stored, documents, now_timestamp)]
+            save_plob_document_rows_in_sqldb(sqlBatchWriter, plob_stored.id, plob_document_rows, now_timestamp)
+            save_plob_pages_in_sqldb(sqlBatchWriter, plob.url, plob_pages, now_timestamp)
+            sqlBatchWriter.commit()
+            plob_documents_stored_count += len(plob_document_rows)
+            logger.debug(f"url={plob.url} - saved batch of {len(documents)} doc parts and {len(plob_pages)} pages in SQL DB and vectorstore")
+
+        logger.debug(f"url={plob.url} - DONE - Saved plob and doc parts in SQL DB and vectorstore: plob_id={plob_stored.id} with {plob_documents_stored_count} doc parts")
+        return plob_stored, plob_documents_stored_count
+
+    except Exception as e:
+        logger.warning(f"url={plob.url}: {e}")
+        try:
+            sqlBatchWriter.rollback()
+        except Exception as e2:
+            logger.warning(f"url={plob.url}: after exception {e}: rollback failed: {e2}")
+        raise e
+
+
 # delete olg plob entries from SQL DB
 def delete_old_plob_from_sqldb(sqlConnection: DBAPIConnection, plob_url: str):
     # Is the url already in the DB? Then delete related entries now.
@@ -123,6 +175,9 @@ def delete_old_plob_from_sqldb(sqlConnection: DBAPIConnection, plob_url: str):
     cursor.close()
     logger.debug(f"Deleted {rowcount} row(s) with url={plob_url} from 'plob' table")
 
+    # Delete the recorded pages (re-recorded with the new plob, if parsed page by page)
+    delete_plob_pages_from_sqldb(sqlConnection, plob_url)
+
 
 # save plob (without its documents) in SQL DB, and add IDs
 def save_plob_only_in_sqldb(sqlConnection: DBAPIConnection, plob: Plob, now_timestamp: str) -> Plob:
@@ -142,47 +197,99 @@ def save_plob_only_in_sqldb(sqlConnection: DBAPIConnection, plob: Plob, now_time
     return plob
 
 
-# iterate over the documents, save them in SQL DB, and add IDs
-def save_documents_of_plob_in_vectorstore_and_sqldb(sqlConnection: DBAPIConnection,
-                                                    sqlConnection4Embeddings: DBAPIConnection,
-                                                    plob: Plob,
+# iterate over the documents, save them in the vectorstore, and add IDs
+def save_documents_of_plob_in_vectorstore_and_sqldb(plob: Plob,
                                                     documents: Iterator[Document],
                                                     now_timestamp: str
                                                    ) -> Iterator[Document]:
+    """
+    Save the documents of a plob in the vectorstore, and their embeddings and texts in the SQL DB
+    (committed per batch, a cache - the plob_document rows are saved by the caller, see save_plob_document_rows_in_sqldb()).
+
+    The documents are processed in batches of the writer's batch size:
+    the embeddings of a batch are calculated with a single call of the embedding model,
+    and the batch is added to the vectorstore with a single call.
+
+    Returns: the saved documents, with metadata "plob_id" and "document_sha256"
+    """
     plob_id = plob.id
     logger.debug(f"Start with documents of plob.id={plob_id}, plob.url={plob.url} ...")
     content_count = 0
+    saved_plob_text_sha256s = set()
+    batch_size = SqlBatchWriter(get_sql_database_connection_after_setup()).batch_size
 
     # save content parts
+    documents_batch: List[Document] = []
+    plob_text_by_sha256: Dict[str, str] = {}
     for document in documents:
-        logger.debug(f"document.metadata={str_limit(document.metadata, 1024)} document.page_content='{str_limit(document.page_content)}'")
-
         #
-        # save document in vectorstore and SQL DB (if not already there)
+        # save the (transient) parent text of a split only once in SQL DB - not in the vectorstore
         #
-        document_sha256 = save_single_document_in_vectorstore_and_sqldb(sqlConnection4Embeddings, document)
+        plob_text = document.metadata.pop("plob_text", None)
+        plob_text_sha256 = document.metadata.get("plob_text_sha256")
+        if plob_text is not None and plob_text_sha256 not in saved_plob_text_sha256s:
+            plob_text_by_sha256[plob_text_sha256] = plob_text
+            saved_plob_text_sha256s.add(plob_text_sha256)
 
-        #
-        # insert new content part into SQL DB
-        #
-        document_anker = document.metadata.get("anker")
-        logger.debug(f"insert plob_document row: document_id={plob_id}, content_sha256={document_sha256}, document_anker={document_anker}")
-        cursor = sqlConnection.cursor()
-        cursor.execute(
-            """INSERT INTO plob_document (plob_id, document_sha256, document_anker, row_last_modified)
-               VALUES (?, ?, ?, ?)""",
-            (plob_id, document_sha256, document_anker, now_timestamp)
-        )
-        cursor.close()
-        content_count += 1
+        logger.debug(f"document.metadata={str_limit(document.metadata, 1024)} document.page_content='{str_limit(document.page_content)}'")
+        documents_batch.append(document)
+        if len(documents_batch) >= batch_size:
+            yield from _save_documents_batch_of_plob_in_vectorstore_and_sqldb(plob_id, documents_batch, plob_text_by_sha256, now_timestamp)
+            content_count += len(documents_batch)
+            documents_batch = []
+            plob_text_by_sha256 = {}
+    if documents_batch:
+        yield from _save_documents_batch_of_plob_in_vectorstore_and_sqldb(plob_id, documents_batch, plob_text_by_sha256, now_timestamp)
+        content_count += len(documents_batch)
+
+    # loop done without exception
+
+    # iteration done
+    logger.debug(f"{content_count} documents saved - DONE")
+
+
+def _save_documents_batch_of_plob_in_vectorstore_and_sqldb(plob_id: str,
+                                                           documents: List[Document],
+                                                           plob_text_by_sha256: Dict[str, str],
+                                                           now_timestamp: str
+                                                          ) -> Iterator[Document]:
+    #
+    # calculate the missing embeddings first: committed right away, without holding the write lock during the embedding model call
+    #
+    get_or_caclulate_and_save_texts_sha256_and_embeddings_with_sqldb([document.page_content for document in documents])
+
+    #
+    # save parent texts, and documents in vectorstore and SQL DB (if not already there) - committed in save_documents_in_vectorstore_and_sqldb()
+    #
+    sqlBatchWriter = SqlBatchWriter(get_sql_database_connection_after_setup())
+    try:
+        for plob_text_sha256, plob_text in plob_text_by_sha256.items():
+            save_plob_text_in_sqldb(sqlBatchWriter.sqlConnection, plob_text_sha256, plob_text, now_timestamp, sqlBatchWriter)
+        document_sha256s = save_documents_in_vectorstore_and_sqldb(sqlBatchWriter, documents)
+    except Exception:
+        sqlBatchWriter.rollback()
+        raise
+
+    for document, document_sha256 in zip(documents, document_sha256s):
         document.metadata["plob_id"] = plob_id
         document.metadata["document_sha256"] = document_sha256
         yield document
 
-    # loop done without exception
 
-    # iteration done
-    logger.debug(f"{content_count} plob_document row(s) inserted - DONE")
+def save_plob_document_rows_in_sqldb(sqlBatchWriter: SqlBatchWriter,
+                                     plob_id: str,
+                                     plob_document_rows: List[Tuple[str, Optional[str]]],
+                                     now_timestamp: str
+                                    ) -> None:
+    """Add the plob_document rows (document_sha256, document_anker) of a plob to the writer (without commit)."""
+    for document_sha256, document_anker in plob_document_rows:
+        logger.debug(f"add plob_document row: document_id={plob_id}, content_sha256={document_sha256}, document_anker={document_anker}")
+        sqlBatchWriter.add(
+            """INSERT INTO plob_document (plob_id, document_sha256, document_anker, row_last_modified)
+               VALUES (?, ?, ?, ?)""",
+            (plob_id, document_sha256, document_anker, now_timestamp)
+        )
+    logger.debug(f"{len(plob_document_rows)} plob_document row(s) added")
 
 
 
@@ -218,7 +325,8 @@ def save_single_document_in_vectorstore_and_sqldb(sqlConnection4Embeddings: DBAP
 
         # save content in vectorstore - get/caclulate/save embedding again inclusive SQL DB
         logger.debug(f"3/4: Add document with sha256={document_sha256} to vectorStore")
-        resultIds = _vectorStore.add_texts(texts=[document_content], metadatas=[document.metadata],) # ids=[<UUID>])
+        with vectorstore_operation_duration_histogram.time(operation="insert"):
+            resultIds = _vectorStore.add_texts(texts=[document_content], metadatas=[document.metadata],) # ids=[<UUID>])
         logger.debug("4/4: After adding to vectorstore")
         
         # final logging
@@ -236,6 +344,57 @@ def save_single_document_in_vectorstore_and_sqldb(sqlConnection4Embeddings: DBAP
         #return None
 
 
+def save_documents_in_vectorstore_and_sqldb(sqlBatchWriter: SqlBatchWriter,
+                                            documents: List[Document]
+                                            ) -> List[str]:
+    """
+    Batch variant of save_single_document_in_vectorstore_and_sqldb():
+    Add documents of a single plob to the SQL DB (with the writer, committed before the vectorstore write) and the vectorstore.
+
+    Returns: The sha256 hashes of the documents (same order), or raise an exception in the case of an error
+    """
+
+    try:
+        # preparation
+        _vectorStore = get_vectorstore()
+        document_contents = [document.page_content for document in documents]
+
+        # get/caclulate/save embeddings from/to SQL DB - with a single call of the embedding model
+        sha256s_and_embeddings = get_or_caclulate_and_save_texts_sha256_and_embeddings_with_sqldb(document_contents, sqlBatchWriter=sqlBatchWriter)
+        document_sha256s = [document_sha256 for document_sha256, _ in sha256s_and_embeddings]
+
+        # enrich content metadata before adding it to the vectorstore
+        for document, document_sha256 in zip(documents, document_sha256s):
+            document.metadata["document_sha256"] = document_sha256
+
+        # search result text differing from the indexed text (e.g. original text of a summary):
+        # in the text store, referenced by its sha256 in the vectorstore
+        if text_store_enabled:
+            metadata_page_content_by_sha256: Dict[str, str] = {}
+            for document in documents:
+                metadata_page_content = document.metadata.pop("page_content", None)
+                if metadata_page_content:
+                    metadata_page_content_sha256 = sha256sum_str(metadata_page_content)
+                    metadata_page_content_by_sha256[metadata_page_content_sha256] = metadata_page_content
+                    document.metadata["page_content_sha256"] = metadata_page_content_sha256
+            save_texts_in_sqldb(sqlBatchWriter.sqlConnection, metadata_page_content_by_sha256,
+                                datetime.now(timezone.utc).isoformat(), sqlBatchWriter)
+
+        # save contents in vectorstore - its (cached) embedding function finds the new (committed) embeddings;
+        # the vectorstore write doesn't hold the write lock of the SQL DB
+        sqlBatchWriter.commit()
+        with vectorstore_operation_duration_histogram.time(operation="insert"):
+            resultIds = _vectorStore.add_texts(texts=document_contents, metadatas=[document.metadata for document in documents],)
+        logger.debug(f"Added {len(documents)} documents to vectorStore with id(s)={str_limit(resultIds, 1024)}")
+
+        # done
+        return document_sha256s
+
+    except Exception as e:
+        logger.warning(f"Batch of {len(documents)} documents: {e}")
+        raise e
+
+
 def get_or_caclulate_and_save_content_sha256_and_embedding_with_sqldb(sqlConnection4Embeddings: DBAPIConnection,
                                                                       content: str
                                                                      ) -> Tuple[str, List[float]]:
@@ -9,73 +9,83 @@ import time
 
 from factory.llm_factory import get_document_summarizer_chat_llm
 from common.utils.string_util import str_limit
+from common.service.span_recorder import timing_span
+from common.service.admission_control import get_llm_limiter
 
 logger = logging.getLogger(__name__)
 
 
-async def summarize_text(text: str) -> str | None:
+def summarize_text_blocking(text: str) -> str | None:
     """
-    Summarize a text with LLM.
+    Summarize a text with LLM - blocking, for the indexing threads (without event loop).
+
+    An async version would need an event loop per call (asyncio.run()),
+    but the shared async HTTP connections are bound to the event loop of the API server.
     """
 
     # Start time (for calculation of processing time)
     start_time = time.monotonic()
 
     try:
-        # Data model
-        class TextSummary(BaseModel):
-            """Summary of a text."""
-
-            summary: str = Field(
-                description="The summary of the text.",
-            )
-
-        # LLM with function call
-        llm = get_document_summarizer_chat_llm()
-        structured_llm_summarizer = llm.with_structured_output(TextSummary)
-
-        # Prompt
-        system = """You are a helpful assistant for text summarization. \n"""
-        user = """Please summarize the following text chunk in **2–3 sentences**,
-            writing the summary **in the same language as the original text**.
-            Return **only** a JSON object with a single field "summary"`\n
-            \n
-            Do not include any additional keys or commentary.\n
-            \n
-            Text:\n
-            {TEXT}
-            """
-        prompt = ChatPromptTemplate.from_messages(
-            [
-                ("system", system),
-                ("human", user),
-            ]
-        )
-
-        # Combine the prompt and the LLM
-        summarizer = prompt | structured_llm_summarizer
-
-        # Iterate over the documents
+        summarizer = _create_text_summarizer()
         textSummary = summarizer.invoke({"TEXT": text})
-        used_millis = (time.monotonic() - start_time) * 1000 
-        if logger.isEnabledFor(logging.DEBUG):
-            logger.debug(f"textSummary={textSummary} after {used_millis} ms for text={str_limit(text, 1000)}")
-
-        # Result
-        if textSummary.summary:
-            return textSummary.summary
-        else:
-            logger.warning("No summary generated.")
-            #return "No summary available."
-            #return text[:100] + "..." if len(text) > 100 else text
-            return None
+        return _get_summary_from_result(textSummary, text, start_time)
     except Exception as e:
         used_millis = int((time.monotonic() - start_time) * 1000)
-        text_str = str({"TEXT": text})
-        logger.warning(f"Error summarizing text for text {text_str} with prompt={prompt} after {used_millis} ms: {e}")
+        logger.warning(f"Error summarizing text for text {str_limit(text, 1000)} after {used_millis} ms: {e}")
         raise e
 
 
+class TextSummary(BaseModel):
+    """Summary of a text."""
+
+    summary: str = Field(
+        description="The summary of the text.",
+    )
+
+
+def _create_text_summarizer():
+    # LLM with function call
+    llm = get_document_summarizer_chat_llm()
+    structured_llm_summarizer = llm.with_structured_output(TextSummary)
+
+    # Prompt
+    system = """You are a helpful assistant for text summarization. \n"""
+    user = """Please summarize the following text chunk in **2–3 sentences**,
+        writing the summary **in the same language as the original text**.
+        Return **only** a JSON object with a single field "summary"`\n
+        \n
+        Do not include any additional keys or commentary.\n
+        \n
+        Text:\n
+        {TEXT}
+        """
+    prompt = ChatPromptTemplate.from_messages(
+        [
+            ("system", system),
+            ("human", user),
+        ]
+    )
+
+    # Combine the prompt and the LLM
+    return prompt | structured_llm_summarizer
+
+
+def _get_summary_from_result(textSummary: TextSummary, text: str, start_time: float) -> str | None:
+    used_millis = (time.monotonic() - start_time) * 1000
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f"textSummary={textSummary} after {used_millis} ms for text={str_limit(text, 1000)}")
+
+    # Result
+    if textSummary.summary:
+        return textSummary.summary
+    else:
+        logger.warning("No summary generated.")
+        #return "No summary available."
+        #return text[:100] + "..." if len(text) > 100 else text
+        return None
+
+
 async def compact_and_deduplicate_text(text: str) -> str | None:
     """
     Compact text and remove duplicated content using LLM.
@@ -133,7 +143,9 @@ You should:
     compactor = prompt | structured_llm_compactor
 
     # Process the text
-    compacted_result = compactor.invoke({"TEXT": text})
+    async with get_llm_limiter("summarizer"):
+        with timing_span("llm_compaction", external=True):
+            compacted_result = await compactor.ainvoke({"TEXT": text})
     if logger.isEnabledFor(logging.DEBUG):
         logger.debug(f"compacted_result={compacted_result}    for text={str_limit(text, 1000)}")
 
@@ -85,25 +85,36 @@ class BlobParserDocumentLoader(BaseLoader):
             logger.debug(f"Blob to parse: {blob}")
 
             try:
-                # Check if blobParser contains function "lazy_parse2media"
-                if hasattr(self.blobParser, "lazy_parse2plob"):
-                    # Parse directly to plob
-                    plob = list([self.blobParser.lazy_parse2plob(blob)])[0]
-
-                    # Result
-                    logger.info(f"Extracted plob directly - yielded now: {plob}")
-                    yield plob
-                else:
-                    # Parse regularly - to documents
-                    documents = list(self.blobParser.lazy_parse(blob))
-
-                    # Create plob containing the documents
-                    plob = create_plob_with_metadata_of_blob(blob)
-                    plob.documents = list(documents)
-
-                    # Result
-                    logger.info(f"Extracted documents and created plob - yielded now: {plob} with {len(plob.documents)} documents")
-                    yield plob
+                plob = parse_blob_to_plob(self.blobParser, blob)
+
+                # Result
+                documents_count = "streamed" if plob.documents_streamed else len(plob.documents)
+                logger.info(f"Extracted plob - yielded now: {plob} with {documents_count} documents")
+                yield plob
             except Exception as e:
                 logger.warning(f"Error while parsing blob {blob}: {e} - continue with next")
-                continue
\ No newline at end of file
+                continue
+
+    def yield_blobs(self) -> Iterator[Blob]:
+        """The blobs of the blobLoader, to parse them elsewhere (e.g. in the process pool stage) with parse_blob_to_plob()."""
+        return self.blobLoader.yield_blobs()
+
+
+def parse_blob_to_plob(blobParser: BaseBlobParser, blob: Blob) -> Plob:
+    """
+    Parse a blob into one plob with one or multiple documents.
+
+    Top-level function: can be called in a worker process (with a picklable blobParser).
+    """
+    # Check if blobParser contains function "lazy_parse2plob"
+    if hasattr(blobParser, "lazy_parse2plob"):
+        # Parse directly to plob
+        plob = next(iter(blobParser.lazy_parse2plob(blob)))
+    else:
+        # Parse regularly - to documents
+        documents = list(blobParser.lazy_parse(blob))
+
+        # Create plob containing the documents
+        plob = create_plob_with_metadata_of_blob(blob)
+        plob.documents = list(documents)
+    return plob
@@ -1,4 +1,4 @@
-from typing import Iterator, Mapping, Generator
+from typing import Iterable, Iterator, Mapping, Generator, Optional
 from langchain_core.documents import Document
 from langchain_core.documents.base import Blob
 from langchain_community.document_loaders.base import BaseBlobParser
@@ -7,10 +7,19 @@ from langchain_community.document_loaders.parsers.txt import TextParser
 from langchain_community.document_loaders.parsers.pdf import PyPDFParser
 from model.plob import Plob
 from common.plob_creator import create_plob_with_metadata_of_blob
+from common.service.configloader import deep_get, settings
+from .section_parsers import HtmlSectionParser, MarkdownSectionParser
+from .pdf_page_parser import PdfPageStreamingParser
 import logging
 
 logger = logging.getLogger(__name__)
 
+# structure-aware parsing of HTML and Markdown: documents aligned to the sections, with heading anchors
+section_parsing_enabled = deep_get(settings, "config.rag_indexing.section_parsing.enabled", default_value=True)
+markdown_file_extensions = (".md", ".markdown")
+# page-streaming parsing of PDFs: documents parsed page by page while processed, with per-page change detection
+pdf_page_streaming_enabled = deep_get(settings, "config.rag_indexing.pdf_page_streaming.enabled", default_value=False)
+
 
 class DefaultBlob2DocumentsParser(BaseBlobParser):
     def __init__(self):
@@ -20,6 +29,14 @@ class DefaultBlob2DocumentsParser(BaseBlobParser):
             "text/plain": TextParser(),
             "application/pdf": PyPDFParser(),
         }
+        if section_parsing_enabled:
+            self.handlers["text/html"] = HtmlSectionParser()
+            self.handlers["text/markdown"] = MarkdownSectionParser()
+            self.handlers["text/x-markdown"] = MarkdownSectionParser()
+        if pdf_page_streaming_enabled:
+            self.handlers["application/pdf"] = PdfPageStreamingParser()
+        # parsers whose documents are streamed (see StreamedBlobDocuments)
+        self.streaming_parser_types = (PdfPageStreamingParser,)
         self.fallback_parser = TextParser()
 
 
@@ -51,13 +68,8 @@ class DefaultBlob2DocumentsParser(BaseBlobParser):
 
     def _lazy_parse_to_pure_documents(self, blob: Blob) -> Iterator[Document]:
         """Load documents from a blob. Inspired by MimeTypeBasedParser.lazy_parse()."""
-        mimetype = blob.mimetype
-
-        if mimetype is None:
-            raise ValueError(f"{blob} does not have a mimetype.")
-
-        if mimetype in self.handlers:
-            handler = self.handlers[mimetype]
+        handler = self.get_handler(blob)
+        if handler is not None:
             logger.debug(f"Parsing blob to documents: blob={blob}, handler={handler}")
             # Parse the blob using the appropriate handler
             yield from handler.lazy_parse(blob)
@@ -66,7 +78,19 @@ class DefaultBlob2DocumentsParser(BaseBlobParser):
                 logger.debug(f"Parsing blob to documents FALLBACK: blob={blob} with fallback_parser={self.fallback_parser}")
                 yield from self.fallback_parser.lazy_parse(blob)
             else:
-                raise ValueError(f"Unsupported mime type: {mimetype}")
+                raise ValueError(f"Unsupported mime type: {blob.mimetype}")
+
+    def get_handler(self, blob: Blob) -> Optional[BaseBlobParser]:
+        """The parser for the mime type of the blob, or None (fallback)."""
+        mimetype = blob.mimetype
+
+        if mimetype is None:
+            raise ValueError(f"{blob} does not have a mimetype.")
+        if mimetype == "text/plain" and str(blob.source or "").lower().endswith(markdown_file_extensions):
+            # e.g. Markdown files served as text/plain
+            mimetype = "text/markdown"
+
+        return self.handlers.get(mimetype)
 
 
 
@@ -83,12 +107,32 @@ class DefaultBlob2PlobParser(DefaultBlob2DocumentsParser):
         """Load plob including its documents from a blob."""
         logger.info(f"Parsing blob to plob: blob={blob}")
 
-        # Parse regularly - to documents
-        documents = self.lazy_parse(blob)
-
         # Create plob containing the documents
         plob = create_plob_with_metadata_of_blob(blob)
-        plob.documents = list(documents)
+        if isinstance(self.get_handler(blob), self.streaming_parser_types):
+            # Parse later, while the plob is processed
+            plob.documents = StreamedBlobDocuments(self, blob)
+            plob.documents_streamed = True
+        else:
+            # Parse regularly - to documents
+            plob.documents = list(self.lazy_parse(blob))
 
         # Result
         yield plob
+
+
+class StreamedBlobDocuments(Iterable[Document]):
+    """
+    The documents of a blob, parsed with each iteration (e.g. page by page by PdfPageStreamingParser):
+    the documents are never held in memory together, and can be iterated again (e.g. by a re-try).
+    """
+
+    def __init__(self, blobParser: BaseBlobParser, blob: Blob) -> None:
+        self.blobParser = blobParser
+        self.blob = blob
+
+    def __iter__(self) -> Iterator[Document]:
+        return self.blobParser.lazy_parse(self.blob)
+
+    def __repr__(self) -> str:
+        return f"StreamedBlobDocuments(blob={self.blob.source})"
@@ -0,0 +1,84 @@
+from typing import (
+    Any,
+    Dict,
+    Iterator,
+    List,
+)
+from langchain_core.documents import Document
+from langchain_core.documents.base import Blob
+from langchain_community.document_loaders.base import BaseBlobParser
+import pypdf
+
+from common.utils.hash_util import sha256sum_str
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+#
+# Page-streaming parsing of PDF files: one document per page, extracted one page after the other
+# (the pages of a file are never held in memory together).
+#
+# Metadata of each document:
+# - page_number:  page number (1-based, from the position of the page in the file) - results in the anker "page-<page_number>"
+# - page_sha256:  sha256 hash of the extracted text of the page, for the per-page change detection (see page_store.py)
+# - part:         "/page/<page_number>" (parts of a plob are sorted by it)
+# - page, page_label, total_pages: as with PyPDFParser (page is 0-based)
+#
+# Pages without text (e.g. scanned images) are skipped, the numbers of the other pages stay the same.
+#
+
+class PdfPageStreamingParser(BaseBlobParser):
+    """Parse a PDF into one document per page, page by page (with pypdf)."""
+
+    def __init__(self, password: str | None = None) -> None:
+        self.password = password
+
+    def __str__(self) -> str:
+        return f"PdfPageStreamingParser()"
+
+    def lazy_parse(self, blob: Blob) -> Iterator[Document]:
+        with blob.as_bytes_io() as pdf_file:
+            pdf_reader = pypdf.PdfReader(pdf_file, password=self.password)
+            total_pages = len(pdf_reader.pages)
+            metadata: Dict[str, Any] = {"source": blob.source, "total_pages": total_pages}
+            title = _get_pdf_title(pdf_reader)
+            if title:
+                metadata["title"] = title
+            page_labels = _get_page_labels(pdf_reader, total_pages)
+
+            for page_index in range(total_pages):
+                text = pdf_reader.pages[page_index].extract_text().strip()
+                if not text:
+                    logger.debug(f"{blob.source}: page {page_index + 1}/{total_pages} without text - skipped")
+                    continue
+                page_number = page_index + 1
+                yield Document(page_content=text, metadata={
+                    **metadata,
+                    "page": page_index,
+                    "page_label": page_labels[page_index],
+                    "page_number": page_number,
+                    "page_sha256": sha256sum_str(text),
+                    "part": f"/page/{page_number}",
+                    "part_index": page_index,
+                })
+
+
+def _get_pdf_title(pdf_reader: pypdf.PdfReader) -> str | None:
+    try:
+        if pdf_reader.metadata and pdf_reader.metadata.title:
+            return str(pdf_reader.metadata.title).strip() or None
+    except Exception as e:
+        logger.debug(f"PDF without readable metadata: {e}")
+    return None
+
+
+def _get_page_labels(pdf_reader: pypdf.PdfReader, total_pages: int) -> List[str]:
+    """The labels of all pages (computed once - pdf_reader.page_labels computes all of them with each call)."""
+    try:
+        page_labels = [str(page_label) for page_label in pdf_reader.page_labels]
+        if len(page_labels) == total_pages:
+            return page_labels
+    except Exception as e:
+        logger.debug(f"PDF without readable page labels: {e}")
+    return [str(page_index + 1) for page_index in range(total_pages)]
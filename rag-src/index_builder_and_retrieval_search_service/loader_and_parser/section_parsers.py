@@ -0,0 +1,301 @@
+from typing import (
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+)
+from dataclasses import dataclass
+import re
+from bs4 import BeautifulSoup, CData, NavigableString, Tag
+from langchain_core.documents import Document
+from langchain_core.documents.base import Blob
+from langchain_community.document_loaders.base import BaseBlobParser
+
+from common.service.configloader import deep_get, settings
+from index_builder_and_retrieval_search_service.document_splitter import chunk_size_tokens, get_text_splitter_service
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+#
+# Structure-aware parsing of HTML and Markdown files: one document per section (or group of sections)
+#
+# The text is divided at the headings into sections (heading + text up to the next heading).
+# Each document contains a section with all its sub-sections if they fit into max_section_tokens,
+# otherwise the text of the section itself (split later by the document splitter if still too large)
+# and its sub-sections packed in the same way. Consecutive small sections are packed together.
+#
+# Metadata of each document:
+# - anker:        the #id of its first heading (HTML: id attribute, Markdown: {#id} or GitHub-style slug)
+# - section_path: the headings from the top to its first heading, e.g. "History > Versions"
+# - part:         "/section/<index>" (parts of a plob are sorted by it)
+#
+
+max_section_tokens = deep_get(settings, "config.rag_indexing.section_parsing.max_section_tokens", default_value=chunk_size_tokens)
+section_path_separator = " > "
+
+
+@dataclass
+class Section:
+    # 0 = text before the first heading, 1-6 = heading level
+    level: int
+    heading: str
+    anchor: Optional[str]
+    path: str
+    text: str
+
+
+def sections_to_documents(sections: List[Section], metadata: Dict, max_tokens: int = max_section_tokens) -> List[Document]:
+    """
+    Pack sections (in document order) into documents of up to max_tokens tokens each,
+    aligned to the section structure.
+    """
+    sections = [section for section in sections if section.text.strip()]
+    text_splitter = get_text_splitter_service()
+    tokens = [text_splitter.count_tokens(section.text) for section in sections]
+
+    def subtree_end(i: int) -> int:
+        j = i + 1
+        while j < len(sections) and sections[j].level > sections[i].level:
+            j += 1
+        return j
+
+    # groups of consecutive sections
+    groups: List[Tuple[int, int]] = []
+    group_start, group_end, group_tokens = 0, 0, 0
+    i = 0
+    while i < len(sections):
+        j = subtree_end(i)
+        subtree_tokens = sum(tokens[i:j])
+        if subtree_tokens > max_tokens:
+            # the section itself, its sub-sections follow
+            j = i + 1
+            subtree_tokens = tokens[i]
+        # start a new group if the section doesn't fit, or if it's on a higher level than the first one of the group
+        if group_end > group_start and (group_tokens + subtree_tokens > max_tokens or sections[i].level < sections[group_start].level):
+            groups.append((group_start, group_end))
+            group_start, group_tokens = i, 0
+        group_end = j
+        group_tokens += subtree_tokens
+        i = j
+    if group_end > group_start:
+        groups.append((group_start, group_end))
+
+    documents: List[Document] = []
+    for index, (start, end) in enumerate(groups):
+        first_section = sections[start]
+        document_metadata = dict(metadata)
+        if first_section.anchor:
+            document_metadata["anker"] = first_section.anchor
+        document_metadata["section_path"] = first_section.path
+        document_metadata["part"] = f"/section/{index}"
+        document_metadata["part_index"] = index
+        page_content = "\n\n".join(section.text.strip() for section in sections[start:end])
+        documents.append(Document(page_content=page_content, metadata=document_metadata))
+    return documents
+
+
+def _normalize_text(text: str) -> str:
+    """Remove trailing whitespace of the lines and multiple empty lines."""
+    text = "\n".join(line.rstrip() for line in text.split("\n"))
+    return re.sub(r"\n{3,}", "\n\n", text).strip()
+
+
+class _SectionCollector:
+    """Collect sections while reading a text with headings."""
+
+    def __init__(self) -> None:
+        self.sections: List[Section] = [Section(level=0, heading="", anchor=None, path="", text="")]
+        self._texts: List[str] = []
+        # (level, heading) of the current section and its parents
+        self._heading_stack: List[Tuple[int, str]] = []
+
+    def add_text(self, text: str) -> None:
+        self._texts.append(text)
+
+    def add_heading(self, level: int, heading: str, anchor: Optional[str], heading_text: str) -> None:
+        self._finish_section()
+        while self._heading_stack and self._heading_stack[-1][0] >= level:
+            self._heading_stack.pop()
+        self._heading_stack.append((level, heading))
+        path = section_path_separator.join(h for _, h in self._heading_stack)
+        self.sections.append(Section(level=level, heading=heading, anchor=anchor, path=path, text=""))
+        self._texts.append(heading_text + "\n")
+
+    def get_sections(self) -> List[Section]:
+        self._finish_section()
+        return self.sections
+
+    def _finish_section(self) -> None:
+        self.sections[-1].text = _normalize_text(self.sections[-1].text + "".join(self._texts))
+        self._texts = []
+
+
+#
+# HTML
+#
+
+_heading_levels = {"h1": 1, "h2": 2, "h3": 3, "h4": 4, "h5": 5, "h6": 6}
+# (not content: navigation menus, tables of contents, ...)
+_skipped_tags = {"head", "script", "style", "noscript", "template", "svg", "nav"}
+_block_tags = {"address", "article", "aside", "blockquote", "br", "dd", "div", "dl", "dt", "figcaption", "figure", "footer",
+               "form", "header", "hr", "li", "main", "nav", "ol", "p", "pre", "section", "table", "tr", "ul"}
+
+
+def get_html_sections(soup: BeautifulSoup) -> List[Section]:
+    collector = _SectionCollector()
+    root = soup.body or soup
+    # (iterative, deeply nested HTML exceeds the recursion limit)
+    stack: List[Tuple[Tag, Iterator]] = [(root, iter(root.children))]
+    while stack:
+        element, children = stack[-1]
+        child = next(children, None)
+        if child is None:
+            stack.pop()
+            if element.name in _block_tags:
+                collector.add_text("\n")
+            continue
+        if isinstance(child, Tag):
+            if child.name in _skipped_tags or child.get("role") == "navigation":
+                continue
+            if child.name in _heading_levels:
+                heading = child.get_text(" ", strip=True)
+                if heading:
+                    collector.add_heading(_heading_levels[child.name], heading, _get_html_heading_anchor(child), heading)
+                continue
+            if child.name in _block_tags:
+                collector.add_text("\n")
+            stack.append((child, iter(child.children)))
+        elif type(child) in (NavigableString, CData):
+            # (not: comments, doctype, ...)
+            collector.add_text(str(child))
+    return collector.get_sections()
+
+
+def _get_html_heading_anchor(heading: Tag) -> Optional[str]:
+    """The id to link to the heading, if there is one: of the heading, an element in the heading, or a preceding anchor."""
+    if heading.get("id"):
+        return heading["id"]
+    element_with_id = heading.find(id=True)
+    if element_with_id is not None:
+        return element_with_id["id"]
+    named_anchor = heading.find("a", attrs={"name": True})
+    if named_anchor is not None:
+        return named_anchor["name"]
+    previous = heading.find_previous_sibling()
+    if previous is not None and previous.name == "a" and not previous.get_text(strip=True) and (previous.get("id") or previous.get("name")):
+        return previous.get("id") or previous.get("name")
+    parent = heading.parent
+    if parent is not None and parent.name in ("section", "article") and parent.get("id") and parent.find(_heading_levels.keys()) is heading:
+        return parent["id"]
+    return None
+
+
+class HtmlSectionParser(BaseBlobParser):
+    """Parse HTML into documents aligned to its sections (see sections_to_documents())."""
+
+    def __init__(self, features: str = "lxml") -> None:
+        self.features = features
+
+    def __str__(self) -> str:
+        return f"HtmlSectionParser()"
+
+    def lazy_parse(self, blob: Blob) -> Iterator[Document]:
+        with blob.as_bytes_io() as f:
+            soup = BeautifulSoup(f, features=self.features)
+        title = str(soup.title.string).strip() if soup.title and soup.title.string else ""
+        metadata = {"source": blob.source, "title": title}
+        yield from sections_to_documents(get_html_sections(soup), metadata)
+
+
+#
+# Markdown
+#
+
+_md_fence_pattern = re.compile(r"^ {0,3}(`{3,}|~{3,})")
+_md_atx_heading_pattern = re.compile(r"^ {0,3}(#{1,6})(?:[ \t]+(.*?))?(?:[ \t]+#+)?[ \t]*$")
+_md_setext_underline_pattern = re.compile(r"^ {0,3}(=+|-+)[ \t]*$")
+_md_heading_id_pattern = re.compile(r"[ \t]*\{#([^}\s]+)\}[ \t]*$")
+
+
+def get_markdown_sections(text: str) -> List[Section]:
+    collector = _SectionCollector()
+    slug_counts: Dict[str, int] = {}
+    lines = text.split("\n")
+    fence: Optional[str] = None
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+
+        # fenced code blocks (no headings inside)
+        fence_match = _md_fence_pattern.match(line)
+        if fence_match:
+            marker = fence_match.group(1)
+            if fence is None:
+                fence = marker
+            elif marker[0] == fence[0] and len(marker) >= len(fence):
+                fence = None
+        if fence is not None or fence_match:
+            collector.add_text(line + "\n")
+            i += 1
+            continue
+
+        # "# Heading" or "Heading" + "=====" / "-----"
+        level, heading = 0, ""
+        atx_match = _md_atx_heading_pattern.match(line)
+        if atx_match:
+            level, heading = len(atx_match.group(1)), (atx_match.group(2) or "").strip()
+            heading_lines = 1
+        elif (line.strip() and i + 1 < len(lines) and _md_setext_underline_pattern.match(lines[i + 1])
+              and (i == 0 or not lines[i - 1].strip()) and not line.lstrip().startswith(("-", "*", "+", ">", "|"))):
+            level, heading = (1 if lines[i + 1].strip()[0] == "=" else 2), line.strip()
+            heading_lines = 2
+        if level and heading:
+            # explicit id: "## Heading {#id}"
+            id_match = _md_heading_id_pattern.search(heading)
+            if id_match:
+                heading = heading[:id_match.start()].strip()
+                anchor = id_match.group(1)
+            else:
+                anchor = _get_markdown_slug(heading, slug_counts)
+            collector.add_heading(level, _strip_markdown_formatting(heading), anchor, "\n".join(lines[i:i + heading_lines]))
+            i += heading_lines
+            continue
+
+        collector.add_text(line + "\n")
+        i += 1
+    return collector.get_sections()
+
+
+def _strip_markdown_formatting(text: str) -> str:
+    text = re.sub(r"!?\[([^\]]*)\]\([^)]*\)", r"\1", text)
+    return re.sub(r"[*`]|(?<!\w)_|_(?!\w)", "", text).strip()
+
+
+def _get_markdown_slug(heading: str, slug_counts: Dict[str, int]) -> str:
+    """GitHub-style anchor of a heading (unique within the document)."""
+    slug = re.sub(r"[^\w\- ]", "", _strip_markdown_formatting(heading).lower()).replace(" ", "-")
+    if slug in slug_counts:
+        slug_counts[slug] += 1
+        slug = f"{slug}-{slug_counts[slug]}"
+    else:
+        slug_counts[slug] = 0
+    return slug
+
+
+class MarkdownSectionParser(BaseBlobParser):
+    """Parse Markdown into documents aligned to its sections (see sections_to_documents())."""
+
+    def __str__(self) -> str:
+        return f"MarkdownSectionParser()"
+
+    def lazy_parse(self, blob: Blob) -> Iterator[Document]:
+        sections = get_markdown_sections(blob.as_string())
+        metadata = {"source": blob.source}
+        # title: the first top-level heading
+        title = next((section.heading for section in sections if section.level == 1), None)
+        if title:
+            metadata["title"] = title
+        yield from sections_to_documents(sections, metadata)
@@ -0,0 +1,100 @@
+### Per-page change detection (of plobs parsed page by page, e.g. PDFs)
+
+from typing import (
+    Dict,
+    List,
+    Optional,
+)
+import json
+from langchain_core.documents import Document
+
+from common.service.metrics import Counter
+from common.utils.hash_util import sha256sum_str
+from index_builder_basics.document_storage_sql_database import get_texts_from_sqldb
+from .document_splitter import chunk_overlap_tokens, chunk_size_tokens
+from .document_splitter_and_summarizer import include_summary_in_search_index, include_summary_in_search_results
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+#
+# The documents / parts (splits, summaries) created from a page are recorded with the sha256 hash of the page text
+# (see index_builder_basics/page_store.py). If a page has the same hash (and the same processing settings)
+# in the next build, its recorded documents are restored instead of splitting, summarizing and embedding the page again:
+# - the texts are loaded by their sha256 (their embeddings are found in the embeddings cache)
+# - the metadata of the current build (index_build_id, plob_id, title, source, anker) is taken from the page document
+#
+# Pages are recorded only if they were processed completely (e.g. not if the summarizer was unhealthy),
+# and restored only if all their texts are still found - otherwise they are processed again.
+#
+
+# result = "changed" (processed) or "unchanged" (restored)
+page_change_detection_pages_counter = Counter("rag_indexing_pages_total", "Number of pages of plobs parsed page by page per result", ["result"])
+
+# metadata not recorded: transient (moved to the SQL DB when stored), or taken from the current page document
+_transient_metadata_keys = ("plob_text", "page_content")
+_current_build_metadata_keys = ("index_build_id", "plob_id", "title", "source", "anker")
+
+
+def get_page_processing_signature() -> str:
+    """The settings that change the documents created from a page (recorded pages with other settings are processed again)."""
+    return (f"chunk_size_tokens={chunk_size_tokens},chunk_overlap_tokens={chunk_overlap_tokens},"
+            f"include_summary_in_search_index={include_summary_in_search_index},include_summary_in_search_results={include_summary_in_search_results}")
+
+
+def is_page_processed_completely(page_documents: List[Document]) -> bool:
+    """False if summaries are configured but missing (e.g. the summarizer was unhealthy) - process the page again next time."""
+    if include_summary_in_search_index:
+        return any(document.metadata.get("is_summary") for document in page_documents)
+    return True
+
+
+def page_documents_to_json(page_documents: List[Document]) -> str:
+    """Record the documents created from a page (before they are stored): their metadata, and their texts by sha256."""
+    records = []
+    for document in page_documents:
+        metadata = {key: value for key, value in document.metadata.items()
+                    if key not in _transient_metadata_keys and key not in _current_build_metadata_keys}
+        record = {"sha256": sha256sum_str(document.page_content), "metadata": metadata}
+        if document.metadata.get("page_content"):
+            # search result text differing from the indexed text (e.g. original text of a summary)
+            record["page_content_sha256"] = sha256sum_str(document.metadata["page_content"])
+        records.append(record)
+    return json.dumps(records, default=str)
+
+
+def page_documents_from_json(documents_json: str, page_document: Document) -> Optional[List[Document]]:
+    """
+    Restore the recorded documents of a page, with the metadata of the current build of the page document.
+
+    Returns: the documents, or None if a text is not found anymore (process the page again)
+    """
+    records = json.loads(documents_json)
+    page_text_sha256 = sha256sum_str(page_document.page_content)
+    sha256s = []
+    for record in records:
+        sha256s.extend([record["sha256"], record.get("page_content_sha256"), record["metadata"].get("plob_text_sha256")])
+    text_by_sha256: Dict[str, str] = get_texts_from_sqldb(sha256 for sha256 in sha256s if sha256 and sha256 != page_text_sha256)
+    text_by_sha256[page_text_sha256] = page_document.page_content
+
+    documents: List[Document] = []
+    for record in records:
+        metadata = dict(record["metadata"])
+        page_content = text_by_sha256.get(record["sha256"])
+        if page_content is None:
+            logger.info(f"Recorded text of page {page_document.metadata.get('page_number')} not found (sha256={record['sha256']}) - process the page again")
+            return None
+        if record.get("page_content_sha256"):
+            metadata["page_content"] = text_by_sha256.get(record["page_content_sha256"])
+            if metadata["page_content"] is None:
+                return None
+        if metadata.get("plob_text_sha256"):
+            # the parent text of a split: stored again (only once) with the restored splits
+            metadata["plob_text"] = text_by_sha256.get(metadata["plob_text_sha256"])
+            if metadata["plob_text"] is None:
+                return None
+        for key in _current_build_metadata_keys:
+            metadata[key] = page_document.metadata.get(key)
+        documents.append(Document(page_content=page_content, metadata=metadata))
+    return documents
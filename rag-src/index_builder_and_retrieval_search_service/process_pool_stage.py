@@ -0,0 +1,182 @@
+### Process Pool Stage (CPU-bound steps of the indexing in worker processes)
+
+from typing import (
+    Callable,
+    Deque,
+    Iterable,
+    Iterator,
+    Optional,
+    Tuple,
+    TypeVar,
+)
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
+import os
+import threading
+
+from common.service.configloader import deep_get, settings
+from common.service.logging_setup import setup_logging
+from common.service.metrics import Counter, Gauge
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+#
+# Optional process pool for CPU-bound steps (parsing of HTML/PDF files, splitting with the tokenizer).
+# These steps hold the GIL, i.e. in threads they use only one CPU core.
+#
+# Tasks are submitted in order, with a bounded number of pending tasks per worker
+# (bounds the memory of results not yet consumed), and their results are yielded in the same order.
+# Arguments and results are pickled: pass files by path (e.g. blobs created with Blob.from_path()), not their bytes.
+#
+# Fallback to in-process execution (in the calling thread):
+# - if the stage is disabled or the pool can't be started
+# - for items selected by the caller (e.g. blobs with in-memory data)
+# - for the tasks of a broken pool (e.g. a worker process was killed);
+#   after max_pool_failures broken pools the stage stays in-process until the restart of the application
+#
+# Worker processes are started with "spawn" by default (safe with the threads of the application):
+# they import the main module again, so it must not start its services in processes with a parent process.
+#
+
+process_pool_stage_enabled = deep_get(settings, "config.rag_indexing.process_pool_stage.enabled", default_value=False)
+process_pool_stage_workers = deep_get(settings, "config.rag_indexing.process_pool_stage.workers", default_value=0)
+process_pool_stage_max_pending_per_worker = deep_get(settings, "config.rag_indexing.process_pool_stage.max_pending_per_worker", default_value=2)
+process_pool_stage_start_method = deep_get(settings, "config.rag_indexing.process_pool_stage.start_method", default_value="spawn")
+process_pool_stage_max_pool_failures = deep_get(settings, "config.rag_indexing.process_pool_stage.max_pool_failures", default_value=3)
+
+process_pool_stage_tasks_counter = Counter("rag_process_pool_stage_tasks_total", "Number of tasks of the process pool stage per execution mode and result", ["mode", "result"])
+process_pool_stage_workers_gauge = Gauge("rag_process_pool_stage_workers", "Number of worker processes of the process pool stage (0 = in-process execution)")
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+_process_pool: Optional[ProcessPoolExecutor] = None
+_process_pool_failures = 0
+_process_pool_lock = threading.Lock()
+
+
+def is_process_pool_stage_enabled() -> bool:
+    return process_pool_stage_enabled
+
+
+def get_process_pool_stage_workers() -> int:
+    """Number of worker processes (configured, or the number of CPUs)."""
+    workers = process_pool_stage_workers or 0
+    if workers <= 0:
+        workers = os.cpu_count() or 1
+    return workers
+
+
+def get_process_pool() -> Optional[ProcessPoolExecutor]:
+    """
+    Get the process pool, start it if necessary.
+
+    Returns: the pool, or None for in-process execution (disabled, failed to start, or too many failures)
+    """
+    global _process_pool, _process_pool_failures
+    if not process_pool_stage_enabled:
+        return None
+    with _process_pool_lock:
+        if _process_pool is None and _process_pool_failures < process_pool_stage_max_pool_failures:
+            workers = get_process_pool_stage_workers()
+            try:
+                _process_pool = ProcessPoolExecutor(max_workers=workers,
+                                                    mp_context=multiprocessing.get_context(process_pool_stage_start_method),
+                                                    initializer=_init_worker_process)
+                process_pool_stage_workers_gauge.set(workers)
+                logger.info(f"Setup done: process pool stage with {workers} worker processes (start_method={process_pool_stage_start_method})")
+            except Exception as e:
+                _process_pool_failures += 1
+                logger.error(f"Process pool stage can't be started: {e} - in-process execution")
+        return _process_pool
+
+
+def map_in_process_pool(func: Callable[..., R],
+                        items: Iterable[T],
+                        args: tuple = (),
+                        in_process: Optional[Callable[[T], bool]] = None,
+                       ) -> Iterator[Tuple[T, Optional[R], Optional[Exception]]]:
+    """
+    Call func(item, *args) for each item in the process pool (or in-process as fallback).
+
+    Args:
+        func: top-level function (picklable by reference)
+        items: items to process, consumed lazily
+        args: additional (picklable) arguments of func
+        in_process: items to process in-process instead of in the pool
+
+    Returns: per item in the order of items: (item, result, None), or (item, None, exception) if func failed
+    """
+    pool = get_process_pool()
+    max_pending = get_process_pool_stage_workers() * max(1, process_pool_stage_max_pending_per_worker)
+    # (item, future, pool of the future)
+    pending: Deque[Tuple[T, Optional[Future], Optional[ProcessPoolExecutor]]] = deque()
+
+    for item in items:
+        future: Optional[Future] = None
+        if pool is not None and not (in_process is not None and in_process(item)):
+            try:
+                future = pool.submit(func, item, *args)
+            except (BrokenProcessPool, RuntimeError) as e:
+                _register_pool_failure(pool, f"Process pool stage is broken: {e}")
+                pool = get_process_pool()
+        pending.append((item, future, pool if future is not None else None))
+        # wait for the oldest task if enough are in flight (or if the oldest is executed in-process)
+        while pending and (len(pending) > max_pending or pending[0][1] is None):
+            yield _get_result(func, args, *pending.popleft())
+            pool = get_process_pool()
+
+    while pending:
+        yield _get_result(func, args, *pending.popleft())
+
+
+def _get_result(func: Callable[..., R],
+                args: tuple,
+                item: T,
+                future: Optional[Future],
+                pool: Optional[ProcessPoolExecutor],
+               ) -> Tuple[T, Optional[R], Optional[Exception]]:
+    if future is not None:
+        try:
+            result = future.result()
+            process_pool_stage_tasks_counter.inc(mode="process", result="ok")
+            return item, result, None
+        except BrokenProcessPool as e:
+            _register_pool_failure(pool, f"Process pool stage is broken: {e} - processing its pending tasks in-process")
+        except Exception as e:
+            process_pool_stage_tasks_counter.inc(mode="process", result="error")
+            return item, None, e
+
+    # in-process execution
+    try:
+        result = func(item, *args)
+        process_pool_stage_tasks_counter.inc(mode="in_process", result="ok")
+        return item, result, None
+    except Exception as e:
+        process_pool_stage_tasks_counter.inc(mode="in_process", result="error")
+        return item, None, e
+
+
+def _register_pool_failure(pool: Optional[ProcessPoolExecutor], message: str) -> None:
+    """Count a broken pool (once - all its pending tasks fail) and stop it."""
+    global _process_pool, _process_pool_failures
+    with _process_pool_lock:
+        if pool is None or pool is not _process_pool:
+            return
+        _process_pool_failures += 1
+        _process_pool.shutdown(wait=False, cancel_futures=True)
+        _process_pool = None
+        process_pool_stage_workers_gauge.set(0)
+    if _process_pool_failures >= process_pool_stage_max_pool_failures:
+        logger.error(f"{message} - {_process_pool_failures} failure(s), in-process execution from now on")
+    else:
+        logger.warning(f"{message} - {_process_pool_failures} failure(s), the pool is started again with the next task")
+
+
+def _init_worker_process() -> None:
+    setup_logging()
+    logger.info(f"Process pool stage: worker process {os.getpid()} started")
@@ -4,10 +4,13 @@ import logging
 from async_lru import alru_cache
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser
+from pydantic import BaseModel, Field
 
 import common.service.config as config
 from factory.llm_factory import get_rewrite_question_chat_llm
 from common.utils.string_util import str_limit
+from common.service.span_recorder import timing_span
+from common.service.admission_control import get_llm_limiter
 
 logger = logging.getLogger(__name__)
 
@@ -37,7 +40,9 @@ async def rewrite_question_for_vectorsearch_retrieval(question: str) -> str:
 
     # Action
     question_rewriter = re_write_prompt | llm | StrOutputParser()
-    updated_question = question_rewriter.invoke({"question": question})
+    async with get_llm_limiter("rewriter"):
+        with timing_span("llm_rewrite_vectorsearch", external=True):
+            updated_question = await question_rewriter.ainvoke({"question": question})
 
     # Result
     logger.info(f"Updated question: '{question}' -> '{str_limit(updated_question, 150)}'")
@@ -69,7 +74,9 @@ async def rewrite_question_for_keywordsearch_retrieval(question: str) -> str:
 
     # Action
     question_rewriter = re_write_prompt | llm | StrOutputParser()
-    updated_question = question_rewriter.invoke({"question": question})
+    async with get_llm_limiter("rewriter"):
+        with timing_span("llm_rewrite_keywordsearch", external=True):
+            updated_question = await question_rewriter.ainvoke({"question": question})
 
     # Result
     logger.info(f"Updated question: '{question}' -> '{str_limit(updated_question, 150)}'")
@@ -114,8 +121,70 @@ async def create_hypothetical_answer_for_hyde(question: str) -> str:
 
     # Action
     question_rewriter = re_write_prompt | llm | StrOutputParser()
-    hypothetical_answer = question_rewriter.invoke({"question": question})
+    async with get_llm_limiter("rewriter"):
+        with timing_span("llm_hyde", external=True):
+            hypothetical_answer = await question_rewriter.ainvoke({"question": question})
 
     # Result
     logger.info(f"Hypothetical_answer: '{question}' -> '{str_limit(hypothetical_answer, 150)}'")
     return hypothetical_answer
+
+
+
+#
+# Combined query expansion: all three artefacts above with a single LLM call
+#
+
+class QueryExpansion(BaseModel):
+    """Improved search queries for a user question."""
+
+    vectorsearch_question: str = Field(
+        description="Improved version of the question, optimized for vectorstore retrieval"
+    )
+    keywordsearch_keyword: str = Field(
+        description="The most relevant single keyword of the question, for keyword search"
+    )
+    hypothetical_document: str = Field(
+        description="Hypothetical document of about 150 tokens that answers the question, neutral and formal tone"
+    )
+
+
+@alru_cache(ttl=config.responseCacheTtlSeconds, maxsize=config.maxCachedQuestions)
+async def expand_question_for_retrieval(question: str) -> QueryExpansion:
+    """
+    Rewrite a question for vectorstore retrieval, identify its keyword for keywordsearch retrieval,
+    and generate a hypothetical answer for HyDE - with a single (structured output) LLM call.
+
+    Same results as rewrite_question_for_vectorsearch_retrieval(), rewrite_question_for_keywordsearch_retrieval()
+    and create_hypothetical_answer_for_hyde(), but saves two LLM round trips.
+    Empty fields should be computed with these functions as fallback.
+    """
+
+    # LLM with function call
+    llm = get_rewrite_question_chat_llm()
+    structured_llm_expander = llm.with_structured_output(QueryExpansion)
+
+    # Prompt
+    system = """You optimize a user question for the retrieval of relevant documents. Look at the input and try to identify \n
+         the underlying semantic intent / meaning. Then provide:\n
+         - vectorsearch_question: a better version of the question that is optimized for vectorstore retrieval\n
+         - keywordsearch_keyword: the most relevant **single word** for keyword search\n
+         - hypothetical_document: a standalone hypothetical document of about 150 tokens (2-3 paragraphs) that answers the question,\n
+           in a neutral, formal tone, without any commentary or meta-instructions\n"""
+    expansion_prompt = ChatPromptTemplate.from_messages(
+        [
+            ("system", system),
+            ("human", "Here is the initial question: \n\n {question} \n\n"),
+        ]
+    )
+
+    # Action
+    question_expander = expansion_prompt | structured_llm_expander
+    async with get_llm_limiter("rewriter"):
+        with timing_span("llm_query_expansion", external=True):
+            query_expansion: QueryExpansion = await question_expander.ainvoke({"question": question})
+
+    # Result
+    logger.info(f"Expanded question: '{question}' -> '{str_limit(query_expansion.vectorsearch_question, 150)}', "
+                f"keyword='{query_expansion.keywordsearch_keyword}', hypothetical_answer='{str_limit(query_expansion.hypothetical_document, 150)}'")
+    return query_expansion
@@ -0,0 +1,124 @@
+### Latency Budget of a Search Request
+
+import asyncio
+import logging
+import time
+from typing import (
+    Any,
+    Awaitable,
+    Dict,
+    Optional,
+)
+
+from common.service.configloader import deep_get, settings
+
+logger = logging.getLogger(__name__)
+
+
+default_search_timeout_seconds = deep_get(settings, "config.rag_response.search_timeout_seconds", default_value=20)
+min_seconds_for_optional_stage = deep_get(settings, "config.rag_response.search_min_seconds_for_optional_stage", default_value=2)
+reserved_seconds_for_final_steps = deep_get(settings, "config.rag_response.search_reserved_seconds_for_final_steps", default_value=0.5)
+# time kept by a search that joins an identical search in flight, to run on its own if the other one takes too long
+reserved_seconds_for_standalone_search = deep_get(settings, "config.rag_response.search_reserved_seconds_for_standalone_search", default_value=2)
+
+
+# Reasons why a stage was degraded
+DEGRADED_SKIPPED = "skipped"
+DEGRADED_CUT_SHORT = "cut_short"
+DEGRADED_TIMEOUT = "timeout"
+DEGRADED_ERROR = "error"
+DEGRADED_LOAD_SHEDDING = "load_shedding"
+
+
+class SearchBudget:
+    """
+    Latency budget (deadline) of a single search request.
+
+    The budget is propagated through all stages of the search.
+    Optional (LLM-based) stages are skipped or cut short if the remaining time is too small,
+    so that the request returns (partial) results instead of timing out.
+    All degraded stages are recorded, to report them in the response.
+    """
+
+    def __init__(self, timeout_seconds: Optional[float] = None):
+        """
+        Args:
+            timeout_seconds (Optional[float]): Budget of the request in seconds,
+                None = use the configured default, 0 or negative = unlimited.
+        """
+        if timeout_seconds is None:
+            timeout_seconds = default_search_timeout_seconds
+        self.timeout_seconds: Optional[float] = timeout_seconds if timeout_seconds and timeout_seconds > 0 else None
+        self.start_time = time.monotonic()
+        self.deadline: Optional[float] = (self.start_time + self.timeout_seconds) if self.timeout_seconds else None
+
+        # stage -> reason
+        self.degraded_stages: Dict[str, str] = {}
+
+        # reason why all optional stages are skipped, e.g. because of overload
+        self.optional_stages_disabled_reason: Optional[str] = None
+
+    def __repr__(self) -> str:
+        remaining = self.remaining_seconds()
+        remaining_str = f"{remaining:.2f}s" if remaining is not None else "unlimited"
+        return f"SearchBudget(timeout_seconds={self.timeout_seconds}, remaining={remaining_str}, degraded_stages={self.degraded_stages})"
+
+    def remaining_seconds(self) -> Optional[float]:
+        """Remaining time in seconds (can be negative), None if unlimited."""
+        if self.deadline is None:
+            return None
+        return self.deadline - time.monotonic()
+
+    def is_degraded(self) -> bool:
+        """True if at least one stage was degraded."""
+        return len(self.degraded_stages) > 0
+
+    def disable_optional_stages(self, reason: str) -> None:
+        """Skip all optional stages from now on (e.g. DEGRADED_LOAD_SHEDDING)."""
+        self.optional_stages_disabled_reason = reason
+
+    def join_timeout_seconds(self) -> Optional[float]:
+        """Max. time to wait for an identical search in flight - so a stand-alone search still fits the budget (None if unlimited)."""
+        remaining = self.remaining_seconds()
+        if remaining is None:
+            return None
+        return max(remaining - reserved_seconds_for_standalone_search, 0)
+
+    def has_time_for_optional_stage(self) -> bool:
+        """Is enough time left to start (or continue) an optional stage?"""
+        if self.optional_stages_disabled_reason is not None:
+            return False
+        remaining = self.remaining_seconds()
+        return remaining is None or remaining >= min_seconds_for_optional_stage + reserved_seconds_for_final_steps
+
+    def check_time_for_optional_stage(self, stage: str) -> bool:
+        """
+        Is enough time left to start an optional stage?
+        If not, the stage is recorded as skipped.
+        """
+        if self.has_time_for_optional_stage():
+            return True
+        self.mark_degraded(stage, self.optional_stages_disabled_reason or DEGRADED_SKIPPED)
+        return False
+
+    def mark_degraded(self, stage: str, reason: str) -> None:
+        """Record a degraded stage - the first reason per stage wins."""
+        if stage not in self.degraded_stages:
+            logger.warning(f"Search stage '{stage}' degraded ({reason}), {self}")
+            self.degraded_stages[stage] = reason
+
+    async def run_optional_stage(self, stage: str, awaitable: Awaitable[Any]) -> Any:
+        """
+        Await an optional stage with the remaining time (minus the reserved time for the final steps) as timeout.
+
+        Raises:
+            asyncio.TimeoutError: if the stage didn't finish in time (the stage is recorded as timed out)
+        """
+        remaining = self.remaining_seconds()
+        if remaining is None:
+            return await awaitable
+        try:
+            return await asyncio.wait_for(awaitable, timeout=max(remaining - reserved_seconds_for_final_steps, 0))
+        except asyncio.TimeoutError:
+            self.mark_degraded(stage, DEGRADED_TIMEOUT)
+            raise
@@ -1,22 +1,195 @@
-from typing import Callable, List, Optional
 
+from typing import AsyncIterator, Awaitable, Callable, List, Optional, Tuple
+
+import asyncio
 import logging
-from typing import List
 from langchain_core.documents import Document
-from .document_retrieval import find_relevant_documents_tuned
+from .document_retrieval import find_relevant_documents_tuned, find_relevant_documents_tuned_stream, get_cached_complete_results, normalize_max_results, STAGE_FINAL
+from .search_budget import SearchBudget, DEGRADED_LOAD_SHEDDING
+from index_builder_basics.embeddings_cache import get_cached_default_embeddings
+from common.service.span_recorder import timing_span
+from common.service.configloader import deep_get, settings
+from common.service.metrics import Counter
+from common.service.admission_control import ConcurrencyLimiter, AdmissionRejected
+from common.utils.single_flight import SingleFlight
 
 import common.service.config as config
 
 logger = logging.getLogger(__name__)
 
+# Identical searches in flight: (normalized question, max_results) -> (documents, search_budget of the computation)
+_searches_in_flight: SingleFlight[Tuple[List[Document], SearchBudget]] = SingleFlight()
+search_coalesced_counter = Counter("rag_search_coalesced_total", "Number of searches that joined an identical search in flight")
+
+# Admission control of searches
+search_max_in_flight = deep_get(settings, "config.rag_response.search_max_in_flight", default_value=16)
+search_max_queued = deep_get(settings, "config.rag_response.search_max_queued", default_value=32)
+search_overload_behavior = deep_get(settings, "config.rag_response.search_overload_behavior", default_value="degrade")
+_search_limiter = ConcurrencyLimiter("search", search_max_in_flight, search_max_queued)
+
 
-async def search(question: str, max_results: Optional[int]) -> List[Document]:
+async def search(question: str, max_results: Optional[int], search_budget: Optional[SearchBudget] = None) -> List[Document]:
     """Get relevant documents for a given question.
        Enrich with a tuned question
+
+       Concurrent identical searches (same normalized question and max_results) share one computation,
+       which runs with the search_budget of the first one. If it doesn't finish in time (the own search_budget minus
+       config.rag_response.search_reserved_seconds_for_standalone_search), the search runs on its own (without coalescing)
+       with the remaining own search_budget.
+
+       Cached complete results are returned without admission control (they need no LLM or vectorstore call).
+
+       Degraded stages (because of an exhausted search_budget) are recorded in search_budget.
+
+       Raises:
+           AdmissionRejected: if too many searches are in flight and config.rag_response.search_overload_behavior="reject"
+    """
+    if search_budget is None:
+        search_budget = SearchBudget()
+    normalized_question = normalize_question(question)
+    normalized_max_results = normalize_max_results(max_results)
+    cached_docs = get_cached_complete_results(normalized_question, normalized_max_results)
+    if cached_docs is not None:
+        logger.info(f"Found {len(cached_docs)} docs in results cache - without admission: '{question}'")
+        return cached_docs
+
+    async def search_and_return_budget() -> Tuple[List[Document], SearchBudget]:
+        admitted = await _admit_search(search_budget)
+        try:
+            docs = await find_relevant_documents_tuned(normalized_question, normalized_max_results, search_budget)
+        finally:
+            if admitted:
+                _search_limiter.release()
+        return docs, search_budget
+
+    return await _run_coalesced_search(question, normalized_question, normalized_max_results, search_budget, search_and_return_budget)
+
+
+def normalize_question(question: str) -> str:
+    """Normalize the whitespace of a question (the case is kept, because it can matter for keyword search and LLMs)."""
+    return " ".join(question.split())
+
+
+async def search_stream(question: str, max_results: Optional[int], search_budget: Optional[SearchBudget] = None) -> AsyncIterator[Tuple[str, List[Document]]]:
+    """Get relevant documents for a given question, as soon as the single stages are done.
+
+       Yields (stage, documents) tuples, the last one is the final result (stage "final").
+
+       Coalesced with concurrent identical searches like search(), streaming or not:
+       a search that joins a computation in flight yields its final result only.
+       Cached complete results are yielded without admission control.
+
+       Raises:
+           AdmissionRejected: if too many searches are in flight and config.rag_response.search_overload_behavior="reject"
+    """
+    if search_budget is None:
+        search_budget = SearchBudget()
+    normalized_question = normalize_question(question)
+    normalized_max_results = normalize_max_results(max_results)
+    cached_docs = get_cached_complete_results(normalized_question, normalized_max_results)
+    if cached_docs is not None:
+        logger.info(f"Found {len(cached_docs)} docs in results cache - without admission: '{question}'")
+        yield STAGE_FINAL, cached_docs
+        return
+    # intermediate results of the own computation, None = done
+    intermediate_results: "asyncio.Queue[Optional[Tuple[str, List[Document]]]]" = asyncio.Queue()
+
+    async def stream_and_return_budget() -> Tuple[List[Document], SearchBudget]:
+        admitted = await _admit_search(search_budget)
+        try:
+            docs: List[Document] = []
+            async for stage, stage_docs in find_relevant_documents_tuned_stream(normalized_question, normalized_max_results, search_budget):
+                if stage == STAGE_FINAL:
+                    docs = stage_docs
+                else:
+                    intermediate_results.put_nowait((stage, stage_docs))
+        finally:
+            if admitted:
+                _search_limiter.release()
+        return docs, search_budget
+
+    async def run_search() -> List[Document]:
+        try:
+            return await _run_coalesced_search(question, normalized_question, normalized_max_results, search_budget, stream_and_return_budget)
+        finally:
+            intermediate_results.put_nowait(None)
+
+    search_task = asyncio.ensure_future(run_search())
+    try:
+        while (intermediate_result := await intermediate_results.get()) is not None:
+            yield intermediate_result
+        yield STAGE_FINAL, await search_task
+    finally:
+        if not search_task.done():
+            # e.g. the client disconnected
+            search_task.cancel()
+
+
+async def _run_coalesced_search(question: str,
+                                normalized_question: str,
+                                normalized_max_results: int,
+                                search_budget: SearchBudget,
+                                search_and_return_budget: Callable[[], Awaitable[Tuple[List[Document], SearchBudget]]],
+                                ) -> List[Document]:
+    """Run the search - or join an identical search in flight (see search())."""
+    try:
+        (docs, computation_search_budget), shared = await _searches_in_flight.run(
+            (normalized_question, normalized_max_results), search_and_return_budget, search_budget.join_timeout_seconds())
+    except asyncio.TimeoutError:
+        # Joined a computation started with a larger budget: search on its own with the reserved time,
+        # optional stages are skipped
+        logger.warning(f"Timeout while waiting for identical search in flight - search without coalescing: '{question}'")
+        docs, _ = await search_and_return_budget()
+        return list(docs)
+
+    if shared:
+        # Shared computation of an earlier identical search
+        logger.info(f"Joined identical search in flight: '{question}'")
+        search_coalesced_counter.inc()
+        for stage, reason in computation_search_budget.degraded_stages.items():
+            search_budget.mark_degraded(stage, reason)
+    return list(docs)
+
+
+async def _admit_search(search_budget: SearchBudget) -> bool:
+    """
+    Wait (within the search_budget) until the search is admitted, i.e. until the number of searches in flight is below the limit.
+
+    Load shedding if the wait queue is full or the wait times out:
+    - search_overload_behavior="degrade": the search runs without optional (LLM-based) stages, not counted as in flight
+    - search_overload_behavior="reject": AdmissionRejected is raised
+
+    Returns:
+        bool: True if admitted - then _search_limiter.release() must be called after the search.
+    """
+    try:
+        await _search_limiter.acquire(timeout=search_budget.remaining_seconds())
+        return True
+    except AdmissionRejected as e:
+        if search_overload_behavior != "degrade":
+            logger.warning(f"Search rejected: {e} - {_search_limiter}")
+            raise
+        logger.warning(f"Search degraded to retrieval without LLM: {e} - {_search_limiter}")
+        search_budget.disable_optional_stages(DEGRADED_LOAD_SHEDDING)
+        return False
+
+
+async def precalculate_query_embeddings(questions: List[str]) -> None:
+    """Calculate the embeddings of multiple questions with a single call of the embedding model.
+
+       The embeddings are stored in the embeddings cache, so subsequent searches
+       for these questions (e.g. of a batch request) don't call the embedding model again.
+       The questions are normalized like by search(), so the cached embeddings match its queries.
     """
-    return await find_relevant_documents_tuned(question, max_results)
+    unique_questions = list(dict.fromkeys(normalize_question(question) for question in questions))
+    try:
+        with timing_span("query_embedding_batch", external=True):
+            await asyncio.to_thread(get_cached_default_embeddings().embed_documents, unique_questions)
+    except Exception as e:
+        # Not critical: the searches calculate the embeddings individually
+        logger.warning(f"Error while calculating embeddings of {len(unique_questions)} questions - continue without: {e}")
 
 
 if __name__ == "__main__":
     # Example usage
-    search("What happened at Interleaf?")
\ No newline at end of file
+    search("What happened at Interleaf?")
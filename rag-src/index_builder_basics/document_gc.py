@@ -0,0 +1,247 @@
+### Garbage Collection of the Embeddings Cache
+
+from typing import TYPE_CHECKING
+from typing import (
+    Dict,
+    Iterable,
+    List,
+    Optional,
+)
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+import time
+if TYPE_CHECKING:
+    from _typeshed.dbapi import DBAPIConnection, DBAPICursor
+else:
+    DBAPIConnection = any
+    DBAPICursor = any
+from common.service.configloader import deep_get, settings
+from common.service.metrics import Counter, Gauge
+from .sql_batch_writer import SqlBatchWriter
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+#
+# Retention of the long-term caches in the SQL DB.
+#
+# Rows of "document" (text + embedding) and "text_blob" (texts) are caches, valid independent of the plobs.
+# Each lookup during indexing (and each query embedding lookup) updates their "last_seen" timestamp,
+# at most once per touch interval to avoid a write per lookup.
+#
+# The compaction job deletes in batches (one short transaction per batch):
+# - "document" rows of the current embedding model not seen for max_age_days and not referenced by a plob
+# - "document" rows of other embedding models not seen for other_models_max_age_days
+#   (except keep_embedding_model_ids)
+# - "text_blob" rows not seen for max_age_days and not referenced by a "document" row
+# and then runs ANALYZE (statistics for the query planner) and - if enough pages are free - VACUUM (SQLite only).
+#
+
+document_gc_enabled = deep_get(settings, "config.rag_indexing.document_gc.enabled", default_value=False)
+document_gc_interval_seconds = deep_get(settings, "config.rag_indexing.document_gc.interval_seconds", default_value=86400)
+document_gc_touch_interval_seconds = deep_get(settings, "config.rag_indexing.document_gc.touch_interval_seconds", default_value=86400)
+document_gc_max_age_days = deep_get(settings, "config.rag_indexing.document_gc.max_age_days", default_value=180)
+document_gc_other_models_max_age_days = deep_get(settings, "config.rag_indexing.document_gc.other_models_max_age_days", default_value=30)
+document_gc_keep_embedding_model_ids = deep_get(settings, "config.rag_indexing.document_gc.keep_embedding_model_ids", default_value=[]) or []
+document_gc_delete_batch_size = deep_get(settings, "config.rag_indexing.document_gc.delete_batch_size", default_value=1000)
+document_gc_analyze = deep_get(settings, "config.rag_indexing.document_gc.analyze", default_value=True)
+document_gc_vacuum_min_free_ratio = deep_get(settings, "config.rag_indexing.document_gc.vacuum_min_free_ratio", default_value=0.2)
+
+embedding_model_id = deep_get(settings, "config.common.embedding_model_id")
+is_sqlite = deep_get(settings, "config.common.databases.sql_database.connect") == "sqlite3.connect"
+
+document_gc_rows_deleted_counter = Counter("rag_document_gc_rows_deleted_total", "Number of cache rows deleted by the compaction job per table", ["table"])
+document_gc_bytes_reclaimed_counter = Counter("rag_document_gc_bytes_reclaimed_total", "Number of bytes reclaimed by the compaction job (database file size, SQLite only)")
+document_gc_runs_counter = Counter("rag_document_gc_runs_total", "Number of compaction job runs per result", ["result"])
+sql_database_size_gauge = Gauge("rag_sql_database_size_bytes", "Size of the SQL database file after the last compaction job run (SQLite only)")
+
+_last_run_monotonic: Optional[float] = None
+
+
+#
+# Last-seen tracking
+#
+
+def get_touch_cutoff_timestamp(now_timestamp: str) -> str:
+    """Rows with an older "last_seen" are touched by a lookup."""
+    return (datetime.fromisoformat(now_timestamp) - timedelta(seconds=document_gc_touch_interval_seconds)).isoformat()
+
+
+def touch_rows(sqlBatchWriter: SqlBatchWriter, table: str, where: str, keys: Iterable[tuple], now_timestamp: str) -> int:
+    """
+    Set "last_seen" of looked up rows (with the writer, without commit).
+
+    Args:
+        table (str): "document" or "text_blob"
+        where (str): condition of a row, e.g. "sha256=? AND embedding_model_id=?"
+        keys: values of the placeholders of the condition, per row
+
+    Returns: number of touched rows
+    """
+    count = 0
+    for key in keys:
+        sqlBatchWriter.add(f"UPDATE {table} SET last_seen=? WHERE {where}", (now_timestamp, *key))
+        count += 1
+    return count
+
+
+#
+# Compaction job
+#
+
+@dataclass
+class DocumentGcResult:
+    rows_deleted: Dict[str, int] = field(default_factory=dict)
+    # size of the content of the deleted rows
+    content_bytes_deleted: int = 0
+    # size of the database file (SQLite only)
+    database_bytes_before: Optional[int] = None
+    database_bytes_after: Optional[int] = None
+    analyzed: bool = False
+    vacuumed: bool = False
+    duration_seconds: float = 0.0
+
+    @property
+    def bytes_reclaimed(self) -> Optional[int]:
+        if self.database_bytes_before is None or self.database_bytes_after is None:
+            return None
+        return self.database_bytes_before - self.database_bytes_after
+
+
+def run_document_gc_if_due(sqlConnection: DBAPIConnection) -> Optional[DocumentGcResult]:
+    """
+    Run the compaction job if enabled and the interval since the last run has passed.
+    Call it without pending changes on the connection and outside of an indexing run.
+    """
+    global _last_run_monotonic
+    if not document_gc_enabled:
+        return None
+    if _last_run_monotonic is not None and time.monotonic() - _last_run_monotonic < document_gc_interval_seconds:
+        return None
+    _last_run_monotonic = time.monotonic()
+    try:
+        result = run_document_gc(sqlConnection)
+        document_gc_runs_counter.inc(result="ok")
+        return result
+    except Exception as e:
+        logger.warning(f"Compaction job failed: {e}")
+        document_gc_runs_counter.inc(result="error")
+        try:
+            sqlConnection.rollback()
+        except Exception:
+            pass
+        return None
+
+
+def run_document_gc(sqlConnection: DBAPIConnection, now: Optional[datetime] = None) -> DocumentGcResult:
+    """
+    Delete outdated cache rows in batches, update the statistics and vacuum the database if worthwhile.
+
+    Args:
+        sqlConnection: SQL DB connection without pending changes.
+        now: current time (for tests), default: now
+
+    Returns: the result of the run
+    """
+    start_time = time.perf_counter()
+    now = now or datetime.now(timezone.utc)
+    result = DocumentGcResult()
+    result.database_bytes_before = _get_sqlite_database_bytes(sqlConnection)
+    logger.info("Compaction job: start ...")
+
+    # "document" rows of the current embedding model: not seen for a long time and not referenced by a plob
+    max_age_cutoff = (now - timedelta(days=document_gc_max_age_days)).isoformat()
+    _delete_in_batches(sqlConnection, result, "document",
+                       select_statement="""SELECT sha256, embedding_model_id, LENGTH(content) + LENGTH(embedding_json) FROM document
+                                           WHERE embedding_model_id=? AND last_seen<?
+                                           AND NOT EXISTS (SELECT 1 FROM plob_document WHERE plob_document.document_sha256=document.sha256)
+                                           LIMIT ?""",
+                       select_args=(embedding_model_id, max_age_cutoff),
+                       delete_statement="DELETE FROM document WHERE sha256=? AND embedding_model_id=?")
+
+    # "document" rows of other embedding models
+    other_models_cutoff = (now - timedelta(days=document_gc_other_models_max_age_days)).isoformat()
+    keep_model_ids: List[str] = [embedding_model_id, *document_gc_keep_embedding_model_ids]
+    placeholders = ",".join("?" * len(keep_model_ids))
+    _delete_in_batches(sqlConnection, result, "document",
+                       select_statement=f"""SELECT sha256, embedding_model_id, LENGTH(content) + LENGTH(embedding_json) FROM document
+                                            WHERE embedding_model_id NOT IN ({placeholders}) AND last_seen<?
+                                            LIMIT ?""",
+                       select_args=(*keep_model_ids, other_models_cutoff),
+                       delete_statement="DELETE FROM document WHERE sha256=? AND embedding_model_id=?")
+
+    # texts: not seen for a long time and not referenced by a "document" row
+    _delete_in_batches(sqlConnection, result, "text_blob",
+                       select_statement="""SELECT sha256, LENGTH(data) FROM text_blob
+                                           WHERE last_seen<?
+                                           AND NOT EXISTS (SELECT 1 FROM document WHERE document.sha256=text_blob.sha256)
+                                           LIMIT ?""",
+                       select_args=(max_age_cutoff,),
+                       delete_statement="DELETE FROM text_blob WHERE sha256=?")
+
+    # statistics and free space (SQLite only)
+    if is_sqlite:
+        if document_gc_analyze:
+            sqlConnection.execute("ANALYZE")
+            sqlConnection.commit()
+            result.analyzed = True
+        free_ratio = _get_sqlite_free_page_ratio(sqlConnection)
+        if free_ratio >= document_gc_vacuum_min_free_ratio:
+            logger.info(f"Compaction job: VACUUM ({free_ratio:.0%} free pages) ...")
+            sqlConnection.execute("VACUUM")
+            result.vacuumed = True
+        result.database_bytes_after = _get_sqlite_database_bytes(sqlConnection)
+        if result.database_bytes_after is not None:
+            sql_database_size_gauge.set(result.database_bytes_after)
+        if result.bytes_reclaimed is not None and result.bytes_reclaimed > 0:
+            document_gc_bytes_reclaimed_counter.inc(result.bytes_reclaimed)
+
+    result.duration_seconds = time.perf_counter() - start_time
+    logger.info(f"Compaction job: DONE in {result.duration_seconds:.1f}s - deleted rows: {result.rows_deleted}, "
+                f"deleted content: {result.content_bytes_deleted} bytes, database file: {result.database_bytes_before} -> {result.database_bytes_after} bytes "
+                f"(reclaimed: {result.bytes_reclaimed}), analyzed={result.analyzed}, vacuumed={result.vacuumed}")
+    return result
+
+
+def _delete_in_batches(sqlConnection: DBAPIConnection,
+                       result: DocumentGcResult,
+                       table: str,
+                       select_statement: str,
+                       select_args: tuple,
+                       delete_statement: str) -> None:
+    """
+    Select rows to delete (key columns + content size in the last column) and delete them, one transaction per batch,
+    so concurrent writers are never blocked for long.
+    """
+    sqlBatchWriter = SqlBatchWriter(sqlConnection, batch_size=document_gc_delete_batch_size)
+    while True:
+        cursor = sqlConnection.cursor()
+        cursor.execute(select_statement, (*select_args, document_gc_delete_batch_size))
+        rows = cursor.fetchall()
+        cursor.close()
+        if not rows:
+            break
+        for row in rows:
+            sqlBatchWriter.add(delete_statement, tuple(row[:-1]))
+            result.content_bytes_deleted += row[-1] or 0
+        sqlBatchWriter.commit()
+        result.rows_deleted[table] = result.rows_deleted.get(table, 0) + len(rows)
+        document_gc_rows_deleted_counter.inc(len(rows), table=table)
+        logger.debug(f"Compaction job: deleted {len(rows)} row(s) from '{table}'")
+        if len(rows) < document_gc_delete_batch_size:
+            break
+
+
+def _get_sqlite_database_bytes(sqlConnection: DBAPIConnection) -> Optional[int]:
+    if not is_sqlite:
+        return None
+    page_count = sqlConnection.execute("PRAGMA page_count").fetchone()[0]
+    page_size = sqlConnection.execute("PRAGMA page_size").fetchone()[0]
+    return page_count * page_size
+
+
+def _get_sqlite_free_page_ratio(sqlConnection: DBAPIConnection) -> float:
+    page_count = sqlConnection.execute("PRAGMA page_count").fetchone()[0]
+    freelist_count = sqlConnection.execute("PRAGMA freelist_count").fetchone()[0]
+    return freelist_count / page_count if page_count > 0 else 0.0
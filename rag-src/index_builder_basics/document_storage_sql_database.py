@@ -2,12 +2,18 @@ from typing import TYPE_CHECKING
 from typing import (
     Any,
     Dict,
+    Iterable,
     Iterator,
     List,
     Optional,
+    Sequence,
     Tuple,
 )
 import json
+import re
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
 if TYPE_CHECKING:
     from _typeshed.dbapi import DBAPIConnection, DBAPICursor
 else:
@@ -15,7 +21,18 @@ else:
     DBAPICursor = any
 import shortuuid
 from common.service.configloader import deep_get, settings
-from factory.sql_database_factory import get_sql_database_connection
+from factory.sql_database_factory import get_sql_connection_pool, get_async_sql_connection_pool
+from .sql_batch_writer import SqlBatchWriter
+from .page_store import DB_TABLE_plob_page
+from .text_store import (
+    DB_TABLE_text_blob,
+    DB_TABLE_text_dictionary,
+    cache_texts,
+    get_cached_texts,
+    load_texts_from_sqldb,
+    save_texts_in_sqldb,
+    text_store_enabled,
+)
 
 import logging
 from common.utils.hash_util import sha256sum_str
@@ -24,9 +41,8 @@ from common.utils.string_util import str_limit
 
 logger = logging.getLogger(__name__)
 
-#_sqlCon: DBAPIConnection | None = None
-_sqlCon = None
-_sqlCon2 = None
+_setup_lock = threading.Lock()
+_setup_done = False
 
 
 #
@@ -63,6 +79,8 @@ DB_TABLE_plob = """CREATE TABLE IF NOT EXISTS plob (
 # in this case only "document_content" entries are deleted.
 # Furthermore "content" are persistent and a kind of long-term cache,
 # to save embedding-calculation costs and time.
+# Entries not seen for a long time (column "last_seen", schema migration 3) are deleted
+# by the optional compaction job, see document_gc.py.
 
 DB_TABLE_document =  """CREATE TABLE IF NOT EXISTS document (
                             sha256 TEXT COMMENT "sha256 hash of the document/text, also used as ID here" NOT NULL,
@@ -81,100 +99,354 @@ DB_TABLE_plob_document = """CREATE TABLE IF NOT EXISTS plob_document (
                                 row_last_modified TEXT COMMENT "timestamp of the last database row modification" NOT NULL
                             )""" # alias "document_text"
 
+# A "plob_text" represents the full text of a document of a plob before splitting.
+# Splits reference it by sha256 and character offsets,
+# so extended page contents (split + neighbor splits) are sliced from a single stored copy.
+#
+# Like "document" entries, "plob_text" entries are not deleted.
+#
+# With the text store (see text_store.py, config.common.text_store.enabled), the texts are stored
+# compressed and deduplicated in table "text_blob" instead: new "document" rows have an empty "content"
+# (the text is referenced by "sha256"), and new full texts get no "plob_text" row at all.
+# Rows written without the text store are still read (fallback).
+DB_TABLE_plob_text = """CREATE TABLE IF NOT EXISTS plob_text (
+                            sha256 TEXT COMMENT "sha256 hash of the text, also used as ID here" NOT NULL PRIMARY KEY,
+                            content TEXT COMMENT "full text of a document before splitting" NOT NULL,
+                            row_last_modified TEXT COMMENT "timestamp of the last database row modification" NOT NULL
+                        )"""
+
+#
+# Schema migrations
+#
+# Changes of the schema after the initial tables above (e.g. indexes) are applied once per database,
+# in the order of their version numbers. Applied versions are recorded in table "schema_migration".
+# New migrations are appended with the next version number - never change an already released one.
+#
+# The statements of a migration must be idempotent: some (e.g. ALTER TABLE with SQLite) are committed implicitly,
+# so a crash before the migration is recorded applies them again. ALTER TABLE ... ADD COLUMN statements
+# are skipped if the column already exists.
+#
+
+DB_TABLE_schema_migration = """CREATE TABLE IF NOT EXISTS schema_migration (
+                                   version INTEGER NOT NULL PRIMARY KEY,
+                                   description TEXT NOT NULL,
+                                   row_last_modified TEXT NOT NULL
+                               )"""
+
+DB_SCHEMA_MIGRATIONS: List[Tuple[int, str, List[str]]] = [
+    (1, "indexes for the lookups of plobs by url and their documents", [
+        "CREATE INDEX IF NOT EXISTS plob_url ON plob(url)",
+        "CREATE INDEX IF NOT EXISTS plob_document_plob_id ON plob_document(plob_id)",
+        "CREATE INDEX IF NOT EXISTS plob_document_document_sha256 ON plob_document(document_sha256)",
+    ]),
+    (2, "content-addressed, compressed text store", [
+        DB_TABLE_text_blob,
+        DB_TABLE_text_dictionary,
+    ]),
+    (3, "last-seen tracking of the cache rows, for their retention (see document_gc.py)", [
+        "ALTER TABLE document ADD COLUMN last_seen TEXT",
+        "UPDATE document SET last_seen=row_last_modified WHERE last_seen IS NULL",
+        "CREATE INDEX IF NOT EXISTS document_embedding_model_id_last_seen ON document(embedding_model_id, last_seen)",
+        "ALTER TABLE text_blob ADD COLUMN last_seen TEXT",
+        "UPDATE text_blob SET last_seen=row_last_modified WHERE last_seen IS NULL",
+        "CREATE INDEX IF NOT EXISTS text_blob_last_seen ON text_blob(last_seen)",
+    ]),
+    (4, "per-page change detection of paged documents (see page_store.py)", [
+        DB_TABLE_plob_page,
+    ]),
+]
+
+def apply_schema_migrations(sqlConnection: DBAPIConnection) -> int:
+    """
+    Apply all schema migrations not yet applied to the database.
+
+    Returns: number of applied migrations
+    """
+    cursor = sqlConnection.cursor()
+    cursor.execute(DB_TABLE_schema_migration)
+    cursor.execute("SELECT version FROM schema_migration")
+    applied_versions = {row[0] for row in cursor.fetchall()}
+
+    applied_count = 0
+    for version, description, statements in sorted(DB_SCHEMA_MIGRATIONS, key=lambda migration: migration[0]):
+        if version in applied_versions:
+            continue
+        logger.info(f"Apply SQL DB schema migration {version}: {description} ...")
+        for statement in statements:
+            if _is_addition_of_existing_column(cursor, statement):
+                logger.info(f"Skip SQL DB schema migration statement (column already exists): {statement}")
+                continue
+            cursor.execute(statement)
+        cursor.execute("INSERT INTO schema_migration (version, description, row_last_modified) VALUES (?, ?, ?)",
+                       (version, description, datetime.now(timezone.utc).isoformat()))
+        sqlConnection.commit()
+        applied_count += 1
+    cursor.close()
+
+    if applied_count > 0:
+        logger.info(f"Applied {applied_count} SQL DB schema migration(s)")
+    return applied_count
+
+
+_add_column_statement_pattern = re.compile(r"^\s*ALTER\s+TABLE\s+(\w+)\s+ADD\s+(?:COLUMN\s+)?(\w+)", re.IGNORECASE)
+
+def _is_addition_of_existing_column(cursor: DBAPICursor, statement: str) -> bool:
+    """Is the statement an ALTER TABLE ... ADD COLUMN of a column that already exists (e.g. of an interrupted migration)?"""
+    match = _add_column_statement_pattern.match(statement)
+    if not match:
+        return False
+    table, column = match.group(1), match.group(2)
+    # (portable: the column names of an empty result)
+    cursor.execute(f"SELECT * FROM {table} WHERE 1=0")
+    column_names = {description[0].lower() for description in cursor.description}
+    cursor.fetchall()
+    return column.lower() in column_names
+
+
 #
 # Helper functions
 #
-# ...?
+
+def save_plob_text_in_sqldb(sqlConnection: DBAPIConnection, sha256: str, content: str, now_timestamp: str,
+                            sqlBatchWriter: Optional[SqlBatchWriter] = None) -> bool:
+    """
+    Save the full text of a document of a plob (before splitting) in the SQL DB, if not already there.
+
+    Args:
+        sqlBatchWriter: If set, the new row is added to this writer (on the same connection).
+
+    Returns: True if the text was inserted, False if it already existed
+    """
+    if text_store_enabled:
+        return save_texts_in_sqldb(sqlConnection, {sha256: content}, now_timestamp, sqlBatchWriter) > 0
+
+    cursor = sqlConnection.cursor()
+    cursor.execute("SELECT 1 FROM plob_text WHERE sha256=?", (sha256,))
+    row = cursor.fetchone()
+    cursor.close()
+    if not row:
+        statement = """INSERT INTO plob_text (sha256, content, row_last_modified)
+                       VALUES (?, ?, ?)"""
+        if sqlBatchWriter is not None:
+            sqlBatchWriter.add(statement, (sha256, content, now_timestamp))
+        else:
+            sqlConnection.execute(statement, (sha256, content, now_timestamp))
+    return not row
+
+def get_plob_text_from_sqldb(sha256: str) -> Optional[str]:
+    """
+    Get the full text of a document of a plob (before splitting) from the SQL DB.
+
+    Returns: the text or None if not found
+    """
+    return get_texts_from_sqldb([sha256]).get(sha256)
+
+def get_texts_from_sqldb(sha256s: Iterable[str]) -> Dict[str, str]:
+    """
+    Bulk lookup of texts (splits, full texts of documents, ...) by their sha256 hash.
+    Texts are immutable (identified by their sha256), so they are cached in memory.
+
+    Returns: sha256 -> text, of the found texts
+    """
+    unique_sha256s = list(dict.fromkeys(sha256 for sha256 in sha256s if sha256))
+    text_by_sha256 = get_cached_texts(unique_sha256s)
+    missing_sha256s = [sha256 for sha256 in unique_sha256s if sha256 not in text_by_sha256]
+    if missing_sha256s:
+        setup_sql_database_if_necessary()
+        with get_sql_connection_pool().connection() as sqlCon:
+            text_by_sha256.update(_load_texts_from_sqldb(sqlCon, missing_sha256s))
+    return text_by_sha256
+
+async def aget_texts_from_sqldb(sha256s: Iterable[str]) -> Dict[str, str]:
+    """
+    Async variant of get_texts_from_sqldb(): cached texts without a thread switch,
+    the others are loaded in a worker thread.
+
+    Returns: sha256 -> text, of the found texts
+    """
+    unique_sha256s = list(dict.fromkeys(sha256 for sha256 in sha256s if sha256))
+    text_by_sha256 = get_cached_texts(unique_sha256s)
+    missing_sha256s = [sha256 for sha256 in unique_sha256s if sha256 not in text_by_sha256]
+    if missing_sha256s:
+        text_by_sha256.update(await get_async_sql_connection_pool().run(_setup_and_load_texts_from_sqldb, missing_sha256s))
+    return text_by_sha256
+
+def _setup_and_load_texts_from_sqldb(sqlConnection: DBAPIConnection, sha256s: List[str]) -> Dict[str, str]:
+    setup_sql_database_if_necessary()
+    return _load_texts_from_sqldb(sqlConnection, sha256s)
+
+def _load_texts_from_sqldb(sqlConnection: DBAPIConnection, sha256s: List[str]) -> Dict[str, str]:
+    # text store
+    text_by_sha256 = load_texts_from_sqldb(sqlConnection, sha256s)
+
+    # fallback: rows written without the text store
+    missing_sha256s = [sha256 for sha256 in sha256s if sha256 not in text_by_sha256]
+    if missing_sha256s:
+        cursor = sqlConnection.cursor()
+        for i in range(0, len(missing_sha256s), 500):
+            sha256s_batch = missing_sha256s[i:i+500]
+            placeholders = ",".join("?" * len(sha256s_batch))
+            cursor.execute(f"SELECT sha256, content FROM plob_text WHERE content<>'' AND sha256 IN ({placeholders})", sha256s_batch)
+            text_by_sha256.update({row[0]: row[1] for row in cursor.fetchall()})
+            cursor.execute(f"SELECT sha256, content FROM document WHERE content<>'' AND sha256 IN ({placeholders})", sha256s_batch)
+            for row in cursor.fetchall():
+                text_by_sha256.setdefault(row[0], row[1])
+        cursor.close()
+
+    cache_texts(text_by_sha256)
+    return text_by_sha256
 
 
 #
 # Database debugging functions
 #
+# Tables are read page by page (keyset pagination: each page continues after the key of the last row
+# of the previous page, with a short use of a pooled connection), so a table is never held in memory
+# and each page has page_size rows (plus the other rows with the same key as its last row, if the key isn't unique).
+# The generators can be consumed slowly (e.g. by a streaming HTTP response) from any thread.
+# Embeddings are only loaded if requested.
+#
+
+# default number of rows per page
+_page_size = 500
+
+def iterate_plobs_from_sqldb(page_size: int = _page_size) -> Iterator[Dict[str, Any]]:
+    """All "plob" rows, ordered by id."""
+    setup_sql_database_if_necessary()
+    last_id = None
+    while True:
+        with get_sql_connection_pool().connection() as sqlCon:
+            cur = sqlCon.cursor()
+            where, where_args = ("", ()) if last_id is None else ("WHERE id>?", (last_id,))
+            cur.execute(f"""SELECT id, url, media_type, file_path, file_size, file_sha256, file_last_modified, row_last_modified FROM plob
+                            {where} ORDER BY id LIMIT ?""", (*where_args, page_size))
+            rows = cur.fetchall()
+            cur.close()
+        for row in rows:
+            yield {
+                "id": row[0],
+                "url": row[1],
+                "media_type": row[2],
+                "file_path": row[3],
+                "file_size": row[4],
+                "file_sha256": row[5],
+                "file_last_modified": row[6],
+                "row_last_modified": row[7],
+            }
+        if len(rows) < page_size:
+            return
+        last_id = rows[-1][0]
+
+def _select_page_by_keyset(cur: DBAPICursor,
+                           table: str,
+                           columns: str,
+                           key_expressions: Tuple[str, str],
+                           last_key: Optional[Sequence[Any]],
+                           page_size: int) -> List[Tuple]:
+    """
+    Select a page of rows ordered by a two-column key, after the key of the last row of the previous page.
 
-def get_all_plobs_from_sqldb() -> List[Dict[str, Any]]:
-    # get all rows
-    sqlCon = get_sql_database_connection_after_setup()
-    cur = sqlCon.cursor()
-    cur.execute("SELECT id, url, media_type, file_path, file_size, file_sha256, file_last_modified, row_last_modified FROM plob")
+    The key doesn't need to be unique: the page ends after all rows with the key of its last row
+    (it can have more than page_size rows then), so the next page doesn't skip any of them.
+
+    Returns: the rows - the columns, followed by the two key values (last_key of the next page: rows[-1][-2:])
+    """
+    key1, key2 = key_expressions
+    select = f"SELECT {columns}, {key1}, {key2} FROM {table}"
+    where, where_args = ("", ()) if last_key is None else (f"WHERE {key1}>? OR ({key1}=? AND {key2}>?)", (last_key[0], last_key[0], last_key[1]))
+    cur.execute(f"{select} {where} ORDER BY {key1}, {key2} LIMIT ?", (*where_args, page_size))
     rows = cur.fetchall()
-    cur.close()
-
-    # map rows to document dictionaries
-    document_dicts = [{
-        "id": row[0],
-        "url": row[1],
-        "media_type": row[2],
-        "file_path": row[3],
-        "file_size": row[4],
-        "file_sha256": row[5],
-        "file_last_modified": row[6],
-        "row_last_modified": row[6],
-    } for row in rows]
-
-    return document_dicts
+    if len(rows) < page_size:
+        return rows
+    # complete the rows with the key of the last row
+    page_last_key = tuple(rows[-1][-2:])
+    rows = [row for row in rows if tuple(row[-2:]) != page_last_key]
+    cur.execute(f"{select} WHERE {key1}=? AND {key2}=?", page_last_key)
+    rows.extend(cur.fetchall())
+    return rows
 
 def print_all_plobs_from_sqldb():
     logger.info("""All "plob" rows in SQL DB:""")
-    docs = get_all_plobs_from_sqldb()
-    docs_values = [list(doc.values()) for doc in docs]
-
-    for row in docs_values:
-        logger.info("  DB row: "+str_limit(row, 200))
+    for plob in iterate_plobs_from_sqldb():
+        logger.info("  DB row: "+str_limit(list(plob.values()), 200))
     logger.info("""All "plob" rows in SQL DB - DONE""")
 
 
-def get_all_plob_documents_from_sqldb() -> List[Dict[str, Any]]:
-    # get all rows
-    sqlCon = get_sql_database_connection_after_setup()
-    cur = sqlCon.cursor()
-    cur.execute("SELECT plob_id, document_sha256, document_anker, row_last_modified FROM plob_document")
-    rows = cur.fetchall()
-    cur.close()
-
-    # map rows to document_part dictionaries
-    document_content_dicts = [{
-        "plob_id": row[0],
-        "document_sha256": row[1],
-        "document_anker": row[2],
-        "row_last_modified": row[3],
-    } for row in rows]
-
-    return document_content_dicts
+def iterate_plob_documents_from_sqldb(page_size: int = _page_size) -> Iterator[Dict[str, Any]]:
+    """All "plob_document" rows, ordered by plob_id and document_sha256."""
+    setup_sql_database_if_necessary()
+    last_key = None
+    while True:
+        with get_sql_connection_pool().connection() as sqlCon:
+            cur = sqlCon.cursor()
+            rows = _select_page_by_keyset(cur, "plob_document", "plob_id, document_sha256, document_anker, row_last_modified",
+                                          ("plob_id", "document_sha256"), last_key, page_size)
+            cur.close()
+        for row in rows:
+            yield {
+                "plob_id": row[0],
+                "document_sha256": row[1],
+                "document_anker": row[2],
+                "row_last_modified": row[3],
+            }
+        if len(rows) < page_size:
+            return
+        last_key = rows[-1][-2:]
 
 def print_all_plob_documents_from_sqldb():
     logger.info("""All "plob_document" rows in SQL DB:""")
-    doc_contents = get_all_plob_documents_from_sqldb()
-    doc_contents_values = [list(doc_part.values()) for doc_part in doc_contents]
-
-    for row in doc_contents_values:
-        logger.info("  DB row: "+str_limit(row, 200))
+    for plob_document in iterate_plob_documents_from_sqldb():
+        logger.info("  DB row: "+str_limit(list(plob_document.values()), 200))
     logger.info("""All "plob_document" rows in SQL DB - DONE""")
 
-def get_all_documents_from_sqldb() -> List[Dict[str, Any]]:
-    # get all rows
-    sqlCon = get_sql_database_connection_after_setup()
-    cur = sqlCon.cursor()
-    cur.execute("SELECT sha256, content, embedding_model_id, embedding_json, row_last_modified FROM document")
-    rows = cur.fetchall()
-    cur.close()
-    # map rows to part dictionaries
-    content_dicts = [{
-        "sha256": row[0],
-        "content": row[1],
-        "embedding_model_id": row[2],
-        "embedding_json_len": len(row[3]),
-        "row_last_modified": row[3],
-    } for row in rows]
-
-    return content_dicts
+
+def iterate_documents_from_sqldb(page_size: int = _page_size,
+                                 include_content: bool = True,
+                                 include_embedding: bool = False) -> Iterator[Dict[str, Any]]:
+    """
+    All "document" rows, ordered by sha256 and embedding_model_id.
+
+    Args:
+        include_content (bool): Include the texts (from the text store, not cached).
+        include_embedding (bool): Include the embeddings (large) - otherwise their size only.
+    """
+    setup_sql_database_if_necessary()
+    embedding_column = "embedding_json" if include_embedding else "NULL"
+    last_key = None
+    while True:
+        with get_sql_connection_pool().connection() as sqlCon:
+            cur = sqlCon.cursor()
+            # (embedding_model_id can be NULL)
+            rows = _select_page_by_keyset(cur, "document",
+                                          f"""sha256, {"content" if include_content else "NULL"}, embedding_model_id, LENGTH(embedding_json), {embedding_column},
+                                              row_last_modified, last_seen""",
+                                          ("sha256", "COALESCE(embedding_model_id, '')"), last_key, page_size)
+            cur.close()
+            text_by_sha256: Dict[str, str] = {}
+            if include_content:
+                # texts in the text store (empty "content" column)
+                text_by_sha256 = load_texts_from_sqldb(sqlCon, list(dict.fromkeys(row[0] for row in rows if not row[1])))
+        for row in rows:
+            document = {
+                "sha256": row[0],
+                "embedding_model_id": row[2],
+                "embedding_json_len": row[3],
+                "row_last_modified": row[5],
+                "last_seen": row[6],
+            }
+            if include_content:
+                document["content"] = row[1] or text_by_sha256.get(row[0])
+            if include_embedding:
+                document["embedding"] = json.loads(row[4])
+            yield document
+        if len(rows) < page_size:
+            return
+        last_key = rows[-1][-2:]
 
 def print_all_documents_from_sqldb():
     logger.info("""All "document" rows in SQL DB :""")
-    documents = get_all_documents_from_sqldb()
-    document_values = [list(document.values()) for document in documents]
-
-    for row in document_values:
-        logger.info("  DB row: "+str_limit(row, 200))
+    for document in iterate_documents_from_sqldb():
+        logger.info("  DB row: "+str_limit(list(document.values()), 200))
     logger.info("""All "document" rows in SQL DB - DONE""")
 
 def print_all_from_sqldb():
@@ -190,43 +462,47 @@ def print_all_from_sqldb():
 # basic database functions
 #
 
-def get_sql_database_connection_after_setup() -> DBAPIConnection:
-    """
-    Get the (long-term) SQL database connection, setup the tables if necessary.
+def setup_sql_database_if_necessary() -> None:
+    """Setup the tables and apply the schema migrations, once per process."""
+    global _setup_done
+    if _setup_done:
+        return
+    with _setup_lock:
+        if _setup_done:
+            return
+        with get_sql_connection_pool().connection() as sqlCon:
+            sqlCon.execute(DB_TABLE_plob)
+            sqlCon.execute(DB_TABLE_document)
+            sqlCon.execute(DB_TABLE_plob_document)
+            sqlCon.execute(DB_TABLE_plob_text)
+            sqlCon.commit()
+            apply_schema_migrations(sqlCon)
+        _setup_done = True
 
-    Returns: the SQL database connection
+def get_sql_database_connection_after_setup() -> DBAPIConnection:
     """
+    Get the (long-term) SQL database connection of the current thread, setup the tables if necessary.
 
-    global _sqlCon
-    if _sqlCon is None:
-        _sqlCon = get_sql_database_connection()
-            # see also:
-            # - https://docs.python.org/3/library/sqlite3.html#sqlite3.threadsafety
-            # - https://discuss.python.org/t/is-sqlite3-threadsafety-the-same-thing-as-sqlite3-threadsafe-from-the-c-library/11463
-
-        # setup tables if necessary
-        _sqlCon.execute(DB_TABLE_plob)
-        _sqlCon.execute(DB_TABLE_document)
-        _sqlCon.execute(DB_TABLE_plob_document)
-
-    return _sqlCon
-
-def get_2nd_sql_database_connection_after_setup() -> DBAPIConnection:
-    """
-    Get an additional SQL database connection, for short transactions.
-    Wetup the tables if necessary.
+    The connection is pinned to the current thread by the connection pool,
+    so indexing workers (in different threads) can use the SQL DB concurrently.
+    Only for long-lived threads (e.g. indexing workers): with a bounded pool, each thread keeps one of its connections
+    until it ends - short work of other threads (e.g. of search requests) uses sql_database_connection_after_setup().
 
     Returns: the SQL database connection
     """
+    setup_sql_database_if_necessary()
+    return get_sql_connection_pool().thread_connection()
 
-    # Setup tables if necessary
-    get_sql_database_connection_after_setup() 
+@contextmanager
+def sql_database_connection_after_setup() -> Iterator[DBAPIConnection]:
+    """
+    A SQL database connection for a short use (e.g. the lookups of a search request), setup the tables if necessary.
 
-    global _sqlCon2
-    if _sqlCon2 is None:
-        _sqlCon2 = get_sql_database_connection()
-            # see also:
-            # - https://docs.python.org/3/library/sqlite3.html#sqlite3.threadsafety
-            # - https://discuss.python.org/t/is-sqlite3-threadsafety-the-same-thing-as-sqlite3-threadsafe-from-the-c-library/11463
+    The connection is returned to the pool afterwards - unless it is the pinned connection of the current thread
+    (e.g. of an indexing worker), which is used then.
 
-    return _sqlCon2
+    Yields: the SQL database connection
+    """
+    setup_sql_database_if_necessary()
+    with get_sql_connection_pool().connection() as sqlConnection:
+        yield sqlConnection
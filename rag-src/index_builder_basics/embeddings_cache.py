@@ -10,8 +10,13 @@ from datetime import datetime, timezone
 from common.utils.hash_util import sha256sum_str
 from common.utils.string_util import str_limit
 from common.service.configloader import deep_get, settings
+from common.service.span_recorder import timing_span
+from common.service.metrics import Counter, Gauge
 from factory.llm_factory import get_default_embeddings
-from .document_storage_sql_database import get_2nd_sql_database_connection_after_setup
+from .document_storage_sql_database import get_sql_database_connection_after_setup, sql_database_connection_after_setup
+from .sql_batch_writer import SqlBatchWriter
+from .text_store import save_texts_in_sqldb, text_store_enabled
+from .document_gc import get_touch_cutoff_timestamp, touch_rows
 if TYPE_CHECKING:
     from _typeshed.dbapi import DBAPIConnection, DBAPICursor
 else:
@@ -27,17 +32,15 @@ logger = logging.getLogger(__name__)
 #
 
 @cache
-def get_cached_default_embeddings(sqlConnection4Embeddings: DBAPIConnection = get_2nd_sql_database_connection_after_setup()) -> Embeddings:
+def get_cached_default_embeddings() -> Embeddings:
     """Get the cache/performance-optimized default embedding model.
 
+    The embeddings are cached in the SQL DB, with a connection of the pool per call
+    (the pinned connection of the calling thread, if any).
+
     Returns:
         The cached default embedding model.
     """
-
-    global defaultSqlConnection4Embeddings
-    if sqlConnection4Embeddings is not None:
-        defaultSqlConnection4Embeddings = sqlConnection4Embeddings 
-
     return CachedEmbeddings()
 
 #
@@ -46,6 +49,17 @@ def get_cached_default_embeddings(sqlConnection4Embeddings: DBAPIConnection = ge
 
 embedding_model_id = deep_get(settings, "config.common.embedding_model_id")
 
+# result = "hit", "miss" or "no_db"
+embedding_cache_requests_counter = Counter("rag_embedding_cache_requests_total", "Number of embedding lookups in the SQL DB cache per result", ["result"])
+embedding_cache_hit_ratio_gauge = Gauge("rag_embedding_cache_hit_ratio", "Ratio of embedding cache hits to all lookups (since start)")
+
+def _get_embedding_cache_hit_ratio() -> float:
+    hits = embedding_cache_requests_counter.get(result="hit")
+    misses = embedding_cache_requests_counter.get(result="miss")
+    return hits / (hits + misses) if hits + misses > 0 else 0.0
+
+embedding_cache_hit_ratio_gauge.set_function(_get_embedding_cache_hit_ratio)
+
 class CachedEmbeddings(BaseModel, Embeddings):
     """Embedding from the configured default embedding model.
        Cached in SQL database table "content".
@@ -54,19 +68,21 @@ class CachedEmbeddings(BaseModel, Embeddings):
     def embed_documents(self, texts: List[str]) -> List[List[float]]:
         """Get the embeddings of texts from the SQL DB or calculate and save it SQL DB.
 
+        All texts not yet in the SQL DB are calculated with a single call of the embedding model.
+
         Args:
             texts: The list of texts to embed.
 
         Returns:
             List of embeddings, one for each text.
         """
-        
-        # iterate over texts
-        embeddings = []
-        for text in texts:
-            embedding = self.embed_document(text)
-            embeddings.append(embedding)
-        return embeddings
+        if len(texts) == 1:
+            return [self.embed_document(texts[0])]
+
+        # (called from arbitrary threads, e.g. executor threads of the search requests: don't pin a connection to them)
+        with sql_database_connection_after_setup() as sqlConnection:
+            sha256s_and_embeddings = get_or_caclulate_and_save_texts_sha256_and_embeddings_with_sqldb(texts, sqlConnection)
+        return [embedding for _, embedding in sha256s_and_embeddings]
 
     def embed_document(self, text: str) -> List[float]:
         """Get the embedding of a single text from the SQL DB or calculate and save it SQL DB.
@@ -79,7 +95,8 @@ class CachedEmbeddings(BaseModel, Embeddings):
         """
 
         logger.debug(f"embed_document START ...")
-        sha256, embedding = get_or_caclulate_and_save_text_sha256_and_embedding_with_sqldb(text)
+        with sql_database_connection_after_setup() as sqlConnection:
+            sha256, embedding = get_or_caclulate_and_save_text_sha256_and_embedding_with_sqldb(text, sqlConnection)
         logger.debug(f"DONE: embedding_model_id='{embedding_model_id}', sha256={sha256}, embedding_len={len(embedding)}")
 
         return embedding
@@ -93,7 +110,8 @@ class CachedEmbeddings(BaseModel, Embeddings):
         Returns:
             Embedding for the text.
         """
-        return self.embed_documents([text])[0]
+        with timing_span("query_embedding"):
+            return self.embed_documents([text])[0]
 
     async def aembed_query(self, text: str) -> List[float]:
         """Get cached embedding (async).
@@ -112,12 +130,9 @@ class CachedEmbeddings(BaseModel, Embeddings):
 # Basic functions
 #
 
-# Set global variable sqlConnection4Embeddings
-defaultSqlConnection4Embeddings: Optional[DBAPIConnection] = None
-
 def get_or_caclulate_and_save_text_sha256_and_embedding_with_sqldb(
         text: str,
-        sqlConnection4Embeddings: Optional[DBAPIConnection] = defaultSqlConnection4Embeddings
+        sqlConnection4Embeddings: Optional[DBAPIConnection] = None
         ) -> Tuple[str, List[float]]:
     """
     Get the embedding of a text from the SQL DB or calculate and save it SQL DB.
@@ -130,13 +145,14 @@ def get_or_caclulate_and_save_text_sha256_and_embedding_with_sqldb(
     content_sha256 = sha256sum_str(text)
     #logger.debug(f"content_sha256={content_sha256}, embedding_model_id='{embedding_model_id}')")
     embedding = None
-    sqlConnection = sqlConnection4Embeddings or defaultSqlConnection4Embeddings
+    sqlConnection = sqlConnection4Embeddings or get_sql_database_connection_after_setup()
 
     # Action
     try:
         # Pre-check DB
         if sqlConnection is None:
             logger.warning("sqlConnection4Embeddings is None - continue without SQL DB")
+            embedding_cache_requests_counter.inc(result="no_db")
             embeddings: Embeddings = get_default_embeddings()
             embedding = embeddings.embed_documents([text])[0]
             return content_sha256, embedding
@@ -144,17 +160,26 @@ def get_or_caclulate_and_save_text_sha256_and_embedding_with_sqldb(
 
         # Check if content is already in SQL DB
         cursor1 = sqlConnection.cursor()
-        cursor1.execute("SELECT embedding_json FROM document WHERE sha256=? AND embedding_model_id=?", (content_sha256,embedding_model_id,))
+        cursor1.execute("SELECT embedding_json, last_seen FROM document WHERE sha256=? AND embedding_model_id=?", (content_sha256,embedding_model_id,))
         row = cursor1.fetchone()
 
         if row:
             # Document is already in SQL DB: read embedding
             logger.debug(f"embedding of document already in SQL DB: sha256={content_sha256}, content={str_limit(text)}")
+            embedding_cache_requests_counter.inc(result="hit")
             embedding_json = row[0]
             embedding = json.loads(embedding_json)
+
+            # last-seen tracking (for the retention of the cache rows)
+            now = datetime.now(timezone.utc).isoformat()
+            if row[1] is None or row[1] < get_touch_cutoff_timestamp(now):
+                writer = SqlBatchWriter(sqlConnection)
+                touch_rows(writer, "document", "sha256=? AND embedding_model_id=?", [(content_sha256, embedding_model_id)], now)
+                writer.commit()
         else:
             # Document is NOT in SQL DB
             logger.debug(f"embedding of document NOT YET in SQL DB - calculate it: sha256={content_sha256}, content={str_limit(text)}")
+            embedding_cache_requests_counter.inc(result="miss")
 
             # claculate the embedding
             embeddings: Embeddings = get_default_embeddings()
@@ -164,22 +189,121 @@ def get_or_caclulate_and_save_text_sha256_and_embedding_with_sqldb(
             # save the embedding in the SQL DB
             #logger.debug(f"save embedding of document {content_sha256} in SQL DB: {embedding}")
             embedding_json = json.dumps(embedding)
-            cursor2 = sqlConnection.cursor()
             now = datetime.now(timezone.utc).isoformat()
+            if text_store_enabled:
+                save_texts_in_sqldb(sqlConnection, {content_sha256: text}, now)
+            cursor2 = sqlConnection.cursor()
             cursor2.execute(
-                """INSERT INTO document (sha256, content, embedding_model_id, embedding_json, row_last_modified)
-                             VALUES (?, ?, ?, ?, ?)""",
-                (content_sha256, text, embedding_model_id, embedding_json, now)
+                """INSERT INTO document (sha256, content, embedding_model_id, embedding_json, row_last_modified, last_seen)
+                             VALUES (?, ?, ?, ?, ?, ?)""",
+                (content_sha256, _get_document_row_content(text), embedding_model_id, embedding_json, now, now)
             )
             cursor2.close()
+            sqlConnection.commit()
             logger.debug(f"inserted document row: sha256={content_sha256}, content={str_limit(text)}, embedding_model_id={embedding_model_id} into SQL DB")
 
         # DB cleanup
         cursor1.close()
-        sqlConnection.commit()
 
         return content_sha256, embedding
 
     except Exception as e:
         logger.warning(f"content_sha256={content_sha256}, content={str_limit(text)}): {e}")
         raise e
+
+
+# max. number of sha256 values per SELECT ... IN (...)
+_select_batch_size = 500
+
+def _get_document_row_content(text: str) -> str:
+    # with the text store, the text is referenced by the sha256 of the "document" row only
+    return "" if text_store_enabled else text
+
+def get_or_caclulate_and_save_texts_sha256_and_embeddings_with_sqldb(
+        texts: List[str],
+        sqlConnection4Embeddings: Optional[DBAPIConnection] = None,
+        sqlBatchWriter: Optional[SqlBatchWriter] = None,
+        ) -> List[Tuple[str, List[float]]]:
+    """
+    Batch variant of get_or_caclulate_and_save_text_sha256_and_embedding_with_sqldb():
+    Get the embeddings of texts from the SQL DB, calculate the missing ones
+    with a single call of the embedding model and save them in the SQL DB.
+
+    Args:
+        texts: The texts.
+        sqlConnection4Embeddings: SQL DB connection, default: the connection of the writer or the connection of the current thread.
+        sqlBatchWriter: If set, the new rows are added to this writer (on the same connection)
+            and the caller is responsible for the commit. Otherwise the new rows are committed immediately.
+
+    Returns: The sha256 hash and embedding of each text (same order as texts).
+    """
+
+    # Preparation
+    content_sha256s = [sha256sum_str(text) for text in texts]
+    if sqlConnection4Embeddings is None and sqlBatchWriter is not None:
+        sqlConnection4Embeddings = sqlBatchWriter.sqlConnection
+    sqlConnection = sqlConnection4Embeddings or get_sql_database_connection_after_setup()
+    embeddings: Embeddings = get_default_embeddings()
+
+    # Pre-check DB
+    if sqlConnection is None:
+        logger.warning("sqlConnection4Embeddings is None - continue without SQL DB")
+        embedding_cache_requests_counter.inc(len(texts), result="no_db")
+        return list(zip(content_sha256s, embeddings.embed_documents(texts)))
+    # Continue with SQL DB
+
+    try:
+        # Read existing embeddings from SQL DB (incl. the pending rows of the writer)
+        if sqlBatchWriter is not None:
+            sqlBatchWriter.flush()
+        embedding_by_sha256: Dict[str, List[float]] = {}
+        touch_keys: List[Tuple[str, str]] = []
+        now = datetime.now(timezone.utc).isoformat()
+        touch_cutoff = get_touch_cutoff_timestamp(now)
+        unique_sha256s = list(dict.fromkeys(content_sha256s))
+        cursor = sqlConnection.cursor()
+        for i in range(0, len(unique_sha256s), _select_batch_size):
+            sha256s_batch = unique_sha256s[i:i+_select_batch_size]
+            placeholders = ",".join("?" * len(sha256s_batch))
+            cursor.execute(f"SELECT sha256, embedding_json, last_seen FROM document WHERE embedding_model_id=? AND sha256 IN ({placeholders})",
+                           (embedding_model_id, *sha256s_batch))
+            for row in cursor.fetchall():
+                embedding_by_sha256[row[0]] = json.loads(row[1])
+                if row[2] is None or row[2] < touch_cutoff:
+                    touch_keys.append((row[0], embedding_model_id))
+        missing_text_by_sha256: Dict[str, str] = {}
+        for content_sha256, text in zip(content_sha256s, texts):
+            if content_sha256 not in embedding_by_sha256:
+                missing_text_by_sha256[content_sha256] = text
+        embedding_cache_requests_counter.inc(len(embedding_by_sha256), result="hit")
+        embedding_cache_requests_counter.inc(len(missing_text_by_sha256), result="miss")
+        logger.debug(f"embeddings of {len(texts)} texts: {len(embedding_by_sha256)} already in SQL DB, {len(missing_text_by_sha256)} to calculate")
+
+        # last-seen tracking of the found rows (for the retention of the cache rows)
+        writer = sqlBatchWriter if sqlBatchWriter is not None else SqlBatchWriter(sqlConnection)
+        touch_rows(writer, "document", "sha256=? AND embedding_model_id=?", touch_keys, now)
+
+        # Calculate all missing embeddings at once and save them in the SQL DB
+        if missing_text_by_sha256:
+            missing_sha256s = list(missing_text_by_sha256.keys())
+            missing_embeddings = embeddings.embed_documents([missing_text_by_sha256[sha256] for sha256 in missing_sha256s])
+            if text_store_enabled:
+                save_texts_in_sqldb(sqlConnection, missing_text_by_sha256, now, writer)
+            for content_sha256, embedding in zip(missing_sha256s, missing_embeddings):
+                embedding_by_sha256[content_sha256] = embedding
+                writer.add(
+                    """INSERT INTO document (sha256, content, embedding_model_id, embedding_json, row_last_modified, last_seen)
+                                 VALUES (?, ?, ?, ?, ?, ?)""",
+                    (content_sha256, _get_document_row_content(missing_text_by_sha256[content_sha256]), embedding_model_id, json.dumps(embedding), now, now)
+                )
+        if sqlBatchWriter is None and (touch_keys or missing_text_by_sha256):
+            writer.commit()
+
+        # DB cleanup
+        cursor.close()
+
+        return [(content_sha256, embedding_by_sha256[content_sha256]) for content_sha256 in content_sha256s]
+
+    except Exception as e:
+        logger.warning(f"Batch of {len(texts)} texts: {e}")
+        raise e
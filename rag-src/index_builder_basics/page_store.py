@@ -0,0 +1,97 @@
+### Page Store (per-page change detection of paged documents, e.g. PDFs)
+
+from typing import TYPE_CHECKING
+from typing import (
+    Dict,
+    Iterable,
+)
+from dataclasses import dataclass
+if TYPE_CHECKING:
+    from _typeshed.dbapi import DBAPIConnection, DBAPICursor
+else:
+    DBAPIConnection = any
+    DBAPICursor = any
+from .sql_batch_writer import SqlBatchWriter
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+#
+# For each page of a plob parsed page by page (see loader_and_parser/pdf_page_parser.py),
+# the sha256 hash of its extracted text and the documents / parts (splits, summaries) created from it
+# in the last build are recorded in table "plob_page".
+# The next build reuses the documents of pages with an unchanged hash
+# instead of splitting, summarizing and embedding them again.
+#
+# The rows of a plob are deleted together with the old plob and recorded batch by batch with its new documents,
+# identified by the URL of the plob
+# (the plob id changes with every build).
+# The documents are stored as JSON of their metadata, their texts are referenced by sha256
+# (stored with the embeddings or in the text store anyway).
+#
+
+DB_TABLE_plob_page = """CREATE TABLE IF NOT EXISTS plob_page (
+                            plob_url TEXT COMMENT "URL or file path of the plob" NOT NULL,
+                            page_number INTEGER COMMENT "page number (1-based), also the anker 'page-<page_number>' of its documents" NOT NULL,
+                            page_sha256 TEXT COMMENT "sha256 hash of the extracted text of the page" NOT NULL,
+                            processing_signature TEXT COMMENT "settings used to split/summarize the page" NOT NULL,
+                            documents_json TEXT COMMENT "metadata of the documents / parts created from the page, texts referenced by sha256" NOT NULL,
+                            row_last_modified TEXT COMMENT "timestamp of the last database row modification" NOT NULL,
+                            PRIMARY KEY (plob_url, page_number)
+                        )"""
+
+
+@dataclass
+class PlobPage:
+    page_number: int
+    page_sha256: str
+    processing_signature: str
+    documents_json: str
+
+
+def load_plob_pages_from_sqldb(sqlConnection: DBAPIConnection, plob_url: str) -> Dict[int, PlobPage]:
+    """
+    Load the recorded pages of a plob (of the last build).
+
+    Returns: page_number -> page
+    """
+    cursor = sqlConnection.cursor()
+    cursor.execute("SELECT page_number, page_sha256, processing_signature, documents_json FROM plob_page WHERE plob_url=?", (plob_url,))
+    pages = {row[0]: PlobPage(page_number=row[0], page_sha256=row[1], processing_signature=row[2], documents_json=row[3])
+             for row in cursor.fetchall()}
+    cursor.close()
+    logger.debug(f"Loaded {len(pages)} recorded page(s) for url={plob_url}")
+    return pages
+
+
+def delete_plob_pages_from_sqldb(sqlConnection: DBAPIConnection, plob_url: str) -> int:
+    """
+    Delete the recorded pages of a plob (without commit).
+
+    Returns: number of deleted rows
+    """
+    cursor = sqlConnection.cursor()
+    cursor.execute("DELETE FROM plob_page WHERE plob_url=?", (plob_url,))
+    rowcount = cursor.rowcount
+    cursor.close()
+    logger.debug(f"Deleted {rowcount} row(s) for url={plob_url} from 'plob_page' table")
+    return rowcount
+
+
+def save_plob_pages_in_sqldb(sqlBatchWriter: SqlBatchWriter, plob_url: str, pages: Iterable[PlobPage], now_timestamp: str) -> int:
+    """
+    Record the pages of a plob (with the writer, without commit) - after delete_plob_pages_from_sqldb().
+
+    Returns: number of recorded pages
+    """
+    count = 0
+    for page in pages:
+        sqlBatchWriter.add(
+            """INSERT INTO plob_page (plob_url, page_number, page_sha256, processing_signature, documents_json, row_last_modified)
+               VALUES (?, ?, ?, ?, ?, ?)""",
+            (plob_url, page.page_number, page.page_sha256, page.processing_signature, page.documents_json, now_timestamp)
+        )
+        count += 1
+    logger.debug(f"Recorded {count} page(s) for url={plob_url} in 'plob_page' table")
+    return count
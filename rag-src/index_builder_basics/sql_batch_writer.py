@@ -0,0 +1,92 @@
+from typing import TYPE_CHECKING
+from typing import (
+    Dict,
+    List,
+    Sequence,
+)
+if TYPE_CHECKING:
+    from _typeshed.dbapi import DBAPIConnection, DBAPICursor
+else:
+    DBAPIConnection = any
+    DBAPICursor = any
+from common.service.configloader import deep_get, settings
+from common.service.metrics import Counter
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+sql_write_batch_size = deep_get(settings, "config.rag_indexing.sql_write_batch_size", default_value=500)
+
+sql_batch_writer_rows_counter = Counter("rag_sql_batch_writer_rows_total", "Number of rows written by SQL batch writers")
+sql_batch_writer_commits_counter = Counter("rag_sql_batch_writer_commits_total", "Number of commits of SQL batch writers")
+
+
+#
+# Batched SQL writes (within one transaction).
+#
+# Rows are accumulated per statement and written with executemany() when the batch is full,
+# or at the latest by flush()/commit().
+#
+# Durability contract:
+# - rows added to the writer are NOT visible to other connections and NOT durable
+#   before commit() (flush() makes them visible to the same connection only)
+# - commit() writes all pending rows and commits the transaction of the connection,
+#   i.e. all rows of the writer (and all other uncommitted changes of the connection) become durable together
+# - rollback() discards all pending rows and rolls back the transaction
+#
+
+class SqlBatchWriter:
+    def __init__(self, sqlConnection: DBAPIConnection, batch_size: int = sql_write_batch_size):
+        """
+        Args:
+            sqlConnection: SQL DB connection, with its own transaction
+            batch_size (int): Max. number of pending rows before they are written with executemany()
+        """
+        self.sqlConnection = sqlConnection
+        self.batch_size = max(1, batch_size)
+        # statement -> pending rows (dicts keep the order in which the statements were added first)
+        self._pending_rows: Dict[str, List[Sequence]] = {}
+        self._pending_count = 0
+
+    def add(self, statement: str, row: Sequence) -> None:
+        """Add a row for an INSERT/UPDATE/DELETE statement, written at the latest by flush() or commit()."""
+        self._pending_rows.setdefault(statement, []).append(row)
+        self._pending_count += 1
+        if self._pending_count >= self.batch_size:
+            self.flush()
+
+    def flush(self) -> int:
+        """
+        Write all pending rows (without commit).
+
+        Returns: number of written rows
+        """
+        if self._pending_count == 0:
+            return 0
+        pending_rows = self._pending_rows
+        written_count = self._pending_count
+        self._pending_rows = {}
+        self._pending_count = 0
+
+        cursor = self.sqlConnection.cursor()
+        try:
+            for statement, rows in pending_rows.items():
+                cursor.executemany(statement, rows)
+        finally:
+            cursor.close()
+        sql_batch_writer_rows_counter.inc(written_count)
+        logger.debug(f"Flushed {written_count} row(s) of {len(pending_rows)} statement(s)")
+        return written_count
+
+    def commit(self) -> None:
+        """Write all pending rows and commit the transaction."""
+        self.flush()
+        self.sqlConnection.commit()
+        sql_batch_writer_commits_counter.inc()
+
+    def rollback(self) -> None:
+        """Discard all pending rows and roll back the transaction."""
+        self._pending_rows = {}
+        self._pending_count = 0
+        self.sqlConnection.rollback()
@@ -0,0 +1,440 @@
+### Content-addressed Text Store
+
+from typing import TYPE_CHECKING
+from typing import (
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Tuple,
+)
+from collections import Counter as CollectionsCounter
+from datetime import datetime, timezone
+import hashlib
+import threading
+import zlib
+if TYPE_CHECKING:
+    from _typeshed.dbapi import DBAPIConnection, DBAPICursor
+else:
+    DBAPIConnection = any
+    DBAPICursor = any
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+from common.service.configloader import deep_get, settings
+from common.service.metrics import Counter
+from common.utils.hash_util import sha256sum_str
+from common.utils.ttl_cache import TtlCache
+from .sql_batch_writer import SqlBatchWriter
+from .document_gc import get_touch_cutoff_timestamp, touch_rows
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+#
+# Content-addressed, compressed text store.
+#
+# Each distinct text (a split, the full text of a document before splitting, ...) is stored only once
+# in table "text_blob", compressed and identified by the sha256 hash of the text.
+# SQL rows and vectorstore properties reference the texts by this hash only
+# (document.sha256, plob_text_sha256, page_content_sha256).
+#
+# Codecs: "zstd" (requires package zstandard), "zlib", "none" (small or incompressible texts).
+# Optionally, texts are compressed with a shared dictionary (table "text_dictionary", trained from stored texts),
+# which improves the compression of short texts a lot.
+# Each row records its codec and dictionary, so configuration changes never make stored rows unreadable.
+#
+
+text_store_enabled = deep_get(settings, "config.common.text_store.enabled", default_value=True)
+text_store_codec = deep_get(settings, "config.common.text_store.codec", default_value="zstd")
+text_store_level = deep_get(settings, "config.common.text_store.level", default_value=None)
+text_store_min_size_bytes = deep_get(settings, "config.common.text_store.min_size_bytes", default_value=64)
+text_store_cache_max_texts = deep_get(settings, "config.common.text_store.cache_max_texts", default_value=10000)
+text_store_cache_ttl_seconds = deep_get(settings, "config.common.text_store.cache_ttl_seconds", default_value=3600)
+text_store_dictionary_enabled = deep_get(settings, "config.common.text_store.dictionary.enabled", default_value=False)
+text_store_dictionary_size_bytes = deep_get(settings, "config.common.text_store.dictionary.size_bytes", default_value=64*1024)
+text_store_dictionary_train_min_texts = deep_get(settings, "config.common.text_store.dictionary.train_min_texts", default_value=1000)
+text_store_dictionary_train_max_texts = deep_get(settings, "config.common.text_store.dictionary.train_max_texts", default_value=10000)
+
+CODEC_NONE = "none"
+CODEC_ZLIB = "zlib"
+CODEC_ZSTD = "zstd"
+
+# zlib uses at most the last 32 KiB of a (preset) dictionary
+_ZLIB_MAX_DICTIONARY_SIZE = 32*1024
+
+# max. number of sha256 values per SELECT ... IN (...)
+_select_batch_size = 500
+
+# result = "hit" (in-memory cache), "loaded" (from SQL DB) or "not_found"
+text_store_lookups_counter = Counter("rag_text_store_lookups_total", "Number of text lookups in the text store per result", ["result"])
+# kind = "raw" (UTF-8 size of the texts) or "stored" (size after compression)
+text_store_bytes_counter = Counter("rag_text_store_bytes_written_total", "Number of bytes of new texts written to the text store", ["kind"])
+
+
+DB_TABLE_text_blob = """CREATE TABLE IF NOT EXISTS text_blob (
+                            sha256 TEXT COMMENT "sha256 hash of the (uncompressed) text, also used as ID here" NOT NULL PRIMARY KEY,
+                            codec TEXT COMMENT "none, zlib or zstd" NOT NULL,
+                            dictionary_id TEXT COMMENT "text_dictionary used for the compression, if any",
+                            raw_size INTEGER COMMENT "size of the UTF-8 encoded text in bytes" NOT NULL,
+                            data BLOB COMMENT "compressed UTF-8 encoded text" NOT NULL,
+                            row_last_modified TEXT COMMENT "timestamp of the last database row modification" NOT NULL
+                        )"""
+
+DB_TABLE_text_dictionary = """CREATE TABLE IF NOT EXISTS text_dictionary (
+                                  id TEXT COMMENT "sha256 hash of the dictionary data" NOT NULL PRIMARY KEY,
+                                  codec TEXT COMMENT "zlib or zstd" NOT NULL,
+                                  data BLOB NOT NULL,
+                                  row_last_modified TEXT COMMENT "timestamp of the last database row modification" NOT NULL
+                              )"""
+
+
+#
+# Compression
+#
+
+class TextCodec:
+    """
+    Compression and decompression of texts (thread-safe).
+    """
+
+    def __init__(self, codec: str = text_store_codec, level: Optional[int] = text_store_level, min_size_bytes: int = text_store_min_size_bytes):
+        """
+        Args:
+            codec (str): Codec for new texts: "zstd", "zlib" or "none". "zstd" falls back to "zlib" if package zstandard is not installed.
+            level (int): Compression level, None for the default of the codec.
+            min_size_bytes (int): Smaller texts are stored uncompressed.
+        """
+        if codec == CODEC_ZSTD and zstandard is None:
+            logger.warning("config.common.text_store.codec=zstd, but package 'zstandard' is not installed - use zlib instead")
+            codec = CODEC_ZLIB
+        if codec not in (CODEC_NONE, CODEC_ZLIB, CODEC_ZSTD):
+            raise ValueError(f"Unknown text store codec: {codec}")
+        self.codec = codec
+        self.level = level
+        self.min_size_bytes = min_size_bytes
+        # dictionary used to compress new texts: (id, data)
+        self._active_dictionary: Optional[Tuple[str, bytes]] = None
+        # all known dictionaries, for the decompression: id -> data
+        self._dictionaries: Dict[str, bytes] = {}
+        self._zstd_dictionaries: Dict[str, "zstandard.ZstdCompressionDict"] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def active_dictionary_id(self) -> Optional[str]:
+        return self._active_dictionary[0] if self._active_dictionary else None
+
+    def set_active_dictionary(self, dictionary_id: str, data: bytes) -> None:
+        """Compress new texts with this dictionary (of the codec of this instance)."""
+        self.add_dictionary(dictionary_id, data)
+        self._active_dictionary = (dictionary_id, data)
+
+    def add_dictionary(self, dictionary_id: str, data: bytes) -> None:
+        with self._lock:
+            self._dictionaries[dictionary_id] = data
+
+    def has_dictionary(self, dictionary_id: str) -> bool:
+        return dictionary_id in self._dictionaries
+
+    def compress(self, text: str) -> Tuple[str, Optional[str], bytes]:
+        """
+        Compress a text.
+
+        Returns: codec, dictionary id (or None), compressed data
+        """
+        raw = text.encode("utf-8")
+        if self.codec == CODEC_NONE or len(raw) < self.min_size_bytes:
+            return CODEC_NONE, None, raw
+
+        dictionary_id, dictionary_data = self._active_dictionary or (None, None)
+        if self.codec == CODEC_ZSTD:
+            level = self.level if self.level is not None else 3
+            if dictionary_id:
+                compressor = zstandard.ZstdCompressor(level=level, dict_data=self._get_zstd_dictionary(dictionary_id))
+            else:
+                compressor = zstandard.ZstdCompressor(level=level)
+            data = compressor.compress(raw)
+        else:
+            level = self.level if self.level is not None else 6
+            if dictionary_id:
+                compressor = zlib.compressobj(level=level, zdict=dictionary_data)
+            else:
+                compressor = zlib.compressobj(level=level)
+            data = compressor.compress(raw) + compressor.flush()
+
+        if len(data) >= len(raw):
+            # incompressible
+            return CODEC_NONE, None, raw
+        return self.codec, dictionary_id, data
+
+    def decompress(self, codec: str, dictionary_id: Optional[str], data: bytes) -> str:
+        """Decompress a text, the dictionary (if any) must be known, see add_dictionary()."""
+        data = bytes(data)
+        if codec == CODEC_NONE:
+            raw = data
+        elif codec == CODEC_ZSTD:
+            if zstandard is None:
+                raise ValueError("Text is compressed with zstd, but package 'zstandard' is not installed")
+            if dictionary_id:
+                decompressor = zstandard.ZstdDecompressor(dict_data=self._get_zstd_dictionary(dictionary_id))
+            else:
+                decompressor = zstandard.ZstdDecompressor()
+            raw = decompressor.decompress(data)
+        elif codec == CODEC_ZLIB:
+            if dictionary_id:
+                decompressor = zlib.decompressobj(zdict=self._dictionaries[dictionary_id])
+            else:
+                decompressor = zlib.decompressobj()
+            raw = decompressor.decompress(data) + decompressor.flush()
+        else:
+            raise ValueError(f"Unknown text store codec: {codec}")
+        return raw.decode("utf-8")
+
+    def _get_zstd_dictionary(self, dictionary_id: str) -> "zstandard.ZstdCompressionDict":
+        with self._lock:
+            zstd_dictionary = self._zstd_dictionaries.get(dictionary_id)
+            if zstd_dictionary is None:
+                zstd_dictionary = zstandard.ZstdCompressionDict(self._dictionaries[dictionary_id])
+                self._zstd_dictionaries[dictionary_id] = zstd_dictionary
+            return zstd_dictionary
+
+
+_codec = TextCodec()
+_active_dictionary_loaded = False
+_dictionary_lock = threading.Lock()
+
+
+def get_text_codec() -> TextCodec:
+    return _codec
+
+
+#
+# Saving texts
+#
+
+def save_texts_in_sqldb(sqlConnection: DBAPIConnection,
+                        text_by_sha256: Dict[str, str],
+                        now_timestamp: str,
+                        sqlBatchWriter: Optional[SqlBatchWriter] = None) -> int:
+    """
+    Save texts in the text store, if not already there.
+
+    Args:
+        sqlConnection: SQL DB connection (of the writer, if set)
+        text_by_sha256: sha256 hash of the text -> text
+        sqlBatchWriter: If set, the new rows are added to this writer and the caller is responsible for the commit.
+            Otherwise the new rows are written with the connection, without commit.
+
+    Returns: number of new texts
+    """
+    if not text_by_sha256:
+        return 0
+    _load_active_dictionary_if_necessary(sqlConnection)
+
+    # Already stored? (incl. the pending rows of the writer)
+    if sqlBatchWriter is not None:
+        sqlBatchWriter.flush()
+    existing_sha256s = set()
+    touch_sha256s = []
+    touch_cutoff = get_touch_cutoff_timestamp(now_timestamp)
+    sha256s = list(text_by_sha256.keys())
+    cursor = sqlConnection.cursor()
+    for i in range(0, len(sha256s), _select_batch_size):
+        sha256s_batch = sha256s[i:i+_select_batch_size]
+        placeholders = ",".join("?" * len(sha256s_batch))
+        cursor.execute(f"SELECT sha256, last_seen FROM text_blob WHERE sha256 IN ({placeholders})", sha256s_batch)
+        for sha256, last_seen in cursor.fetchall():
+            existing_sha256s.add(sha256)
+            if last_seen is None or last_seen < touch_cutoff:
+                touch_sha256s.append((sha256,))
+    cursor.close()
+
+    # Compress and save the new texts, touch the existing ones
+    writer = sqlBatchWriter if sqlBatchWriter is not None else SqlBatchWriter(sqlConnection)
+    touch_rows(writer, "text_blob", "sha256=?", touch_sha256s, now_timestamp)
+    new_count = 0
+    for sha256, text in text_by_sha256.items():
+        if sha256 in existing_sha256s:
+            continue
+        codec, dictionary_id, data = _codec.compress(text)
+        raw_size = len(text.encode("utf-8"))
+        writer.add(
+            """INSERT INTO text_blob (sha256, codec, dictionary_id, raw_size, data, row_last_modified, last_seen)
+               VALUES (?, ?, ?, ?, ?, ?, ?)""",
+            (sha256, codec, dictionary_id, raw_size, data, now_timestamp, now_timestamp)
+        )
+        text_store_bytes_counter.inc(raw_size, kind="raw")
+        text_store_bytes_counter.inc(len(data), kind="stored")
+        new_count += 1
+    if sqlBatchWriter is None:
+        writer.flush()
+
+    logger.debug(f"Text store: {new_count} new of {len(text_by_sha256)} text(s)")
+    return new_count
+
+
+def save_text_in_sqldb(sqlConnection: DBAPIConnection, text: str, now_timestamp: str,
+                       sqlBatchWriter: Optional[SqlBatchWriter] = None) -> str:
+    """
+    Save a single text in the text store, if not already there.
+
+    Returns: sha256 hash of the text
+    """
+    sha256 = sha256sum_str(text)
+    save_texts_in_sqldb(sqlConnection, {sha256: text}, now_timestamp, sqlBatchWriter)
+    return sha256
+
+
+#
+# Loading texts
+#
+
+_text_cache: TtlCache[str] = TtlCache(ttl_seconds=text_store_cache_ttl_seconds, maxsize=text_store_cache_max_texts)
+_text_cache_lock = threading.Lock()
+
+
+def get_cached_texts(sha256s: Iterable[str]) -> Dict[str, str]:
+    """Texts found in the in-memory cache: sha256 -> text (without SQL DB access)."""
+    result: Dict[str, str] = {}
+    with _text_cache_lock:
+        for sha256 in sha256s:
+            text = _text_cache.get(sha256)
+            if text is not None:
+                result[sha256] = text
+    text_store_lookups_counter.inc(len(result), result="hit")
+    return result
+
+
+def cache_texts(text_by_sha256: Dict[str, str]) -> None:
+    """Add texts to the in-memory cache (texts are immutable, identified by their sha256 hash)."""
+    with _text_cache_lock:
+        for sha256, text in text_by_sha256.items():
+            _text_cache.put(sha256, text)
+
+
+def load_texts_from_sqldb(sqlConnection: DBAPIConnection, sha256s: List[str]) -> Dict[str, str]:
+    """
+    Load texts from the text store (without the in-memory cache).
+
+    Returns: sha256 -> text, of the found texts
+    """
+    rows = []
+    cursor = sqlConnection.cursor()
+    for i in range(0, len(sha256s), _select_batch_size):
+        sha256s_batch = sha256s[i:i+_select_batch_size]
+        placeholders = ",".join("?" * len(sha256s_batch))
+        cursor.execute(f"SELECT sha256, codec, dictionary_id, data FROM text_blob WHERE sha256 IN ({placeholders})", sha256s_batch)
+        rows.extend(cursor.fetchall())
+    cursor.close()
+
+    text_by_sha256: Dict[str, str] = {}
+    for sha256, codec, dictionary_id, data in rows:
+        if dictionary_id and not _codec.has_dictionary(dictionary_id):
+            _load_dictionary(sqlConnection, dictionary_id)
+        text_by_sha256[sha256] = _codec.decompress(codec, dictionary_id, data)
+    text_store_lookups_counter.inc(len(text_by_sha256), result="loaded")
+    text_store_lookups_counter.inc(len(sha256s) - len(text_by_sha256), result="not_found")
+    return text_by_sha256
+
+
+#
+# Shared dictionaries
+#
+
+def train_text_dictionary_if_necessary(sqlConnection: DBAPIConnection) -> Optional[str]:
+    """
+    Train a shared compression dictionary from the stored texts and use it for new texts,
+    if enabled and there is no dictionary for the configured codec yet. Commits the new dictionary.
+
+    Call it without pending changes on the connection, e.g. at the end of an indexing run.
+
+    Returns: id of the new dictionary, or None if no dictionary was trained
+    """
+    if not text_store_enabled or not text_store_dictionary_enabled or _codec.codec == CODEC_NONE:
+        return None
+    _load_active_dictionary_if_necessary(sqlConnection)
+    if _codec.active_dictionary_id is not None:
+        return None
+
+    with _dictionary_lock:
+        cursor = sqlConnection.cursor()
+        cursor.execute("SELECT COUNT(*) FROM text_blob")
+        text_count = cursor.fetchone()[0]
+        if text_count < text_store_dictionary_train_min_texts:
+            cursor.close()
+            logger.debug(f"Text store: only {text_count} text(s) stored, {text_store_dictionary_train_min_texts} required to train a dictionary")
+            return None
+        cursor.execute("SELECT sha256 FROM text_blob ORDER BY row_last_modified DESC LIMIT ?", (text_store_dictionary_train_max_texts,))
+        sample_sha256s = [row[0] for row in cursor.fetchall()]
+        cursor.close()
+        samples = list(load_texts_from_sqldb(sqlConnection, sample_sha256s).values())
+
+        logger.info(f"Text store: train {_codec.codec} dictionary from {len(samples)} text(s) ...")
+        if _codec.codec == CODEC_ZSTD:
+            dictionary_data = zstandard.train_dictionary(text_store_dictionary_size_bytes, [sample.encode("utf-8") for sample in samples]).as_bytes()
+        else:
+            dictionary_data = _build_zlib_dictionary(samples, min(text_store_dictionary_size_bytes, _ZLIB_MAX_DICTIONARY_SIZE))
+        if not dictionary_data:
+            logger.warning("Text store: no dictionary trained")
+            return None
+        dictionary_id = hashlib.sha256(dictionary_data).hexdigest()
+        sqlConnection.execute(
+            "INSERT INTO text_dictionary (id, codec, data, row_last_modified) VALUES (?, ?, ?, ?)",
+            (dictionary_id, _codec.codec, dictionary_data, datetime.now(timezone.utc).isoformat())
+        )
+        sqlConnection.commit()
+        _codec.set_active_dictionary(dictionary_id, dictionary_data)
+        logger.info(f"Text store: use new {_codec.codec} dictionary {dictionary_id} ({len(dictionary_data)} bytes)")
+        return dictionary_id
+
+
+def _build_zlib_dictionary(samples: List[str], size_bytes: int) -> bytes:
+    """
+    A preset dictionary for zlib (which has no trainer): lines that occur in several texts,
+    the most frequent ones at the end (zlib finds matches at short distances cheaper).
+    """
+    line_counts = CollectionsCounter()
+    for sample in samples:
+        line_counts.update(set(line.strip() for line in sample.splitlines() if len(line.strip()) >= 8))
+    dictionary_lines: List[bytes] = []
+    size = 0
+    for line, count in line_counts.most_common():
+        if count < 2:
+            break
+        encoded_line = line.encode("utf-8") + b"\n"
+        if size + len(encoded_line) > size_bytes:
+            break
+        dictionary_lines.append(encoded_line)
+        size += len(encoded_line)
+    return b"".join(reversed(dictionary_lines))
+
+
+def _load_active_dictionary_if_necessary(sqlConnection: DBAPIConnection) -> None:
+    """Use the newest stored dictionary of the configured codec for new texts (once per process)."""
+    global _active_dictionary_loaded
+    if _active_dictionary_loaded:
+        return
+    with _dictionary_lock:
+        if _active_dictionary_loaded:
+            return
+        if text_store_dictionary_enabled and _codec.codec != CODEC_NONE:
+            cursor = sqlConnection.cursor()
+            cursor.execute("SELECT id, data FROM text_dictionary WHERE codec=? ORDER BY row_last_modified DESC LIMIT 1", (_codec.codec,))
+            row = cursor.fetchone()
+            cursor.close()
+            if row:
+                _codec.set_active_dictionary(row[0], bytes(row[1]))
+                logger.info(f"Text store: use {_codec.codec} dictionary {row[0]}")
+        _active_dictionary_loaded = True
+
+
+def _load_dictionary(sqlConnection: DBAPIConnection, dictionary_id: str) -> None:
+    cursor = sqlConnection.cursor()
+    cursor.execute("SELECT data FROM text_dictionary WHERE id=?", (dictionary_id,))
+    row = cursor.fetchone()
+    cursor.close()
+    if not row:
+        raise KeyError(f"Text store: dictionary {dictionary_id} not found")
+    _codec.add_dictionary(dictionary_id, bytes(row[0]))
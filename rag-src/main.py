@@ -1,13 +1,17 @@
 import logging
+import multiprocessing
 from common.service.configloader import settings, deep_get
 from common.service.logging_setup import setup_logging
 
 from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
 #from fastapi.staticfiles import StaticFiles
 from api import retrieval_search_api_endpoints_main
 #from api import rag_chat_endpoints
-#from api import admin_api_endpoints
+from api import admin_api_endpoints
 from index_builder_and_retrieval_search_service import build_index
+from common.service.metrics import render_metrics, CONTENT_TYPE_LATEST
+from factory.llm_health import get_llm_health_service
 
 logger = logging.getLogger(__name__)
 
@@ -16,7 +20,9 @@ setup_logging()
 
 
 # start building the index
-build_index.start_indexing()
+# (only in the main process: the worker processes of the process pool stage import this module again)
+if multiprocessing.parent_process() is None:
+    build_index.start_indexing()
 
 # start server with API
 app = FastAPI()
@@ -28,7 +34,13 @@ def get_hello():
 @app.get("/health")
 # https://stackoverflow.com/questions/46949108/spec-for-http-health-checks/47119512#47119512
 def get_health():
-    return {"status": "healthy", "message": "AI RAG API is running"}
+    # cached per-model states only, no probing here
+    return {"status": "healthy", "message": "AI RAG API is running", "llm": get_llm_health_service().get_cached_states()}
+
+@app.get("/metrics", response_class=PlainTextResponse)
+# Prometheus text exposition format
+def get_metrics():
+    return PlainTextResponse(render_metrics(), media_type=CONTENT_TYPE_LATEST)
 
 # /search/*  (SearxNG API compatible)
 app.include_router(retrieval_search_api_endpoints_main.router)
@@ -36,8 +48,9 @@ app.include_router(retrieval_search_api_endpoints_main.router)
 # /api/*     (Ollama / Open AI compatible)
 #app.include_router(rag_chat_endpoints.router)
 
-# /admin/*
-#app.include_router(admin_api_endpoints.router)
+# /admin/*   (streamed database dumps - only if enabled)
+if deep_get(settings, "config.common.admin_api_enabled", default_value=False):
+    app.include_router(admin_api_endpoints.router)
 
 # /* for static files - the request are processed IN THE ORDER the mounts are defined here
 #app.mount("/chat", StaticFiles(directory="static_chat",html = True))
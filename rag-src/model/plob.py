@@ -30,6 +30,12 @@ class Plob(BaseMedia):
 
     # documents of the plob:
     documents: List[Document] = None
+    # parts of each document of the plob (same order as documents),
+    # if already split (by the process pool stage), otherwise None:
+    document_splits: Optional[List[List[Document]]] = None
+    # True if documents is streamed (re-iterable, parsed with each iteration, e.g. page by page),
+    # see StreamedBlobDocuments in loader_and_parser/default_blob_parsers.py:
+    documents_streamed: bool = False
 
     # def __init__(
     #     self,
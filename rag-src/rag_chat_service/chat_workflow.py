@@ -19,7 +19,6 @@ from langchain_core.messages.system import SystemMessage
 from langgraph.graph import END, StateGraph, START
 from factory.llm_factory import get_default_chat_llm_with_streaming, get_default_chat_llm_without_streaming
 from rag_chat_service.chat_workflow_tools import Question, enrich_questions_with_retrieved_documents
-from rag_chat_service.chat_workflow_tools import default_llm_with_streaming, default_llm_without_streaming
 
 import logging
                            
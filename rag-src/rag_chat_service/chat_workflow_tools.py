@@ -10,7 +10,6 @@ from async_lru import alru_cache
 from langchain.schema import Document
 
 from langchain import hub
-from langchain_openai import ChatOpenAI
 from langchain_core.runnables import RunnableConfig
 from langchain_core.messages import AnyMessage
 from index_builder_and_retrieval_search_service import document_retrieval
@@ -50,14 +49,6 @@ class Question:
         self.enriched_content = enriched_content
 
 
-#
-# Initial setup
-#
-
-default_llm_with_streaming = ChatOpenAI(model_name="gpt-4o", temperature=0, streaming=True)
-default_llm_without_streaming = ChatOpenAI(model_name="gpt-4o", temperature=0, streaming=False)
-
-
 #
 # Functions used by the chat workflow
 #